@@ -1,14 +1,117 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context, g
+from flask.json.provider import DefaultJSONProvider
 from database import DatabendClient, LogRepository, MetricsRepository, QueryRepository
+from cache import result_cache, note_result_etag
+from conditional import json_response, compress_response
+from fanout import fanout_executor
+from histogram import histogram_cache
+from patterns import pattern_cache
+from jobs import job_manager, JobLimitExceeded, job_filters
+from tail import LogTail, limited_stream, parse_since
+from sessions import ConnectionRegistry
+from shared_state import shared_store
+import rollup
+import metrics_snapshot
+import cancellation
+import timings
+import telemetry
+import time
+from export import EXPORT_FORMATS, EXPORT_MAX_CONCURRENT, export_slots, resolve_export_request, stream_export
 import os
 import argparse
+import importlib.util
+import sys
+import threading
 import json
 from urllib.parse import urlparse
 import uuid
 import secrets
 
+class TimedJSONProvider(DefaultJSONProvider):
+    """Records response serialization as its own request phase"""
+    def response(self, *args, **kwargs):
+        with timings.phase('serialize'):
+            return super().response(*args, **kwargs)
+
+# Generated secret key, kept so sessions stay valid across worker processes and restarts
+SECRET_KEY_FILE = os.path.join(os.path.dirname(__file__), '.secret_key')
+
+def load_secret_key():
+    """SECRET_KEY from the environment, else the key in SECRET_KEY_FILE, created on first start"""
+    if os.environ.get('SECRET_KEY'):
+        return os.environ['SECRET_KEY']
+    try:
+        if not os.path.exists(SECRET_KEY_FILE):
+            temp_path = f"{SECRET_KEY_FILE}.{os.getpid()}"
+            with open(os.open(temp_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600), 'w') as f:
+                f.write(secrets.token_hex(32))
+            try:
+                # Linking fails if another worker got there first, and readers never see a partial key
+                os.link(temp_path, SECRET_KEY_FILE)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(temp_path)
+        with open(SECRET_KEY_FILE) as f:
+            return f.read().strip()
+    except OSError as e:
+        print(f"⚠️ Could not keep a secret key in {SECRET_KEY_FILE}, sessions end with the process: {e}")
+        return secrets.token_hex(32)
+
 app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
+app.json = TimedJSONProvider(app)
+app.secret_key = load_secret_key()
+
+@app.before_request
+def start_request_timings():
+    # Worker threads are reused, so every request starts from a clean slate
+    if request.path.startswith('/api/'):
+        # Group by route pattern so /api/parts/<token> is one entry, not one per token
+        timings.begin_request(request.method, request.url_rule.rule if request.url_rule else request.path)
+    else:
+        timings.end_request()
+
+@app.before_request
+def start_query_context():
+    # Tags the request's Databend queries; a tab's newer request supersedes its older one on the route
+    if request.path.startswith('/api/') and request.url_rule:
+        cancellation.begin_request(get_session_id(), request.headers.get('X-BendDash-Tab'), request.url_rule.rule,
+                                   request.get_data() + request.query_string)
+    else:
+        cancellation.end_request()
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    # The etag of a cached result only applies to the request that looked it up
+    note_result_etag(None)
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Unmatched paths share one label to keep the series count bounded
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        telemetry.observe_http_request(route, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+@app.after_request
+def finish_request_timings(response):
+    request_timings = timings.current()
+    if request_timings is None or request.path == '/api/debug/timings':
+        return response
+    total = request_timings.elapsed()
+    response.headers['Server-Timing'] = request_timings.server_timing(total)
+    timings.timings_buffer.add(request_timings.to_dict(response.status_code, total))
+    timings.end_request()
+    return response
+
+# Registered last so it runs first and its cost shows up in Server-Timing
+@app.after_request
+def compress_api_response(response):
+    if request.path.startswith('/api/'):
+        return compress_response(response)
+    return response
 
 # Global variables for database components (when using global mode)
 global_db_client = None
@@ -17,8 +120,19 @@ global_metrics_repo = None
 global_query_repo = None
 global_connection_status = {"connected": False, "error": None, "dsn_masked": None}
 
-# Session-based connections storage
-session_connections = {}
+# Modification time of the DSN config file the global connection was loaded from
+global_dsn_mtime = None
+global_dsn_lock = threading.Lock()
+
+# Session-based connections, one shared client per DSN; known to every worker through the shared store
+session_connections = ConnectionRegistry(store=shared_store)
+
+telemetry.registry.register(telemetry.Gauge(
+    'benddash_session_connections', 'Sessions holding their own Databend connection.',
+    callback=session_connections.session_count))
+telemetry.registry.register(telemetry.Gauge(
+    'benddash_session_clients', 'Distinct Databend clients shared by session connections.',
+    callback=session_connections.client_count))
 
 # DSN configuration file path
 DSN_CONFIG_FILE = os.path.join(os.path.dirname(__file__), '.dsn_config.json')
@@ -57,10 +171,15 @@ def mask_dsn(dsn):
 
 def save_dsn_config(dsn):
     """Save DSN configuration to file (only for global mode)"""
+    global global_dsn_mtime
     try:
         config = {'dsn': dsn}
-        with open(DSN_CONFIG_FILE, 'w') as f:
+        # Written aside and renamed, so other workers never load half a file
+        temp_path = f"{DSN_CONFIG_FILE}.{os.getpid()}"
+        with open(temp_path, 'w') as f:
             json.dump(config, f)
+        os.replace(temp_path, DSN_CONFIG_FILE)
+        global_dsn_mtime = os.stat(DSN_CONFIG_FILE).st_mtime
     except Exception as e:
         print(f"Failed to save DSN config: {e}")
 
@@ -75,11 +194,34 @@ def load_dsn_config():
         print(f"Failed to load DSN config: {e}")
     return None
 
+def refresh_global_database():
+    """Connect to the saved global DSN when it changed since this process last loaded it,
+    e.g. because another worker process saved a new one"""
+    global global_dsn_mtime
+    try:
+        mtime = os.stat(DSN_CONFIG_FILE).st_mtime
+    except OSError:
+        return None
+    if mtime == global_dsn_mtime:
+        return None
+    with global_dsn_lock:
+        if mtime == global_dsn_mtime:
+            return None
+        global_dsn_mtime = mtime
+        dsn = load_dsn_config()
+        if dsn:
+            initialize_global_database(dsn)
+        return dsn
+
 def initialize_global_database(dsn):
     """Initialize global database connection and repositories."""
     global global_db_client, global_log_repo, global_metrics_repo, global_query_repo, global_connection_status
     
     try:
+        # Release the pooled connections of the previous configuration
+        if global_db_client:
+            global_db_client.close()
+            global_db_client = None
         global_db_client = DatabendClient(dsn)
         
         # Test connection with a query that actually starts the warehouse
@@ -107,46 +249,46 @@ def initialize_global_database(dsn):
         print(f"Failed to connect to global database: {e}")
         return False
 
-def initialize_session_database(session_id, dsn):
-    """Initialize session-specific database connection and repositories."""
+def connect_session_database(dsn):
+    """Open and verify a client for dsn, with the repositories sessions share on it."""
+    db_client = DatabendClient(dsn)
     try:
-        db_client = DatabendClient(dsn)
-        
         # Test connection with a query that actually starts the warehouse
         test_query = "SELECT sum(number) FROM numbers(10)"
         rows, columns, error = db_client.execute_query(test_query)
         if error:
             raise Exception(f"Connection test failed: {error}")
-        
-        log_repo = LogRepository(db_client)
-        metrics_repo = MetricsRepository(db_client)
-        query_repo = QueryRepository(db_client)
-        
-        session_connections[session_id] = {
-            "db_client": db_client,
-            "log_repo": log_repo,
-            "metrics_repo": metrics_repo,
-            "query_repo": query_repo,
-            "connection_status": {
-                "connected": True,
-                "error": None,
-                "dsn_masked": mask_dsn(dsn)
-            }
-        }
+    except Exception:
+        db_client.close()
+        raise
+    return {
+        "db_client": db_client,
+        "log_repo": LogRepository(db_client),
+        "metrics_repo": MetricsRepository(db_client),
+        "query_repo": QueryRepository(db_client)
+    }
+
+def initialize_session_database(session_id, dsn):
+    """Point a session at its own DSN; sessions on the same DSN share one client."""
+    # Remembered in the cookie, so losing the connection later is reported instead of falling back to global
+    session['own_connection'] = True
+    session.pop('session_dsn', None)
+    try:
+        session_connections.connect(session_id, dsn, connect_session_database, {
+            "connected": True,
+            "error": None,
+            "dsn_masked": mask_dsn(dsn)
+        })
+        # Kept in the signed cookie rather than the shared state file, so other workers reconnect from here
+        session['session_dsn'] = dsn
         print(f"Session {session_id} database connection established successfully")
         return True
     except Exception as e:
-        session_connections[session_id] = {
-            "db_client": None,
-            "log_repo": None,
-            "metrics_repo": None,
-            "query_repo": None,
-            "connection_status": {
-                "connected": False,
-                "error": str(e),
-                "dsn_masked": None
-            }
-        }
+        session_connections.record_failure(session_id, {
+            "connected": False,
+            "error": str(e),
+            "dsn_masked": None
+        })
         print(f"Failed to connect session {session_id} to database: {e}")
         return False
 
@@ -155,13 +297,26 @@ def get_repositories():
     session_id = get_session_id()
     
     # Check if session has its own connection
-    if session_id in session_connections:
-        conn = session_connections[session_id]
-        status = conn["connection_status"].copy()
+    conn = session_connections.get(session_id, connect_session_database, session.get('session_dsn'))
+    if conn is not None:
+        resources = conn["resources"]
+        status = conn["status"].copy()
         status["connection_type"] = "session"
-        return conn["log_repo"], conn["metrics_repo"], conn["query_repo"], status
+        return resources.get("log_repo"), resources.get("metrics_repo"), resources.get("query_repo"), status
+    
+    if session.get('own_connection'):
+        # Expired or evicted; the global connection may point at another warehouse entirely
+        return None, None, None, {
+            "connected": False,
+            "error": "Session connection expired, please reconnect",
+            "dsn_masked": None,
+            "connection_type": "session",
+            "expired": True
+        }
     
-    # Fall back to global connection
+    # Fall back to global connection for sessions that never configured their own
+    if shared_store is not None:
+        refresh_global_database()
     status = global_connection_status.copy()
     status["connection_type"] = "global"
     return global_log_repo, global_metrics_repo, global_query_repo, status
@@ -190,6 +345,8 @@ def configure_connection():
         success = initialize_global_database(dsn)
         if success:
             save_dsn_config(dsn)  # Save to file for persistence
+            session.pop('own_connection', None)
+            session.pop('session_dsn', None)
         _, _, _, connection_status = get_repositories()
     else:
         # Configure session-specific connection
@@ -204,37 +361,293 @@ def configure_connection():
 @app.route('/api/logs', methods=['POST'])
 def get_logs():
     log_repo, _, _, _ = get_repositories()
+    if not log_repo:
+        return jsonify({'error': 'Not connected'}), 400
     filters = request.get_json() or {}
     result = log_repo.get_logs(filters)
-    return jsonify(result)
+    return json_response(result)
+
+@app.route('/api/logs/patterns', methods=['POST'])
+def get_log_patterns():
+    """Top message templates of the filtered logs, mined from the streamed message column"""
+    log_repo, _, _, _ = get_repositories()
+    if not log_repo:
+        return jsonify({'error': 'Not connected'}), 400
+    filters = request.get_json() or {}
+    return json_response(log_repo.get_log_patterns(filters))
+
+@app.route('/api/query/<query_id>', methods=['GET'])
+def get_query_drilldown(query_id):
+    """A query's history record with its logs, bounded to the query's own time window"""
+    log_repo, _, query_repo, _ = get_repositories()
+    if not query_repo:
+        return jsonify({'error': 'Not connected'}), 400
+    filters = {'around': request.args.get('around'), 'nocache': request.args.get('nocache') == '1'}
+    result = query_repo.get_query_drilldown(query_id, log_repo, filters)
+    if result is None:
+        return jsonify({'error': f'Query {query_id} not found'}), 404
+    return json_response(result)
+
+@app.route('/api/logs/tail', methods=['GET'])
+def tail_logs():
+    """Server-Sent Events stream of new log rows matching the filters"""
+    log_repo, _, _, _ = get_repositories()
+    if not log_repo:
+        return jsonify({'error': 'Not connected'}), 400
+    try:
+        filters = json.loads(request.args.get('filters') or '{}')
+    except ValueError:
+        return jsonify({'error': 'Invalid filters'}), 400
+    # EventSource resends the last event id when it reconnects
+    since = parse_since(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    tail = LogTail(log_repo, filters, since=since)
+    return Response(stream_with_context(limited_stream(tail.events())), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def export_response(name, export_fn):
+    """Stream an export; filters come from the JSON body or a 'filters' query parameter"""
+    if request.method == 'POST':
+        filters = request.get_json() or {}
+    else:
+        try:
+            filters = json.loads(request.args.get('filters') or '{}')
+        except ValueError:
+            return jsonify({'error': 'Invalid filters'}), 400
+    fmt, max_rows, error = resolve_export_request(
+        filters.get('format') or request.args.get('format'),
+        filters.get('maxRows') or request.args.get('maxRows'))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    # Each export holds a pooled connection while it streams
+    if not export_slots.acquire(blocking=False):
+        return jsonify({'error': f'Too many exports running (max {EXPORT_MAX_CONCURRENT}), try again later'}), 429
+    batches = export_fn(filters, max_rows)
+    # Pull the first batch here so query errors still get a proper status code
+    try:
+        first = next(batches, None)
+    except Exception as e:
+        export_slots.release()
+        return jsonify({'error': str(e)}), 500
+    
+    def all_batches():
+        if first is not None:
+            yield first
+            yield from batches
+    
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    response = Response(stream_with_context(stream_export(all_batches(), fmt)), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={name}.{extension}'
+    })
+    # Runs once the server is done with the response, however the stream ended
+    response.call_on_close(export_slots.release)
+    return response
+
+@app.route('/api/logs/export', methods=['GET', 'POST'])
+def export_logs():
+    log_repo, _, _, _ = get_repositories()
+    if not log_repo:
+        return jsonify({'error': 'Not connected'}), 400
+    return export_response('logs', log_repo.export_logs)
+
+@app.route('/api/queries/export', methods=['GET', 'POST'])
+def export_queries():
+    _, _, query_repo, _ = get_repositories()
+    if not query_repo:
+        return jsonify({'error': 'Not connected'}), 400
+    return export_response('queries', query_repo.export_queries)
 
 @app.route('/api/metrics', methods=['GET'])
 def get_metrics():
     _, metrics_repo, _, _ = get_repositories()
+    if not metrics_repo:
+        return jsonify({'error': 'Not connected'}), 400
     metrics = metrics_repo.get_metrics()
-    return jsonify(metrics)
+    response = json_response(metrics)
+    # Freshness goes in headers so the body, and its ETag, only change with the metrics
+    response.headers.update(metrics_repo.get_metrics_freshness())
+    return response
 
 @app.route('/api/queries', methods=['POST'])
 def get_queries():
     _, _, query_repo, _ = get_repositories()
+    if not query_repo:
+        return jsonify({'error': 'Not connected'}), 400
     filters = request.json or {}
     queries_data = query_repo.get_queries(filters)
-    return jsonify(queries_data)
+    return json_response(queries_data)
+
+@app.route('/api/queries/fingerprints', methods=['POST'])
+def get_query_fingerprints():
+    """Latency percentiles, load and error rate per parameterized query fingerprint"""
+    _, _, query_repo, _ = get_repositories()
+    if not query_repo:
+        return jsonify({'error': 'Not connected'}), 400
+    filters = request.get_json() or {}
+    return json_response(query_repo.get_query_fingerprints(filters))
+
+# Dashboard queries that can run as background jobs: kind -> (repository index, method name)
+JOB_KINDS = {
+    'logs': (0, 'get_logs'),
+    'patterns': (0, 'get_log_patterns'),
+    'queries': (2, 'get_queries'),
+    'fingerprints': (2, 'get_query_fingerprints')
+}
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Run an expensive dashboard query in the background; poll or subscribe to the returned job"""
+    data = request.get_json() or {}
+    kind = data.get('kind')
+    if kind not in JOB_KINDS:
+        return jsonify({'error': f"kind must be one of {', '.join(JOB_KINDS)}"}), 400
+    index, method = JOB_KINDS[kind]
+    repo = get_repositories()[index]
+    if not repo:
+        return jsonify({'error': 'Not connected'}), 400
+    filters = job_filters(data.get('filters') or {})
+    target = f"{repo.db.cache_namespace}/{repo.db.database}"
+    try:
+        job, reused = job_manager.submit(get_session_id(), kind, target, filters, repo.db,
+                                         lambda: getattr(repo, method)(filters))
+    except JobLimitExceeded as e:
+        return jsonify({'error': str(e)}), 429
+    return jsonify(dict(job.to_dict(), reused=reused)), 200 if reused else 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """A job's status and progress, with its result once it is done"""
+    job = job_manager.get(job_id, get_session_id())
+    if job is None:
+        return jsonify({'error': f'Job {job_id} not found'}), 404
+    return json_response(job.to_dict(include_result=True))
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-Sent Events with a job's status and progress until it finishes"""
+    job = job_manager.get(job_id, get_session_id())
+    if job is None:
+        return jsonify({'error': f'Job {job_id} not found'}), 404
+    return Response(stream_with_context(limited_stream(job_manager.events(job))), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id, get_session_id())
+    if job is None:
+        return jsonify({'error': f'Job {job_id} not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def get_job_stats():
+    return jsonify(job_manager.stats())
+
+@app.route('/api/parts/<token>', methods=['GET'])
+def get_pending_parts(token):
+    """Collect parts of a fan-out response that were still running"""
+    wait_seconds = min(request.args.get('wait', 10, type=float), 30)
+    collected = fanout_executor.collect(token, timeout=wait_seconds)
+    if collected is None:
+        return jsonify({'error': 'Unknown or expired parts token'}), 404
+    result, pending, next_token = collected
+    result.update({'pending': pending, 'partsToken': next_token})
+    return jsonify(result)
+
+@app.route('/api/cancel', methods=['POST'])
+def cancel_tab_queries():
+    """Kill the queries a browser tab still has running; sent with sendBeacon when the tab is closed"""
+    data = request.get_json(force=True, silent=True) or {}
+    tab_id = data.get('tabId') or request.headers.get('X-BendDash-Tab')
+    if not tab_id:
+        return jsonify({'error': 'tabId is required'}), 400
+    cancelled = cancellation.query_tracker.cancel_tab(get_session_id(), tab_id)
+    return jsonify({'cancelledRequests': cancelled})
+
+@app.route('/api/cancel/stats', methods=['GET'])
+def get_cancel_stats():
+    return jsonify(cancellation.query_tracker.stats())
+
+@app.route('/api/pool/stats', methods=['GET'])
+def get_pool_stats():
+    log_repo, _, _, _ = get_repositories()
+    if not log_repo:
+        return jsonify({'error': 'Not connected'}), 400
+    return jsonify(log_repo.db.pool_stats())
+
+@app.route('/api/sessions/stats', methods=['GET'])
+def get_session_stats():
+    session_connections.expire()
+    return jsonify(session_connections.stats())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    stats = result_cache.stats()
+    stats['histogram'] = histogram_cache.stats()
+    stats['rollup'] = rollup.rollup_stats()
+    stats['metrics'] = metrics_snapshot.metrics_snapshot_stats()
+    stats['patterns'] = pattern_cache.stats()
+    return jsonify(stats)
+
+@app.route('/api/debug/timings', methods=['GET'])
+def get_debug_timings():
+    """Phase breakdowns of recent API requests, newest first"""
+    path = request.args.get('path')
+    limit = min(request.args.get('limit', 50, type=int), timings.TIMINGS_BUFFER_SIZE)
+    return jsonify({
+        'summary': timings.timings_buffer.summary(path),
+        'recent': timings.timings_buffer.recent(path, limit)
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_prometheus_metrics():
+    """Process metrics in the Prometheus text exposition format"""
+    return Response(telemetry.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Databend Log Observer')
     parser.add_argument('--port', type=int, default=5002, help='Port to run the server on')
     parser.add_argument('--dsn', help='Databend DSN connection string (optional, can be configured via web interface)')
+    parser.add_argument('--rollup', action='store_true', help='Serve counts and charts from background-maintained minute rollups')
+    parser.add_argument('--serve', action='store_true', help='Run under gunicorn with several worker processes sharing state')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes in --serve mode')
+    # Live tails and job event streams may hold at most half of them (BENDDASH_MAX_STREAMS, see tail.py)
+    parser.add_argument('--threads', type=int, default=16,
+                        help='Request threads per worker in --serve mode; up to half may hold event streams')
+    parser.add_argument('--debug', action='store_true', help='Run the Flask development server with the debugger and reloader')
     
     args = parser.parse_args()
+    if args.serve:
+        if importlib.util.find_spec('gunicorn') is None:
+            sys.exit("❌ --serve needs gunicorn: pip install gunicorn")
+        # Workers import the app fresh and pick these up; each loads the saved DSN on its first request
+        os.environ['BENDDASH_THREADS'] = str(args.threads)
+        os.environ.setdefault('BENDDASH_STATE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.benddash_state.db'))
+        if args.rollup:
+            os.environ['BENDDASH_ROLLUP'] = '1'
+        print(f"🚀 Serving Databend Log Observer on port {args.port} with {args.workers} workers x {args.threads} threads")
+        os.execvp(sys.executable, [
+            sys.executable, '-m', 'gunicorn',
+            '--chdir', os.path.dirname(os.path.abspath(__file__)),
+            '--bind', f'0.0.0.0:{args.port}',
+            '--workers', str(args.workers),
+            '--worker-class', 'gthread',
+            '--threads', str(args.threads),
+            '--access-logfile', '-',
+            'app:app'
+        ])
+    
+    if args.rollup:
+        rollup.ROLLUP_ENABLED = True
     
     # Load global DSN configuration from file on startup
-    global_dsn = load_dsn_config()
-    if global_dsn:
-        initialize_global_database(global_dsn)
+    global_dsn = refresh_global_database()
     
     print(f"🚀 Starting Databend Log Observer on port {args.port}")
     if not args.dsn and not global_dsn:
         print("💡 No DSN provided. Please configure database connection via web interface.")
     
-    app.run(host='0.0.0.0', port=args.port, debug=True)
+    app.run(host='0.0.0.0', port=args.port, debug=args.debug, threaded=True)
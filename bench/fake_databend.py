@@ -0,0 +1,159 @@
+"""SQLite-backed stand-in for databend_driver, for offline benchmarks.
+
+install() registers a `databend_driver` module whose BlockingDatabendClient
+opens a SQLite file holding a `system_history` schema. Queries are rewritten
+from the Databend dialect BendDash uses (`::VARCHAR`, TRUNC, NOW() - INTERVAL,
+epoch-second bucket arithmetic, QUANTILE_CONT, SETTINGS) into SQLite before they run.
+"""
+import datetime
+import re
+import sqlite3
+import sys
+import types
+from urllib.parse import urlparse
+
+TS_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+_UNITS = {'SECOND': 'seconds', 'MINUTE': 'minutes', 'HOUR': 'hours', 'DAY': 'days'}
+_TRUNC_SECONDS = {'SECOND': 1, 'MINUTE': 60, 'HOUR': 3600, 'DAY': 86400}
+
+_CAST_RE = re.compile(r"(\w+\([^()]*\)|[\w.]+)::VARCHAR", re.IGNORECASE)
+_INTERVAL_RE = re.compile(r"NOW\(\)\s*-\s*INTERVAL\s+(\d+)\s+(SECOND|MINUTE|HOUR|DAY)", re.IGNORECASE)
+_DIV_RE = re.compile(r"\s+DIV\s+", re.IGNORECASE)
+_SETTINGS_RE = re.compile(r"\bSETTINGS\s*\([^)]*\)\s*", re.IGNORECASE)
+_QUANTILE_RE = re.compile(r"QUANTILE_CONT\(([\d.]+)\)\(", re.IGNORECASE)
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().strftime(TS_FORMAT)
+
+
+def _now_minus(amount: int, unit: str) -> str:
+    delta = datetime.timedelta(**{_UNITS[unit.upper()]: int(amount)})
+    return (datetime.datetime.utcnow() - delta).strftime(TS_FORMAT)
+
+
+def _to_unix_timestamp(value):
+    if value is None:
+        return None
+    return int((datetime.datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S') - _EPOCH).total_seconds())
+
+
+def _to_timestamp(seconds):
+    if seconds is None:
+        return None
+    return (_EPOCH + datetime.timedelta(seconds=int(seconds))).strftime(TS_FORMAT)
+
+
+def _trunc(value, unit):
+    if value is None:
+        return None
+    ts = datetime.datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S')
+    step = _TRUNC_SECONDS.get(str(unit).upper(), 60)
+    epoch = int((ts - datetime.datetime(1970, 1, 1)).total_seconds())
+    return (datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=epoch - epoch % step)).strftime(TS_FORMAT)
+
+
+def _regexp_replace(value, pattern, replacement):
+    if value is None:
+        return None
+    return re.sub(pattern, replacement, value)
+
+
+class _QuantileCont:
+    """QUANTILE_CONT(level)(x), rewritten to QUANTILE_CONT(level, x)"""
+
+    def __init__(self):
+        self.level = 0.5
+        self.values = []
+
+    def step(self, level, value):
+        self.level = level
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        if not self.values:
+            return None
+        values = sorted(self.values)
+        position = (len(values) - 1) * self.level
+        lower = int(position)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def translate(query: str) -> str:
+    """Rewrite the Databend SQL BendDash emits into SQLite"""
+    query = _SETTINGS_RE.sub('', query)
+    query = _INTERVAL_RE.sub(lambda m: f"NOW_MINUS({m.group(1)}, '{m.group(2).upper()}')", query)
+    query = query.replace('NOW()', 'NOW_TS()')
+    # SQLite divides integers as integers
+    query = _DIV_RE.sub(' / ', query)
+    query = _QUANTILE_RE.sub(lambda m: f"QUANTILE_CONT({m.group(1)}, ", query)
+    query = _CAST_RE.sub(lambda m: f"CAST({m.group(1)} AS TEXT)", query)
+    # Casts of nested expressions are left; timestamps are already text here
+    return query.replace('::VARCHAR', '')
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.execute("ATTACH DATABASE ? AS system_history", [path])
+    conn.create_function('NOW_TS', 0, _now)
+    conn.create_function('NOW_MINUS', 2, _now_minus)
+    conn.create_function('TRUNC', 2, _trunc, deterministic=True)
+    conn.create_function('TO_UNIX_TIMESTAMP', 1, _to_unix_timestamp, deterministic=True)
+    conn.create_function('TO_TIMESTAMP', 1, _to_timestamp, deterministic=True)
+    conn.create_function('REGEXP_REPLACE', 3, _regexp_replace, deterministic=True)
+    conn.create_aggregate('QUANTILE_CONT', 2, _QuantileCont)
+    return conn
+
+
+class FakeCursor:
+    """The subset of the databend_driver cursor API BendDash uses"""
+
+    def __init__(self, path: str):
+        self._conn = connect(path)
+        self._cursor = self._conn.cursor()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, query: str, params=None):
+        self._cursor.execute(translate(query), list(params or []))
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size: int):
+        return self._cursor.fetchmany(size)
+
+    def close(self):
+        self._cursor.close()
+        self._conn.close()
+
+
+class BlockingDatabendClient:
+    """Accepts DSNs like databend://bench@localhost/system_history?path=/tmp/bench.db"""
+
+    def __init__(self, dsn: str):
+        query = dict(part.split('=', 1) for part in (urlparse(dsn).query or '').split('&') if '=' in part)
+        if 'path' not in query:
+            raise ValueError("fake databend DSN needs a ?path=<sqlite file> parameter")
+        self.path = query['path']
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self.path)
+
+
+def install():
+    """Make `import databend_driver` resolve to this fake"""
+    module = types.ModuleType('databend_driver')
+    module.BlockingDatabendClient = BlockingDatabendClient
+    sys.modules['databend_driver'] = module
+    return module
+
+
+def dsn_for(path: str) -> str:
+    return f"databend://bench@localhost:8000/system_history?path={path}"
@@ -0,0 +1,209 @@
+"""Offline benchmarks for BendDash hot paths.
+
+Runs against synthetic history tables in SQLite through a fake databend_driver,
+so no warehouse or network is needed:
+
+    python bench/run.py --sizes 10k,1M --output bench_output.json
+    python bench/run.py --sizes 10k --compare bench/baseline.json --threshold 0.25
+
+With --compare the run exits with status 1 when any benchmark's median is
+slower than the baseline by more than the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import fake_databend  # noqa: E402
+import synthetic  # noqa: E402
+
+fake_databend.install()
+# Measure the work itself, not result cache hits
+os.environ.setdefault('BENDDASH_CACHE_MAX_BYTES', '0')
+
+from database import DatabendClient, LogRepository, QueryRepository, MetricsRepository, window_bucket_seconds  # noqa: E402
+
+LOG_FILTERS = {'timeRange': '24h', 'page': 1, 'pageSize': 200, 'nocache': True}
+QUERY_FILTERS = {'timeRange': '24h', 'page': 1, 'pageSize': 200, 'nocache': True}
+WHERE_FILTERS = [
+    {'timeRange': '1h', 'level': 'error'},
+    {'timeRange': '24h', 'search': 'timeout', 'advancedFilters': ["node_id = 'node-1'", "warehouse_id = 'wh-etl'"]},
+    {'queryId': 'abc', 'level': 'warning', 'node_id': 'node-2'},
+]
+
+
+class ReplayClient:
+    """Returns a recorded result instantly, isolating Python-side decoding"""
+
+    def __init__(self, database: str, rows, columns):
+        self.database = database
+        self.cache_namespace = 'replay'
+        self.rows = rows
+        self.columns = columns
+
+    def execute_query(self, query, params=None):
+        return self.rows, self.columns, None
+
+
+def measure(fn, repeat: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'medianMs': round(statistics.median(samples), 3),
+        'minMs': round(samples[0], 3),
+        'p95Ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'repeat': repeat
+    }
+
+
+def record_combined(client: DatabendClient, repo: LogRepository):
+    """Run the combined logs query once and keep its raw rows"""
+    where, params = repo._build_where_clause(LOG_FILTERS)
+    stats_where, stats_params = repo._build_where_clause({k: v for k, v in LOG_FILTERS.items() if k != 'level'})
+    captured = {}
+    original = client.execute_query
+
+    def capture(query, query_params=None):
+        rows, columns, error = original(query, query_params)
+        captured.update(rows=rows, columns=columns)
+        return rows, columns, error
+
+    client.execute_query = capture
+    try:
+        repo._get_logs_combined(f"WHERE {where}", params, f"WHERE {stats_where}", stats_params, 200, 0, window_bucket_seconds(LOG_FILTERS), 1)
+    finally:
+        client.execute_query = original
+    return where, params, stats_where, stats_params, captured['rows'], captured['columns']
+
+
+def bench_size(size_label: str, rows: int, repeat: int, workdir: str) -> dict:
+    path = os.path.join(workdir, f"history_{size_label}.db")
+    start = time.perf_counter()
+    synthetic.generate(path, log_rows=rows, query_rows=rows)
+    print(f"📦 Generated {rows} log and query rows in {time.perf_counter() - start:.1f}s")
+
+    client = DatabendClient(fake_databend.dsn_for(path))
+    log_repo = LogRepository(client)
+    query_repo = QueryRepository(client)
+    results = {}
+
+    def where_clauses():
+        for _ in range(1000):
+            for filters in WHERE_FILTERS:
+                log_repo._build_where_clause(filters)
+                query_repo._build_where_clause(filters)
+    results['build_where_clause_x1000'] = measure(where_clauses, repeat)
+
+    where, params, stats_where, stats_params, rows_, columns = record_combined(client, log_repo)
+    replay_repo = LogRepository(ReplayClient(client.database, rows_, columns))
+    results['logs_combined_decode'] = measure(lambda: replay_repo._get_logs_combined(
+        f"WHERE {where}", params, f"WHERE {stats_where}", stats_params, 200, 0, window_bucket_seconds(LOG_FILTERS), 1), repeat)
+
+    q_where, q_params = query_repo._build_where_clause(QUERY_FILTERS)
+    raw_queries = query_repo._get_paginated_queries(f"WHERE {q_where}", q_params, 10000, 0)
+    results['process_query_durations'] = measure(lambda: query_repo._process_query_durations(raw_queries), repeat)
+    results['process_query_durations']['rows'] = len(raw_queries)
+
+    results['repo_get_logs'] = measure(lambda: log_repo.get_logs(dict(LOG_FILTERS)), repeat)
+    results['repo_get_queries'] = measure(lambda: query_repo.get_queries(dict(QUERY_FILTERS)), repeat)
+
+    results.update(bench_flask(client, repeat))
+    client.close()
+    return results
+
+
+def bench_flask(client: DatabendClient, repeat: int) -> dict:
+    """End-to-end request handling through the Flask test client"""
+    try:
+        import app as app_module
+    except ImportError as e:
+        print(f"⚠️ Skipping Flask benchmarks: {e}")
+        return {}
+    app_module.global_log_repo = LogRepository(client)
+    app_module.global_query_repo = QueryRepository(client)
+    app_module.global_metrics_repo = MetricsRepository(client)
+    test_client = app_module.app.test_client()
+
+    def post(path, body):
+        def call():
+            response = test_client.post(path, json=body)
+            assert response.status_code == 200, response.status_code
+        return call
+
+    return {
+        'flask_api_logs': measure(post('/api/logs', LOG_FILTERS), repeat),
+        'flask_api_queries': measure(post('/api/queries', QUERY_FILTERS), repeat),
+        'flask_api_metrics': measure(lambda: test_client.get('/api/metrics'), repeat),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Benchmarks whose median regressed by more than threshold (a fraction)"""
+    regressions = []
+    for size, benches in results['sizes'].items():
+        for name, current in benches.items():
+            previous = baseline.get('sizes', {}).get(size, {}).get(name)
+            if not previous or not previous.get('medianMs'):
+                continue
+            change = current['medianMs'] / previous['medianMs'] - 1
+            marker = '❌' if change > threshold else '✅'
+            print(f"{marker} {size:>5} {name:<28} {previous['medianMs']:>10.3f}ms -> {current['medianMs']:>10.3f}ms ({change:+.1%})")
+            if change > threshold:
+                regressions.append({'size': size, 'name': name, 'change': round(change, 4)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BendDash offline benchmarks')
+    parser.add_argument('--sizes', default='10k', help='Comma-separated row counts: 10k, 100k, 1M, 10M or integers')
+    parser.add_argument('--repeat', type=int, default=10, help='Timed runs per benchmark')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', help='Baseline JSON from an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed median slowdown before failing, as a fraction')
+    parser.add_argument('--workdir', help='Directory for the generated SQLite files (default: a temp dir)')
+    args = parser.parse_args()
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'createdAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'sizes': {}
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        for label in [s.strip() for s in args.sizes.split(',') if s.strip()]:
+            print(f"🚀 Benchmarking {label}")
+            results['sizes'][label] = bench_size(label, synthetic.parse_size(label), args.repeat, workdir)
+            for name, result in results['sizes'][label].items():
+                print(f"⏱️  {label:>5} {name:<28} median {result['medianMs']:>10.3f}ms  p95 {result['p95Ms']:>10.3f}ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print("✅ No regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Synthetic log_history / query_history data for the fake Databend driver"""
+import datetime
+import os
+import random
+import sqlite3
+import uuid
+
+TS_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+SCHEMA = """
+CREATE TABLE log_history (
+    timestamp TEXT, query_id TEXT, log_level TEXT, target TEXT, message TEXT, path TEXT,
+    cluster_id TEXT, node_id TEXT, warehouse_id TEXT, fields TEXT
+);
+CREATE TABLE query_history (
+    query_id TEXT, log_type_name TEXT, query_text TEXT, event_time TEXT, query_start_time TEXT,
+    query_duration_ms INTEGER, exception_code INTEGER, exception_text TEXT, sql_user TEXT,
+    current_database TEXT, query_kind TEXT, result_rows INTEGER, result_bytes INTEGER,
+    scan_rows INTEGER, scan_bytes INTEGER, client_address TEXT, query_parameterized_hash TEXT,
+    join_spilled_bytes INTEGER, agg_spilled_bytes INTEGER, group_by_spilled_bytes INTEGER
+);
+"""
+
+# Created after loading, which is much faster for the large sizes
+INDEXES = """
+CREATE INDEX log_history_ts ON log_history (timestamp);
+CREATE INDEX log_history_query ON log_history (query_id);
+CREATE INDEX query_history_start ON query_history (query_start_time);
+CREATE INDEX query_history_query ON query_history (query_id);
+"""
+
+LEVELS = ['INFO'] * 70 + ['DEBUG'] * 20 + ['WARN'] * 7 + ['ERROR'] * 3
+TARGETS = ['databend_query::servers::http', 'databend_query::pipelines', 'databend_common_storage', 'databend_query::sessions']
+MESSAGES = [
+    'query {qid} finished in {ms}ms',
+    'fetched {n} rows from block cache',
+    'spilling {n} bytes to storage for hash join',
+    'connection from 10.0.{a}.{b} accepted',
+    'retrying request to object storage after timeout, attempt {a}',
+]
+STATEMENTS = [
+    'SELECT * FROM orders WHERE id = {n}',
+    'SELECT count(*) FROM events WHERE ts > now() - interval 1 hour',
+    'INSERT INTO metrics VALUES ({n}, {a})',
+    "SELECT user_id, sum(amount) FROM payments GROUP BY user_id LIMIT {a}",
+]
+USERS = ['root', 'etl', 'analyst', 'dashboard']
+DATABASES = ['default', 'sales', 'telemetry']
+NODES = [f'node-{i}' for i in range(4)]
+WAREHOUSES = ['wh-default', 'wh-etl']
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000, '10M': 10_000_000}
+
+
+def parse_size(value: str) -> int:
+    return SIZES.get(value) or int(value)
+
+
+def _log_rows(count: int, span: datetime.timedelta, now: datetime.datetime, rng: random.Random):
+    query_ids = [uuid.UUID(int=rng.getrandbits(128)).hex for _ in range(max(1, count // 20))]
+    for _ in range(count):
+        ts = now - datetime.timedelta(seconds=rng.random() * span.total_seconds())
+        template = rng.choice(MESSAGES)
+        message = template.format(qid=rng.choice(query_ids), ms=rng.randint(1, 5000),
+                                  n=rng.randint(1, 10**6), a=rng.randint(0, 255), b=rng.randint(0, 255))
+        yield (ts.strftime(TS_FORMAT), rng.choice(query_ids), rng.choice(LEVELS), rng.choice(TARGETS),
+               message, 'src/query/service.rs:42', 'cluster-1', rng.choice(NODES), rng.choice(WAREHOUSES), '{}')
+
+
+def _query_rows(count: int, span: datetime.timedelta, now: datetime.datetime, rng: random.Random):
+    # Every query has a QueryStart row and, once finished, a QueryEnd row
+    for _ in range(count // 2):
+        qid = uuid.UUID(int=rng.getrandbits(128)).hex
+        start = now - datetime.timedelta(seconds=rng.random() * span.total_seconds())
+        duration = int(rng.expovariate(1 / 300))
+        failed = rng.random() < 0.05
+        statement = rng.randrange(len(STATEMENTS))
+        text = STATEMENTS[statement].format(n=rng.randint(1, 10**6), a=rng.randint(1, 1000))
+        # Older servers leave the parameterized hash empty
+        parameterized_hash = f'{statement:016x}' if statement % 2 else ''
+        user, database = rng.choice(USERS), rng.choice(DATABASES)
+        common = (text, user, database, 'Query' if text.startswith('SELECT') else 'Insert')
+        start_ts = start.strftime(TS_FORMAT)
+        yield (qid, 'QueryStart', common[0], start_ts, start_ts, 0, 0, '', common[1], common[2], common[3],
+               0, 0, 0, 0, '10.0.0.1', parameterized_hash, 0, 0, 0)
+        end_ts = (start + datetime.timedelta(milliseconds=duration)).strftime(TS_FORMAT)
+        yield (qid, 'QueryEnd', common[0], end_ts, start_ts, duration, 1006 if failed else 0,
+               'division by zero' if failed else '', common[1], common[2], common[3],
+               rng.randint(0, 10**4), rng.randint(0, 10**6), rng.randint(0, 10**6), rng.randint(0, 10**8), '10.0.0.1',
+               parameterized_hash, rng.choice([0, 0, 0, rng.randint(0, 10**8)]), 0, 0)
+
+
+def generate(path: str, log_rows: int, query_rows: int, span_hours: int = 48, seed: int = 42, batch: int = 50_000):
+    """Create a SQLite file with log_history and query_history filled relative to now"""
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    span = datetime.timedelta(hours=span_hours)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.executescript(SCHEMA)
+    for table, rows, width in (('log_history', _log_rows(log_rows, span, now, rng), 10),
+                               ('query_history', _query_rows(query_rows, span, now, rng), 20)):
+        placeholders = ', '.join('?' * width)
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= batch:
+                conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", chunk)
+                chunk = []
+        if chunk:
+            conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", chunk)
+    conn.executescript(INDEXES)
+    conn.commit()
+    conn.close()
+    return path
@@ -0,0 +1,347 @@
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import cancellation
+from shared_state import SharedStore, shared_store
+
+# Result TTL in seconds per relative time range. Short windows move quickly,
+# long windows barely change between two auto-refresh ticks.
+CACHE_TTL = {
+    '1m': 2, '5m': 5, '15m': 10, '30m': 15, '1h': 20,
+    '3h': 30, '6h': 45, '12h': 60, '24h': 60, '2d': 120,
+    '7d': 300, '30d': 600
+}
+DEFAULT_CACHE_TTL = 10
+
+# Request keys that never change the result set
+IGNORED_FILTER_KEYS = {'_ts', 'nocache', 'mode', 'partTimeouts'}
+
+
+def canonicalize_filters(filters: Dict) -> Dict:
+    """Normalize a filters dict so equivalent requests produce the same key"""
+    canonical = {}
+    for key, value in (filters or {}).items():
+        if key in IGNORED_FILTER_KEYS:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        if key == 'advancedFilters' and isinstance(value, list):
+            # Conditions are AND-ed together, so order and duplicates don't matter
+            value = sorted({c.strip() for c in value if isinstance(c, str) and c.strip()})
+        if value in (None, '', [], {}):
+            continue
+        canonical[key] = value
+    return canonical
+
+
+# Etag of the cached result the current request was answered from, if any
+_result_etag = contextvars.ContextVar('benddash_result_etag', default=None)
+
+
+def note_result_etag(etag: Optional[str]):
+    _result_etag.set(etag)
+
+
+def current_result_etag() -> Optional[str]:
+    return _result_etag.get()
+
+
+def canonical_json(value: Any) -> str:
+    """Deterministic compact JSON, used both as response body and for content hashes"""
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def content_etag(body: str) -> str:
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Thread-safe TTL cache with an LRU bound on total payload size.
+
+    Concurrent misses for the same key are coalesced, so N browser tabs
+    refreshing the same view trigger a single database query.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_map: Dict[str, int] = None,
+                 default_ttl: int = DEFAULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl_map = ttl_map if ttl_map is not None else CACHE_TTL
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, value, etag)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.retries = 0
+
+    def make_key(self, namespace: str, database: str, filters: Dict) -> str:
+        payload = json.dumps(
+            {'ns': namespace, 'db': database, 'filters': canonicalize_filters(filters)},
+            sort_keys=True, default=str
+        )
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def ttl_for(self, filters: Dict) -> int:
+        return self.ttl_map.get((filters or {}).get('timeRange'), self.default_ttl)
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.get_with_etag(key)[0]
+
+    def get_with_etag(self, key: str) -> Tuple[Optional[Any], Optional[str]]:
+        """Cached value and the content hash of its JSON form"""
+        with self._lock:
+            return self._get_locked(key)
+
+    def _get_locked(self, key: str) -> Tuple[Optional[Any], Optional[str]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, None
+        expires_at, size, value, etag = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._remove_locked(key)
+            return None, None
+        self._entries.move_to_end(key)
+        return value, etag
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> Optional[str]:
+        """Store a value; returns its etag, or None if it is too large to cache"""
+        body = canonical_json(value)
+        size = len(body)
+        if size > self.max_bytes:
+            return None
+        etag = content_etag(body)
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove_locked(key)
+            self._entries[key] = (expires_at, size, value, etag)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove_locked(oldest)
+                self.evictions += 1
+        return etag
+
+    def _remove_locked(self, key: str):
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get_or_load(self, key: str, loader: Callable[[], Tuple[Any, bool]], ttl: Optional[float] = None) -> Any:
+        """Return the cached value or call loader() once for all concurrent callers.
+
+        The loader returns (value, cacheable); failed loads are shared with the
+        callers already waiting but are not stored. An exception raised by the
+        loader is raised in the waiting callers too. A load cut short because
+        the request running it was superseded or cancelled is never handed to
+        the waiting callers; they load again instead.
+        """
+        return self.get_or_load_with_etag(key, loader, ttl)[0]
+
+    def get_or_load_with_etag(self, key: str, loader: Callable[[], Tuple[Any, bool]],
+                              ttl: Optional[float] = None) -> Tuple[Any, Optional[str]]:
+        """get_or_load() that also returns the value's etag; None for values that were not cached"""
+        while True:
+            with self._lock:
+                value, etag = self._get_locked(key)
+                if value is not None:
+                    self.hits += 1
+                    return value, etag
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    waiter = {'event': threading.Event(), 'value': None, 'etag': None, 'error': None, 'stopped': False}
+                    self._inflight[key] = waiter
+                    self.misses += 1
+                    break
+                self.hits += 1
+
+            waiter['event'].wait()
+            if waiter['stopped']:
+                # The owner's own request was superseded or cancelled, not ours
+                with self._lock:
+                    self.retries += 1
+                continue
+            if waiter['error'] is not None:
+                # The load failed outright; waiting callers fail the same way
+                raise waiter['error']
+            return waiter['value'], waiter['etag']
+
+        context = cancellation.current()
+        try:
+            value, cacheable = loader()
+            waiter['value'] = value
+            if cacheable:
+                waiter['etag'] = self.set(key, value, ttl)
+            return value, waiter['etag']
+        except BaseException as e:
+            waiter['error'] = e
+            raise
+        finally:
+            waiter['stopped'] = cancellation.was_stopped(context)
+            with self._lock:
+                self._inflight.pop(key, None)
+            waiter['event'].set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'retries': self.retries,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class NullCache(ResultCache):
+    """Cache that never stores anything, for disabling result caching"""
+
+    def get_or_load_with_etag(self, key: str, loader: Callable[[], Tuple[Any, bool]],
+                              ttl: Optional[float] = None) -> Tuple[Any, Optional[str]]:
+        with self._lock:
+            self.misses += 1
+        value, _ = loader()
+        return value, None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> Optional[str]:
+        return None
+
+
+class SharedResultCache(ResultCache):
+    """ResultCache backed by a SharedStore, so worker processes reuse each other's results.
+
+    Each process keeps its own in-memory LRU in front of the store. A miss in
+    both is loaded once per process as before and, across processes, by
+    whichever worker takes the load lease first; the others wait for its
+    result to appear in the store.
+    """
+
+    NAMESPACE = 'result'
+    LEASE_NAMESPACE = 'result-lease'
+    # Longest a worker waits for another one's load before loading itself
+    LEASE_SECONDS = 30.0
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, store: SharedStore, max_bytes: int = 64 * 1024 * 1024, shared_max_bytes: int = 256 * 1024 * 1024,
+                 **kwargs):
+        super().__init__(max_bytes=max_bytes, **kwargs)
+        self.store = store
+        self.shared_max_bytes = shared_max_bytes
+        self.shared_hits = 0
+        self.shared_waits = 0
+        self._shared_sets = 0
+
+    def _get_shared(self, key: str) -> Tuple[Optional[Any], Optional[str]]:
+        stored, expires_at = self.store.get(self.NAMESPACE, key)
+        if stored is None:
+            return None, None
+        # Stored as "<etag>:<canonical json>"; the etag is hex, so the first colon splits them
+        etag, body = stored.split(':', 1)
+        value = json.loads(body)
+        ttl = expires_at - time.time() if expires_at is not None else None
+        with self._lock:
+            self._put_locked(key, value, len(body), etag, ttl)
+            self.shared_hits += 1
+        return value, etag
+
+    def _put_locked(self, key: str, value: Any, size: int, etag: str, ttl: Optional[float]):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove_locked(key)
+        self._entries[key] = (time.monotonic() + ttl if ttl is not None else None, size, value, etag)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            self._remove_locked(next(iter(self._entries)))
+            self.evictions += 1
+
+    def get_with_etag(self, key: str) -> Tuple[Optional[Any], Optional[str]]:
+        value, etag = super().get_with_etag(key)
+        if value is None:
+            value, etag = self._get_shared(key)
+        return value, etag
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> Optional[str]:
+        body = canonical_json(value)
+        size = len(body)
+        if size > self.shared_max_bytes:
+            return None
+        etag = content_etag(body)
+        with self._lock:
+            self._put_locked(key, value, size, etag, ttl)
+            self._shared_sets += 1
+            trim = self._shared_sets % 50 == 0
+        self.store.set(self.NAMESPACE, key, f"{etag}:{body}", ttl)
+        if trim:
+            self.store.trim(self.NAMESPACE, self.shared_max_bytes)
+        return etag
+
+    def get_or_load_with_etag(self, key: str, loader: Callable[[], Tuple[Any, bool]],
+                              ttl: Optional[float] = None) -> Tuple[Any, Optional[str]]:
+        def shared_loader():
+            value, etag = self._get_shared(key)
+            if value is not None:
+                return value, False
+            lease = f"{os.getpid()}"
+            deadline = time.monotonic() + self.LEASE_SECONDS
+            while not self.store.add(self.LEASE_NAMESPACE, key, lease, self.LEASE_SECONDS):
+                # Another worker is loading the same result
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(self.POLL_INTERVAL)
+                value, etag = self._get_shared(key)
+                if value is not None:
+                    with self._lock:
+                        self.shared_waits += 1
+                    return value, False
+            try:
+                return loader()
+            finally:
+                self.store.delete(self.LEASE_NAMESPACE, key)
+
+        value, etag = super().get_or_load_with_etag(key, shared_loader, ttl)
+        if etag is None:
+            # Results found in the store were copied into the local tier by _get_shared
+            _, etag = super().get_with_etag(key)
+        return value, etag
+
+    def clear(self):
+        super().clear()
+        self.store.clear(self.NAMESPACE)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        with self._lock:
+            stats['shared'] = dict(self.store.namespace_stats(self.NAMESPACE), maxBytes=self.shared_max_bytes,
+                                   hits=self.shared_hits, waits=self.shared_waits)
+        return stats
+
+
+def create_result_cache() -> ResultCache:
+    """Build the process-wide cache from environment settings"""
+    max_bytes = int(os.environ.get('BENDDASH_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    if max_bytes <= 0:
+        return NullCache(max_bytes=0)
+    if shared_store is not None:
+        shared_max_bytes = int(os.environ.get('BENDDASH_SHARED_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+        return SharedResultCache(shared_store, max_bytes=max_bytes, shared_max_bytes=shared_max_bytes)
+    return ResultCache(max_bytes=max_bytes)
+
+
+result_cache = create_result_cache()
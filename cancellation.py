@@ -0,0 +1,232 @@
+import contextvars
+import hashlib
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from telemetry import db_queries_killed
+
+# Statement timeouts in seconds per route, e.g. "default=120,/api/logs/export=3600";
+# 0 means no limit. Exports stream for up to half an hour by default.
+DEFAULT_STATEMENT_TIMEOUTS = {'default': 120, '/api/logs/export': 1800, '/api/queries/export': 1800, '/api/jobs': 1800}
+# Kill the queries of a request once the same tab sends a different one to the same route
+CANCEL_SUPERSEDED = os.environ.get('BENDDASH_CANCEL_SUPERSEDED', '1') != '0'
+# Channels remembered for supersede checks, least recently used first out
+MAX_CHANNELS = 10000
+
+_ID_RE = re.compile(r'^[\w\-]+$')
+# Statements that take a SETTINGS clause; KILL, SHOW, USE and the like only get the tag
+_SETTINGS_RE = re.compile(r'^(SELECT|WITH)\b', re.IGNORECASE)
+
+
+class QueryCancelled(Exception):
+    """Raised instead of starting a query whose request has been superseded or cancelled"""
+
+
+def parse_statement_timeouts(value: str) -> Dict[str, int]:
+    timeouts = dict(DEFAULT_STATEMENT_TIMEOUTS)
+    for part in (value or '').split(','):
+        route, _, seconds = part.strip().partition('=')
+        if not route or not seconds:
+            continue
+        try:
+            timeouts[route.strip()] = int(seconds)
+        except ValueError:
+            print(f"⚠️ Ignoring invalid statement timeout: {part!r}")
+    return timeouts
+
+
+STATEMENT_TIMEOUTS = parse_statement_timeouts(os.environ.get('BENDDASH_STATEMENT_TIMEOUTS', ''))
+
+
+class QueryContext:
+    """Who a query runs for: the request, its session and tab, and its statement timeout"""
+
+    def __init__(self, request_id: str, session_tag: str, channel: Optional[Tuple], signature: str, timeout: int):
+        self.request_id = request_id
+        self.session_tag = session_tag
+        self.channel = channel
+        self.signature = signature
+        self.timeout = timeout
+        # Set when the work is cancelled outright; its next statements are refused
+        self.cancelled = False
+        # Why the request's statements were killed or refused, if they were
+        self.stopped = None
+
+
+_context = contextvars.ContextVar('benddash_query_context', default=None)
+
+
+def session_tag(session_id: str) -> str:
+    # The session id itself stays out of query_history, which other users may read
+    return hashlib.sha1(session_id.encode('utf-8')).hexdigest()[:12]
+
+
+def begin_request(session_id: str, tab_id: Optional[str], route: str, body: bytes) -> QueryContext:
+    """Set the query context of an API request; a tab's new request supersedes its previous one on the route"""
+    tag = session_tag(session_id)
+    tab_id = tab_id if tab_id and _ID_RE.match(tab_id) else None
+    channel = (tag, tab_id, route) if tab_id else None
+    context = QueryContext(uuid.uuid4().hex, tag, channel, hashlib.sha1(body or b'').hexdigest(),
+                           STATEMENT_TIMEOUTS.get(route, STATEMENT_TIMEOUTS['default']))
+    _context.set(context)
+    if channel and CANCEL_SUPERSEDED:
+        query_tracker.supersede(context)
+    return context
+
+
+def job_context(job_id: str, session_id: str) -> QueryContext:
+    """Query context of a background job; it belongs to no tab, so only an explicit cancel stops it"""
+    return QueryContext(job_id, session_tag(session_id), None, '', STATEMENT_TIMEOUTS['/api/jobs'])
+
+
+def activate(context: Optional[QueryContext]):
+    _context.set(context)
+
+
+def end_request():
+    _context.set(None)
+
+
+def current() -> Optional[QueryContext]:
+    return _context.get()
+
+
+def tag_query(query: str, context: Optional[QueryContext] = None) -> str:
+    """Prefix a statement with the request tag and, for queries, its execution time limit"""
+    context = context or _context.get()
+    if context is None:
+        tag = "/* benddash-background */"
+        timeout = STATEMENT_TIMEOUTS['default']
+    else:
+        tag = f"/* benddash-request:{context.request_id} session:{context.session_tag} */"
+        timeout = context.timeout
+    query = query.lstrip()
+    settings = f"SETTINGS (max_execution_time = {int(timeout)}) " if timeout and _SETTINGS_RE.match(query) else ""
+    return f"{tag} {settings}{query}"
+
+
+class QueryTracker:
+    """In-flight Databend queries per request, and the latest request per tab and route.
+
+    Queries of a request that was superseded by a different request, or whose
+    tab went away, are killed on the server; queries it had not started yet
+    are refused with QueryCancelled.
+    """
+
+    def __init__(self, max_channels: int = MAX_CHANNELS):
+        self.max_channels = max_channels
+        self._running = {}  # request id -> {'context', 'clients': {id(client): [client, queries]}}
+        self._latest = OrderedDict()  # channel -> (request id, signature)
+        self._lock = threading.Lock()
+        self._stats = {'superseded': 0, 'disconnected': 0, 'cancelled': 0, 'refused': 0, 'killed': 0, 'killFailures': 0}
+
+    def start(self, db_client, context: Optional[QueryContext] = None):
+        """Register a query about to run; returns the token for finish()"""
+        context = context or _context.get()
+        if context is None:
+            return None
+        with self._lock:
+            latest = self._latest.get(context.channel) if context.channel else None
+            if context.cancelled or (latest and latest[0] != context.request_id and latest[1] != context.signature):
+                self._stats['refused'] += 1
+                context.stopped = 'cancelled' if context.cancelled else 'superseded'
+                raise QueryCancelled(f"Request {context.request_id} was {context.stopped}")
+            entry = self._running.setdefault(context.request_id, {'context': context, 'clients': {}})
+            slot = entry['clients'].setdefault(id(db_client), [db_client, 0])
+            slot[1] += 1
+        return context.request_id, id(db_client)
+
+    def finish(self, token):
+        if token is None:
+            return
+        request_id, client_key = token
+        with self._lock:
+            entry = self._running.get(request_id)
+            if entry is None:
+                return
+            slot = entry['clients'].get(client_key)
+            if slot is not None:
+                slot[1] -= 1
+                if slot[1] <= 0:
+                    del entry['clients'][client_key]
+            if not entry['clients']:
+                del self._running[request_id]
+
+    def supersede(self, context: QueryContext):
+        """Make context the latest request of its channel and kill the different ones still running"""
+        with self._lock:
+            self._latest[context.channel] = (context.request_id, context.signature)
+            self._latest.move_to_end(context.channel)
+            while len(self._latest) > self.max_channels:
+                self._latest.popitem(last=False)
+            victims = [request_id for request_id, entry in self._running.items()
+                       if entry['context'].channel == context.channel and request_id != context.request_id
+                       and entry['context'].signature != context.signature]
+        for request_id in victims:
+            self.kill(request_id, 'superseded')
+
+    def cancel_tab(self, session_id: str, tab_id: str) -> int:
+        """Kill everything a tab still has running, e.g. when it is closed"""
+        tag = session_tag(session_id)
+        with self._lock:
+            victims = [request_id for request_id, entry in self._running.items()
+                       if entry['context'].channel and entry['context'].channel[:2] == (tag, tab_id)]
+            # Queries the tab's requests have yet to start are refused too
+            for channel in [c for c in self._latest if c[:2] == (tag, tab_id)]:
+                self._latest[channel] = ('', '')
+        for request_id in victims:
+            self.kill(request_id, 'disconnected')
+        return len(victims)
+
+    def cancel(self, context: QueryContext):
+        """Stop a request or job: refuse its next statements and kill the running ones"""
+        context.cancelled = True
+        self.kill(context.request_id, 'cancelled')
+
+    def kill(self, request_id: str, reason: str):
+        """Kill a request's running statements in the background"""
+        with self._lock:
+            entry = self._running.get(request_id)
+            clients = [slot[0] for slot in entry['clients'].values()] if entry else []
+            if clients:
+                entry['context'].stopped = reason
+                self._stats[reason] += 1
+        if clients:
+            threading.Thread(target=self._kill, args=(request_id, clients, reason),
+                             name='benddash-kill', daemon=True).start()
+
+    def _kill(self, request_id: str, clients: List, reason: str):
+        for db_client in clients:
+            try:
+                killed = db_client.kill_tagged(request_id)
+            except Exception as e:
+                print(f"⚠️ Failed to kill queries of request {request_id}: {e}")
+                with self._lock:
+                    self._stats['killFailures'] += 1
+                continue
+            if killed:
+                print(f"🛑 Killed {killed} {reason} quer{'y' if killed == 1 else 'ies'} of request {request_id}")
+                db_queries_killed.inc(reason, amount=killed)
+                with self._lock:
+                    self._stats['killed'] += killed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, inFlightRequests=len(self._running), channels=len(self._latest),
+                        statementTimeouts=STATEMENT_TIMEOUTS)
+
+
+query_tracker = QueryTracker()
+
+
+def was_stopped(context: Optional[QueryContext]) -> bool:
+    """Whether a request's statements were killed or refused because it was superseded or cancelled"""
+    return context is not None and context.stopped is not None
+
+
+def valid_process_id(value) -> bool:
+    return bool(value) and bool(_ID_RE.match(str(value)))
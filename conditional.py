@@ -0,0 +1,91 @@
+import gzip
+import os
+from typing import Any, Optional
+
+from flask import Response, request
+
+from cache import canonical_json, content_etag, current_result_etag
+from timings import phase
+
+# Bodies smaller than this are sent as-is; compressing them costs more than it saves
+COMPRESS_MIN_BYTES = int(os.environ.get('BENDDASH_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+def json_response(value: Any) -> Response:
+    """JSON response with a content-hash ETag, or 304 when the client already has it.
+
+    When the value came from the result cache its etag is known, so a
+    matching If-None-Match is answered without serializing anything.
+    """
+    etag = current_result_etag()
+    if etag and request.if_none_match.contains_weak(etag):
+        return _not_modified(etag)
+
+    with phase('serialize'):
+        body = canonical_json(value)
+    if etag is None:
+        etag = content_etag(body)
+        if request.if_none_match.contains_weak(etag):
+            return _not_modified(etag)
+
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def _not_modified(etag: str) -> Response:
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Preferred content coding the client accepts: br when available, then gzip"""
+    offered = {}
+    for item in (accept_encoding or '').split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, q = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(q)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            offered[coding] = quality
+    if brotli is not None and offered.get('br', 0) > 0:
+        return 'br'
+    if offered.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+
+def compress_response(response: Response) -> Response:
+    """Compress a buffered JSON response according to Accept-Encoding"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    with phase('compress'):
+        if encoding == 'br':
+            data = brotli.compress(data, quality=BROTLI_QUALITY)
+        else:
+            data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -1,35 +1,144 @@
 from databend_driver import BlockingDatabendClient
 import os
-from typing import Dict, List, Tuple, Optional, Any
+import json
+import base64
+from typing import Dict, List, Tuple, Optional, Any, Iterator
 import datetime
+import time
 from urllib.parse import urlparse
+from cache import ResultCache, result_cache, note_result_etag
+from pool import ConnectionPool, pool_settings_from_env
+from fanout import fanout_executor
+from patterns import PATTERN_MAX_ROWS, pattern_cache
+from histogram import histogram_cache, ceil_ts, choose_bucket_seconds, floor_ts, format_ts, parse_ts, time_bucket_sql
+from rollup import QUERY_STATUS_EXPR, release_rollup, rollup_for
+from metrics_snapshot import metrics_snapshot_for
+from timings import phase, record
+from search import build_search_condition, resolve_index_type
+from columnar import encode_rows, wants_columnar
+from telemetry import db_operation, db_queries_in_flight, observe_db_query, operation_scope
+import cancellation
+from cancellation import query_tracker, tag_query, valid_process_id
 
 # Shared constants
-TIME_RANGES = {
-    '1m': 'NOW() - INTERVAL 1 MINUTE',
-    '5m': 'NOW() - INTERVAL 5 MINUTE', 
-    '15m': 'NOW() - INTERVAL 15 MINUTE',
-    '30m': 'NOW() - INTERVAL 30 MINUTE',
-    '1h': 'NOW() - INTERVAL 1 HOUR',
-    '3h': 'NOW() - INTERVAL 3 HOUR',
-    '6h': 'NOW() - INTERVAL 6 HOUR',
-    '12h': 'NOW() - INTERVAL 12 HOUR',
-    '24h': 'NOW() - INTERVAL 24 HOUR',
-    '2d': 'NOW() - INTERVAL 2 DAY'
+TIME_RANGE_DELTAS = {
+    '1m': datetime.timedelta(minutes=1), '5m': datetime.timedelta(minutes=5),
+    '15m': datetime.timedelta(minutes=15), '30m': datetime.timedelta(minutes=30),
+    '1h': datetime.timedelta(hours=1), '3h': datetime.timedelta(hours=3),
+    '6h': datetime.timedelta(hours=6), '12h': datetime.timedelta(hours=12),
+    '24h': datetime.timedelta(hours=24), '2d': datetime.timedelta(days=2),
+    '7d': datetime.timedelta(days=7), '30d': datetime.timedelta(days=30)
 }
 
+# Serve time distributions from the closed-bucket cache and only scan the open tail
+INCREMENTAL_HISTOGRAM = os.environ.get('BENDDASH_INCREMENTAL_HISTOGRAM', '1') != '0'
+
 LEVEL_MAP = {'warning': 'WARN', 'error': 'ERROR', 'info': 'INFO', 'debug': 'DEBUG'}
 
-BUCKET_PRECISION = {
-    '1m': 'SECOND', '5m': 'MINUTE', '15m': 'MINUTE', '30m': 'MINUTE',
-    '1h': 'MINUTE', '3h': 'HOUR', '6h': 'HOUR', '12h': 'HOUR',
-    '24h': 'HOUR', '2d': 'HOUR'
+# query_history columns carried through the collapsed one-row-per-query view
+QUERY_COLUMNS = """query_id, log_type_name, query_text, event_time, query_start_time,
+            query_duration_ms, exception_code, exception_text, sql_user, current_database,
+            query_kind, result_rows, result_bytes, scan_rows, scan_bytes, client_address"""
+
+# Fingerprint of a query: Databend's parameterized hash, or the query text with
+# literals replaced when the hash is missing. Patterns are bound as parameters.
+QUERY_NORMALIZE_PATTERNS = [r"'(?:[^']|'')*'", r"\b\d+(?:\.\d+)?\b", r"\s+"]
+QUERY_NORMALIZE_EXPR = "REGEXP_REPLACE(REGEXP_REPLACE(REGEXP_REPLACE(query_text, ?, '?'), ?, '?'), ?, ' ')"
+QUERY_FINGERPRINT_EXPR = f"COALESCE(NULLIF(query_parameterized_hash, ''), {QUERY_NORMALIZE_EXPR})"
+QUERY_SPILLED_BYTES_EXPR = "COALESCE(join_spilled_bytes, 0) + COALESCE(agg_spilled_bytes, 0) + COALESCE(group_by_spilled_bytes, 0)"
+
+# Sort orders of the fingerprint view, all descending
+FINGERPRINT_SORTS = {
+    'totalTime': 'total_ms', 'calls': 'calls', 'p50': 'p50_ms', 'p95': 'p95_ms', 'p99': 'p99_ms',
+    'scanBytes': 'scan_bytes', 'spillBytes': 'spill_bytes', 'errorRate': 'errors * 1.0 / calls'
+}
+
+# Row order of log pages; the trailing keys keep ties on timestamp stable across pages
+LOG_PAGE_ORDER = 'timestamp DESC, query_id DESC, node_id DESC'
+# Oldest-first order of live tail reads, with the same tiebreak so OFFSET skips the rows already sent
+LOG_TAIL_ORDER = 'timestamp ASC, query_id ASC, node_id ASC'
+
+# Request keys that are never treated as legacy key=value column filters
+SYSTEM_FILTER_KEYS = {
+    'queryId', 'level', 'search', 'timeRange', 'startTime', 'endTime',
+    'page', 'pageSize', 'status', 'database', 'user', 'advancedFilters',
+    'cursor', 'nocache', 'mode', 'partTimeouts', 'format', 'maxRows', 'points', 'limit', 'sort'
 }
 
+# Logs of a query are looked up this far around its start and end time
+DRILLDOWN_SLACK = datetime.timedelta(seconds=int(os.environ.get('BENDDASH_DRILLDOWN_SLACK_SECONDS', 60)))
+DRILLDOWN_LOG_LIMIT = 1000
+# With a start time hint, query_history is searched this far on either side of it
+DRILLDOWN_HINT_WINDOW = datetime.timedelta(days=1)
+
+# Bucket width of time distributions when the filters carry no time window
+DEFAULT_BUCKET_SECONDS = 60
+
+# Filter keys describing the time window; absolute startTime/endTime win over timeRange
+TIME_FILTER_KEYS = ('timeRange', 'startTime', 'endTime')
+
+def without_time_filters(filters: Dict) -> Dict:
+    return {k: v for k, v in filters.items() if k not in TIME_FILTER_KEYS}
+
+def parse_time_bound(value) -> Optional[datetime.datetime]:
+    """A UI time bound ('YYYY-MM-DD HH:MM:SS[.ffffff]' or ISO 8601) as naive UTC, or None"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    except ValueError:
+        print(f"⚠️ Ignoring invalid time bound: {value!r}")
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def window_bucket_seconds(filters: Dict) -> int:
+    """Time distribution bucket width for the filters' window and requested point count"""
+    if filters.get('timeRange') in TIME_RANGE_DELTAS:
+        return choose_bucket_seconds(TIME_RANGE_DELTAS[filters['timeRange']], filters.get('points'))
+    start, end = parse_time_bound(filters.get('startTime')), parse_time_bound(filters.get('endTime'))
+    if start and end:
+        return choose_bucket_seconds(end - start, filters.get('points'))
+    return DEFAULT_BUCKET_SECONDS
+
+def resolve_time_window(filters: Dict, now: datetime.datetime = None) -> Dict:
+    """Copy of filters with the time window as absolute startTime/endTime bounds.
+
+    Bounds are snapped outwards to the window's bucket width. A relative
+    timeRange ends at the close of the current bucket, so every refresh within
+    one bucket produces the same query; it is kept for TTLs and rollups.
+    Absolute bounds from the UI replace timeRange.
+    """
+    now = now or datetime.datetime.utcnow()
+    start, end = parse_time_bound(filters.get('startTime')), parse_time_bound(filters.get('endTime'))
+    resolved = {k: v for k, v in filters.items() if k not in ('startTime', 'endTime')}
+    if start or end:
+        end = end or now
+        start = start or end - TIME_RANGE_DELTAS.get(filters.get('timeRange'), TIME_RANGE_DELTAS['1h'])
+        if start >= end:
+            print(f"⚠️ Ignoring empty time window {start} - {end}")
+            return resolved
+        resolved.pop('timeRange', None)
+        seconds = choose_bucket_seconds(end - start, filters.get('points'))
+        start, end = floor_ts(start, seconds), ceil_ts(end, seconds)
+    elif filters.get('timeRange') in TIME_RANGE_DELTAS:
+        seconds = window_bucket_seconds(filters)
+        # Both edges snap outwards, so the window always covers the whole range
+        start = floor_ts(now - TIME_RANGE_DELTAS[filters['timeRange']], seconds)
+        end = ceil_ts(now, seconds)
+    else:
+        return resolved
+    resolved['startTime'], resolved['endTime'] = format_ts(start), format_ts(end)
+    return resolved
+
 class DatabendClient:
-    def __init__(self, dsn=None):
+    def __init__(self, dsn=None, pool_settings: Dict = None):
         self.client = None
+        self.pool = None
         self.database = None
+        self.cache_namespace = None
+        self.pool_settings = pool_settings if pool_settings is not None else pool_settings_from_env()
         if dsn:
             self._connect_with_dsn(dsn)
         else:
@@ -43,59 +152,350 @@ class DatabendClient:
     
     def _connect_with_dsn(self, dsn):
         self.client = BlockingDatabendClient(dsn)
+        self.pool = ConnectionPool(self.client.cursor, **self.pool_settings)
         parsed_dsn = urlparse(dsn)
         if parsed_dsn.path and parsed_dsn.path.strip('/'):
             self.database = parsed_dsn.path.strip('/')
         else:
             self.database = 'system_history'
             print("⚠️ Warning: No database specified in DSN, defaulting to 'system_history'.")
+        # Identify the target without credentials so cached results are never shared across servers
+        self.cache_namespace = f"{parsed_dsn.username or ''}@{parsed_dsn.hostname or ''}:{parsed_dsn.port or ''}"
     
     def execute_query(self, query: str, params: List = None) -> Tuple[List, List, Optional[str]]:
-        import time
         start_time = time.time()
+        query = tag_query(query)
+        db_queries_in_flight.inc()
+        token = None
         
         try:
-            cursor = self.client.cursor()
-            
-            # Log the SQL query and parameters
-            if params:
-                print(f"🔍 Executing SQL: {query}")
-                print(f"📋 Parameters: {params}")
-                cursor.execute(query, params)
-            else:
-                print(f"🔍 Executing SQL: {query}")
-                cursor.execute(query)
-            
-            rows = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            token = query_tracker.start(self)
+            with self.pool.connection() as cursor:
+                wait_time = time.time() - start_time
+                record('db_wait', wait_time)
+                
+                # Log the SQL query and parameters
+                with phase('db_execute'):
+                    if params:
+                        print(f"🔍 Executing SQL: {query}")
+                        print(f"📋 Parameters: {params}")
+                        cursor.execute(query, params)
+                    else:
+                        print(f"🔍 Executing SQL: {query}")
+                        cursor.execute(query)
+                
+                with phase('db_fetch'):
+                    rows = cursor.fetchall()
+                columns = [desc[0] for desc in cursor.description] if cursor.description else []
             
             # Calculate and log execution time
             execution_time = time.time() - start_time
             row_count = len(rows) if rows else 0
-            print(f"⏱️  Query executed in {execution_time:.3f}s, returned {row_count} rows")
+            print(f"⏱️  Query executed in {execution_time:.3f}s (waited {wait_time:.3f}s for a connection), returned {row_count} rows")
+            observe_db_query(execution_time, row_count)
             
             return rows, columns, None
         except Exception as e:
             execution_time = time.time() - start_time
             print(f"❌ Query failed after {execution_time:.3f}s: {str(e)}")
+            observe_db_query(execution_time, 0, error=True)
             return [], [], str(e)
+        finally:
+            query_tracker.finish(token)
+            db_queries_in_flight.dec()
+    
+    def iter_query(self, query: str, params: List = None, batch_size: int = 5000, operation: str = 'export') -> Iterator[Tuple[List, List]]:
+        """Execute a query and yield (columns, rows) batches as they are fetched.
+
+        The connection stays checked out until the generator is exhausted or
+        closed; a generator closed early discards it, since the cursor still
+        holds unread results, and has the statement killed on the server.
+        """
+        # Streaming outlives the request, so its query context is taken now
+        context = cancellation.current()
+        return self._iter_query(tag_query(query, context), params, batch_size, operation, context)
+    
+    def _iter_query(self, query: str, params: Optional[List], batch_size: int, operation: str,
+                    context: Optional[cancellation.QueryContext]) -> Iterator[Tuple[List, List]]:
+        start_time = time.time()
+        row_count = 0
+        failed = False
+        db_queries_in_flight.inc()
+        token = None
+        
+        try:
+            token = query_tracker.start(self, context)
+            with self.pool.connection() as cursor:
+                print(f"🔍 Streaming SQL: {query}")
+                if params:
+                    print(f"📋 Parameters: {params}")
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                columns = [desc[0] for desc in cursor.description] if cursor.description else []
+                
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    row_count += len(rows)
+                    yield columns, rows
+                if row_count == 0:
+                    # Still hand out the columns, so empty exports get a CSV header and a Parquet schema
+                    yield columns, []
+        except GeneratorExit:
+            # The client went away while the statement was still producing rows
+            if context is not None:
+                query_tracker.kill(context.request_id, 'disconnected')
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            query_tracker.finish(token)
+            db_queries_in_flight.dec()
+            # Streaming outlives the request context, so the operation label is passed in
+            with operation_scope(operation):
+                observe_db_query(time.time() - start_time, row_count, error=failed)
+        
+        print(f"⏱️  Streamed {row_count} rows in {time.time() - start_time:.3f}s")
+    
+    def kill_tagged(self, request_id: str) -> int:
+        """KILL QUERY the statements still running for a request; returns how many were found"""
+        # A connection of its own, so a kill never waits behind a full pool
+        cursor = self.client.cursor()
+        try:
+            # The tag is split in two so this lookup doesn't find itself
+            cursor.execute("SELECT id FROM system.processes WHERE extra_info LIKE CONCAT('%benddash-request:', ?, ' %')", [request_id])
+            process_ids = [row[0] for row in cursor.fetchall() if valid_process_id(row[0])]
+            for process_id in process_ids:
+                cursor.execute(f"KILL QUERY '{process_id}'")
+            return len(process_ids)
+        finally:
+            cursor.close()
+    
+    def tagged_progress(self, request_id: str) -> Dict[str, int]:
+        """Scan progress of the statements still running for a request, from system.processes"""
+        rows, _, error = self.execute_query(
+            "SELECT COUNT(*), SUM(scan_progress_read_rows), SUM(scan_progress_read_bytes) FROM system.processes "
+            "WHERE extra_info LIKE CONCAT('%benddash-request:', ?, ' %')", [request_id])
+        if error:
+            raise RuntimeError(error)
+        statements, read_rows, read_bytes = rows[0] if rows else (0, 0, 0)
+        return {'runningStatements': int(statements or 0), 'rowsScanned': int(read_rows or 0), 'bytesScanned': int(read_bytes or 0)}
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        return self.pool.stats() if self.pool else {}
+    
+    @property
+    def closed(self) -> bool:
+        return self.pool is not None and self.pool.closed
+    
+    def close(self):
+        # Background work reading through this client ends with it
+        release_rollup(self)
+        if self.pool:
+            self.pool.close()
 
 class BaseRepository:
     """Base repository class with shared functionality"""
-    def __init__(self, db_client: DatabendClient):
+    # Result key of the page rows and how they are encoded for format=columnar
+    PAGE_KEY = None
+    DICTIONARY_COLUMNS = ()
+    TIMESTAMP_COLUMNS = ()
+    
+    def __init__(self, db_client: DatabendClient, cache: ResultCache = None):
         self.db = db_client
+        self.cache = cache if cache is not None else result_cache
     
-    def _add_time_filter(self, conditions: List[str], filters: Dict, time_field: str = 'timestamp'):
-        """Add time range filter to conditions"""
-        if filters.get('timeRange') in TIME_RANGES:
-            conditions.append(f"{time_field} >= {TIME_RANGES[filters['timeRange']]}")
+    def _cache_key(self, namespace: str, filters: Dict) -> str:
+        return self.cache.make_key(f"{self.db.cache_namespace}:{namespace}", self.db.database, filters)
     
-    def _add_search_filter(self, conditions: List[str], params: List, filters: Dict):
-        """Add search filter with case-insensitive matching"""
+    def _cached(self, namespace: str, filters: Dict, loader):
+        """Serve a result from the cache, loading it once on miss"""
+        if filters.get('nocache'):
+            return loader()[0]
+        value, etag = self.cache.get_or_load_with_etag(self._cache_key(namespace, filters), loader, ttl=self.cache.ttl_for(filters))
+        # Lets the response layer answer If-None-Match without serializing the value
+        note_result_etag(etag)
+        return value
+    
+    def _encode_page(self, result: Dict, filters: Dict) -> Dict:
+        """Re-encode the page rows column by column when the client asked for format=columnar"""
+        rows = result.get(self.PAGE_KEY)
+        if not wants_columnar(filters) or not isinstance(rows, list):
+            return result
+        return {**result, self.PAGE_KEY: encode_rows(rows, self.DICTIONARY_COLUMNS, self.TIMESTAMP_COLUMNS)}
+    
+    def _encoded(self, filters: Dict, loader):
+        """Wrap a (result, cacheable) loader so the cached result is already encoded
+        and reports how text search was executed"""
+        def load():
+            result, cacheable = loader()
+            result = self._encode_page(result, filters)
+            if filters.get('search'):
+                result['searchPath'] = self._search_condition(filters['search'])[2]
+            result['window'] = self._window_info(filters)
+            return result, cacheable
+        return load
+    
+    def _window_info(self, filters: Dict) -> Optional[Dict]:
+        """Resolved bounds and bucket width, so the UI can zoom into a bucket"""
+        if not filters.get('startTime'):
+            return None
+        return {
+            'start': filters['startTime'],
+            'end': filters['endTime'],
+            'bucketSeconds': window_bucket_seconds(filters)
+        }
+    
+    def _query_or_raise(self, query: str, params: List = None) -> Tuple[List, List]:
+        """Execute a query for a fan-out part; errors propagate so the part is reported as failed"""
+        rows, columns, error = self.db.execute_query(query, params)
+        if error:
+            raise RuntimeError(error)
+        return rows or [], columns
+    
+    def _incremental_time_distribution(self, filters: Dict, table: str, time_field: str, label_expr: str, source=None):
+        """Loader for the time distribution through the closed-bucket cache.
+
+        source(where) renders what is counted, given the row condition; by
+        default the table itself. Returns None when the filters don't describe
+        a relative time window that is still live.
+        """
+        time_range = filters.get('timeRange')
+        if not INCREMENTAL_HISTOGRAM or filters.get('queryId') or time_range not in TIME_RANGE_DELTAS:
+            return None
+        # Windows that already ended have no open bucket to refresh; they are counted in one scan
+        window_end = parse_time_bound(filters.get('endTime'))
+        if window_end is not None and window_end <= datetime.datetime.utcnow():
+            return None
+        
+        base_conditions, base_params = self._build_where_clause(without_time_filters(filters))
+        bucket_seconds = window_bucket_seconds(filters)
+        source = source or (lambda where: f"{self.db.database}.{table} WHERE {where}")
+        key = histogram_cache.make_key(f"{self.db.cache_namespace}:{self.db.database}.{table}", source(base_conditions), base_params, bucket_seconds)
+        window_start = parse_time_bound(filters.get('startTime')) or datetime.datetime.utcnow() - TIME_RANGE_DELTAS[time_range]
+        
+        operation = f"{type(self).__name__}._incremental_time_distribution"
+        
+        def fetch(range_condition: str, range_params: List) -> List[Tuple]:
+            where = " AND ".join(c for c in [base_conditions, range_condition.format(time_field=time_field)] if c)
+            query = f"""
+            SELECT
+                {time_bucket_sql(time_field, bucket_seconds)}::VARCHAR as time_bucket,
+                {label_expr} as label,
+                COUNT(*) as count
+            FROM {source(where)}
+            GROUP BY time_bucket, label
+            """
+            with operation_scope(operation):
+                rows, _ = self._query_or_raise(query, base_params + range_params)
+            return rows
+        
+        return lambda: histogram_cache.get(key, window_start, bucket_seconds, fetch, window_end=window_end)
+    
+    def _rollup_window(self, source: str, filters: Dict, dimension_keys: Tuple[str, ...]):
+        """Plan for answering aggregates from the rollup, or None.
+
+        Only relative time windows with filters that map onto rollup
+        dimensions qualify; free-text search and raw WHERE conditions do not.
+        Returns (aggregator, window_start, first_full, rollup_end, precision_seconds, dimensions).
+        """
+        time_range = filters.get('timeRange')
+        # Rollups hold whole minutes, so only minute-multiple buckets can be answered from them
+        if time_range not in TIME_RANGE_DELTAS or window_bucket_seconds(filters) % 60:
+            return None
+        if filters.get('queryId') or filters.get('search') or filters.get('advancedFilters'):
+            return None
+        dimensions = {}
+        for key, value in filters.items():
+            if key in SYSTEM_FILTER_KEYS or not value or not str(value).strip():
+                continue
+            if key not in dimension_keys:
+                return None
+            dimensions[key] = value
+        
+        aggregator = rollup_for(self.db)
+        if aggregator is None:
+            return None
+        precision_seconds = window_bucket_seconds(filters)
+        window_start = parse_time_bound(filters.get('startTime')) or datetime.datetime.utcnow() - TIME_RANGE_DELTAS[time_range]
+        coverage = aggregator.coverage(source, window_start, precision_seconds)
+        if coverage is None:
+            return None
+        return aggregator, window_start, coverage[0], coverage[1], precision_seconds, dimensions
+    
+    @db_operation
+    def _edge_aggregate(self, filters: Dict, table: str, time_field: str, select: str, group_by: str,
+                        window_start: datetime.datetime, first_full: datetime.datetime, rollup_end: datetime.datetime) -> List[Tuple]:
+        """Aggregate the parts of the window the rollup does not cover:
+        the partial head bucket and everything after the rollup watermark"""
+        base_conditions, base_params = self._build_where_clause(without_time_filters(filters))
+        range_condition = f"(({time_field} >= ? AND {time_field} < ?) OR {time_field} >= ?)"
+        where = " AND ".join(c for c in [base_conditions, range_condition] if c)
+        query = f"""
+        SELECT {select}
+        FROM {self.db.database}.{table}
+        WHERE {where}
+        GROUP BY {group_by}
+        """
+        range_params = [format_ts(window_start), format_ts(first_full), format_ts(rollup_end)]
+        rows, _ = self._query_or_raise(query, base_params + range_params)
+        return rows
+    
+    def _resolve_time_dist(self, future) -> Tuple[List, Optional[str]]:
+        """Wait for an incremental time distribution started next to the main query"""
+        if future is None:
+            return [], None
+        try:
+            with phase('time_dist_wait'):
+                return future.result(), None
+        except Exception as e:
+            print(f"❌ Incremental time distribution failed: {e}")
+            return [], str(e)
+    
+    def _count_part(self, total_count: int, page_size: int) -> Dict[str, int]:
+        return {'total': total_count, 'totalPages': (total_count + page_size - 1) // page_size}
+    
+    def _run_fanout(self, namespace: str, filters: Dict, parts: Dict, page: int, page_size: int) -> Dict[str, Any]:
+        """Serve a complete cached result or run the parts concurrently"""
+        key = self._cache_key(namespace, filters)
+        if not filters.get('nocache'):
+            cached, etag = self.cache.get_with_etag(key)
+            if cached is not None:
+                note_result_etag(etag)
+                return cached
+        
+        result, pending, token = fanout_executor.run(parts, filters.get('partTimeouts'))
+        result.update({'page': page, 'pageSize': page_size, 'pending': pending, 'partsToken': token})
+        if filters.get('search'):
+            result['searchPath'] = self._search_condition(filters['search'])[2]
+        result['window'] = self._window_info(filters)
+        if not pending and not result.get('failedParts'):
+            note_result_etag(self.cache.set(key, result, self.cache.ttl_for(filters)))
+        return result
+    
+    def _add_time_filter(self, conditions: List[str], params: List, filters: Dict, time_field: str = 'timestamp'):
+        """Bound time_field to the [startTime, endTime) window, resolving a relative timeRange first"""
+        window = filters if filters.get('startTime') and filters.get('endTime') else resolve_time_window(filters)
+        if window.get('startTime'):
+            conditions.append(f"{time_field} >= ? AND {time_field} < ?")
+            params.extend([window['startTime'], window['endTime']])
+    
+    def _search_condition(self, search: str) -> Tuple[str, List, str]:
+        """Text search condition using the search column's index when it has one"""
         search_field = self._get_search_field()
+        index_type = resolve_index_type(self.db, self._get_search_table(), search_field)
+        return build_search_condition(search, search_field, index_type)
+    
+    def _add_search_filter(self, conditions: List[str], params: List, filters: Dict):
+        """Add search filter: full-text MATCH/QUERY on indexed columns, case-insensitive LIKE otherwise"""
         if filters.get('search'):
-            conditions.append(f"UPPER({search_field}) LIKE UPPER(?)")
-            params.append(f"%{filters['search']}%")
+            condition, search_params, _ = self._search_condition(filters['search'])
+            if condition:
+                conditions.append(condition)
+                params.extend(search_params)
     
     def _add_advanced_filters(self, conditions: List[str], params: List, filters: Dict):
         """Add advanced filters (WHERE conditions)"""
@@ -110,40 +510,84 @@ class BaseRepository:
                     conditions.append(f"({condition.strip()})")
         else:
             # Legacy format: key=value pairs (for backward compatibility)
-            # System parameters that should not be treated as database filters
-            system_params = {
-                'queryId', 'level', 'search', 'timeRange', 
-                'page', 'pageSize', 'status', 'database', 'advancedFilters'
-            }
-            
             for key, value in filters.items():
-                if key not in system_params and value and value.strip():
+                if key not in SYSTEM_FILTER_KEYS and value and value.strip():
                     conditions.append(f"{key} = ?")
                     params.append(value)
 
 class LogRepository(BaseRepository):
-    def __init__(self, db_client: DatabendClient):
-        super().__init__(db_client)
+    PAGE_KEY = 'logs'
+    DICTIONARY_COLUMNS = ('log_level', 'target', 'path', 'cluster_id', 'node_id', 'warehouse_id')
+    TIMESTAMP_COLUMNS = ('timestamp',)
+    
+    def __init__(self, db_client: DatabendClient, cache: ResultCache = None):
+        super().__init__(db_client, cache)
     
     def _get_search_field(self):
         """Return the field name used for searching in logs"""
         return 'message'
     
+    def _get_search_table(self):
+        return 'log_history'
+    
     def get_logs(self, filters: Dict) -> Dict[str, Any]:
         page = filters.get('page', 1)
         page_size = min(filters.get('pageSize', 200), 200)
         offset = (page - 1) * page_size
+        cursor = self._decode_cursor(filters.get('cursor'))
         
-        where_conditions, params = self._build_where_clause(filters)
-        where_clause = f"WHERE {where_conditions}" if where_conditions else ""
+        with phase('sql_build'):
+            # Resolved once so every part of the response shares the same bounds
+            filters = resolve_time_window(filters)
+            where_conditions, params = self._build_where_clause(filters)
+            where_clause = f"WHERE {where_conditions}" if where_conditions else ""
+            
+            # Get global stats (without level filter) for the same time range and search
+            stats_filters = {k: v for k, v in filters.items() if k != 'level'}
+            stats_where_conditions, stats_params = self._build_where_clause(stats_filters)
+            stats_where_clause = f"WHERE {stats_where_conditions}" if stats_where_conditions else ""
         
-        # Get global stats (without level filter) for the same time range and search
-        stats_filters = {k: v for k, v in filters.items() if k != 'level'}
-        stats_where_conditions, stats_params = self._build_where_clause(stats_filters)
-        stats_where_clause = f"WHERE {stats_where_conditions}" if stats_where_conditions else ""
+        rollup_plan = self._rollup_window('log', stats_filters, ('node_id', 'warehouse_id'))
+        if rollup_plan:
+            return self._cached('logs', filters, self._encoded(filters, lambda: self._get_logs_rollup(
+                filters, rollup_plan, where_clause, params, page_size, offset, page, cursor)))
+        
+        time_dist_loader = self._incremental_time_distribution(stats_filters, 'log_history', 'timestamp', 'log_level')
+        
+        if filters.get('mode') == 'fanout':
+            return self._get_logs_fanout(filters, where_clause, params, stats_where_clause, stats_params, page_size, offset, page, cursor, time_dist_loader)
         
         # Execute all queries in parallel using a single CTE query to reduce database requests
-        return self._get_logs_combined(where_clause, params, stats_where_clause, stats_params, page_size, offset, filters.get('timeRange', '5m'), page)
+        return self._cached('logs', filters, self._encoded(filters, lambda: self._get_logs_combined(
+            where_clause, params, stats_where_clause, stats_params, page_size, offset, window_bucket_seconds(filters), page, cursor, time_dist_loader)))
+    
+    def _decode_cursor(self, cursor: Optional[str]) -> Optional[Dict]:
+        """Decode an opaque page cursor; invalid cursors fall back to page-number mode"""
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            return {'ts': str(data['ts']), 'skip': int(data.get('skip', 0))}
+        except Exception as e:
+            print(f"⚠️ Ignoring invalid page cursor {cursor!r}: {e}")
+            return None
+    
+    def _encode_cursor(self, ts: str, skip: int) -> str:
+        payload = json.dumps({'ts': ts, 'skip': skip}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+    
+    def _next_cursor(self, logs: List[Dict], page_size: int, cursor: Optional[Dict]) -> Optional[str]:
+        """Cursor for the page after this one: the oldest timestamp on the page plus
+        how many rows with exactly that timestamp have already been shown"""
+        if len(logs) < page_size:
+            return None
+        last_ts = min(log['timestamp'] for log in logs)
+        skip = sum(1 for log in logs if log['timestamp'] == last_ts)
+        if cursor and cursor['ts'] == last_ts:
+            # The run of equal timestamps started on an earlier page
+            skip += cursor['skip']
+        return self._encode_cursor(last_ts, skip)
     
     def _build_where_clause(self, filters: Dict) -> Tuple[str, List]:
         conditions = []
@@ -156,7 +600,7 @@ class LogRepository(BaseRepository):
             if filters.get('level') and filters['level'] in LEVEL_MAP:
                 conditions.append(f"log_level = '{LEVEL_MAP[filters['level']]}'")
         else:
-            self._add_time_filter(conditions, filters)
+            self._add_time_filter(conditions, params, filters)
             
             # Level mapping
             if filters.get('level') and filters['level'] in LEVEL_MAP:
@@ -169,17 +613,51 @@ class LogRepository(BaseRepository):
         
         return " AND ".join(conditions), params
     
-    def _get_logs_combined(self, where_clause: str, params: List, stats_where_clause: str, stats_params: List, page_size: int, offset: int, time_range: str, page: int) -> Dict[str, Any]:
-        """Combined query to get logs, stats, count and time distribution in one request"""
-        is_query_id_search = any('query_id = ?' in where_clause for _ in [where_clause])
-        
-        if is_query_id_search:
-            precision = 'HOUR'
+    @db_operation
+    def _get_logs_combined(self, where_clause: str, params: List, stats_where_clause: str, stats_params: List, page_size: int, offset: int, bucket_seconds: int, page: int, cursor: Optional[Dict] = None, time_dist_loader=None) -> Dict[str, Any]:
+        """Combined query to get logs, stats, count and time distribution in one request.
+
+        With a time_dist_loader the time distribution is computed incrementally
+        alongside the combined query instead of as one of its branches.
+        Returns (result, cacheable); failed queries are not cacheable.
+        """
+        time_dist_future = fanout_executor.submit(time_dist_loader) if time_dist_loader else None
+        bucket_seconds = self._query_id_bucket_seconds(where_clause, bucket_seconds)
+        
+        # Keyset mode seeks to the cursor timestamp instead of sorting every row before the offset
+        if cursor:
+            page_where_clause = f"{where_clause} AND timestamp <= ?" if where_clause else "WHERE timestamp <= ?"
+            page_params = params + [cursor['ts']]
+            page_offset = cursor['skip']
         else:
-            precision = BUCKET_PRECISION.get(time_range, 'MINUTE')
+            page_where_clause = where_clause
+            page_params = params
+            page_offset = offset
         
         # Create parameter list combining both where clauses
-        all_params = params + stats_params + params + stats_params
+        all_params = params + stats_params + page_params
+        
+        time_dist_cte = ""
+        time_dist_select = ""
+        if not time_dist_future:
+            all_params += stats_params
+            time_dist_cte = f""",
+        -- Get time distribution
+        time_dist_data AS (
+            SELECT
+                {time_bucket_sql('timestamp', bucket_seconds)} as time_bucket,
+                log_level,
+                COUNT(*) as count
+            FROM {self.db.database}.log_history
+            {stats_where_clause}
+            GROUP BY time_bucket, log_level
+        )"""
+            time_dist_select = """
+        UNION ALL
+        SELECT 
+            'time_dist' as data_type, time_bucket::VARCHAR as value1, log_level as value2, count::VARCHAR as value3,
+            NULL as value4, NULL as value5, NULL as value6, NULL as value7, NULL as value8, NULL as value9, NULL as value10
+        FROM time_dist_data"""
         
         combined_query = f"""
         WITH 
@@ -202,21 +680,12 @@ class LogRepository(BaseRepository):
         logs_data AS (
             SELECT 
                 timestamp, query_id, log_level, target, message, path,
-                cluster_id, node_id, warehouse_id, fields,
-                ROW_NUMBER() OVER (ORDER BY timestamp DESC) as rn
+                cluster_id, node_id, warehouse_id, fields
             FROM {self.db.database}.log_history
-            {where_clause}
-        ),
-        -- Get time distribution
-        time_dist_data AS (
-            SELECT
-                TRUNC(timestamp, '{precision}') as time_bucket,
-                log_level,
-                COUNT(*) as count
-            FROM {self.db.database}.log_history
-            {stats_where_clause}
-            GROUP BY time_bucket, log_level
-        )
+            {page_where_clause}
+            ORDER BY {LOG_PAGE_ORDER}
+            LIMIT {page_size} OFFSET {page_offset}
+        ){time_dist_cte}
         SELECT 
             'count' as data_type, total_count::VARCHAR as value1, NULL as value2, NULL as value3, NULL as value4, NULL as value5, NULL as value6, NULL as value7, NULL as value8, NULL as value9, NULL as value10
         FROM count_data
@@ -229,21 +698,17 @@ class LogRepository(BaseRepository):
             'logs' as data_type, 
             timestamp::VARCHAR as value1, query_id as value2, log_level as value3, target as value4, 
             message as value5, path as value6, cluster_id as value7, node_id as value8, warehouse_id as value9, fields as value10
-        FROM logs_data
-        WHERE rn > {offset} AND rn <= {offset + page_size}
-        UNION ALL
-        SELECT 
-            'time_dist' as data_type, time_bucket::VARCHAR as value1, log_level as value2, count::VARCHAR as value3,
-            NULL as value4, NULL as value5, NULL as value6, NULL as value7, NULL as value8, NULL as value9, NULL as value10
-        FROM time_dist_data
+        FROM logs_data{time_dist_select}
         ORDER BY data_type, value1
         """
         
         results, _, error = self.db.execute_query(combined_query, all_params)
+        time_dist_rows, time_dist_error = self._resolve_time_dist(time_dist_future)
         if error or not results:
-            return {'logs': [], 'total': 0, 'page': page, 'pageSize': page_size, 'totalPages': 0, 'stats': {'total': 0, 'error': 0, 'warning': 0, 'info': 0, 'debug': 0}, 'timeDistribution': []}
+            return {'logs': [], 'total': 0, 'page': page, 'pageSize': page_size, 'totalPages': 0, 'stats': {'total': 0, 'error': 0, 'warning': 0, 'info': 0, 'debug': 0}, 'timeDistribution': []}, not error
         
         # Parse results
+        decode_start = time.perf_counter()
         total_count = 0
         stats = {'total': 0, 'error': 0, 'warning': 0, 'info': 0, 'debug': 0}
         logs = []
@@ -285,7 +750,11 @@ class LogRepository(BaseRepository):
                 time_buckets[time_bucket]['total'] += count
         
         stats['total'] = sum(stats[key] for key in ['error', 'warning', 'info', 'debug'])
-        time_distribution = sorted(time_buckets.values(), key=lambda x: x['time_bucket'] or '')
+        if time_dist_future:
+            time_distribution = self._format_time_distribution(time_dist_rows)
+        else:
+            time_distribution = sorted(time_buckets.values(), key=lambda x: x['time_bucket'] or '')
+        record('decode', time.perf_counter() - decode_start)
         
         return {
             'logs': logs,
@@ -293,15 +762,176 @@ class LogRepository(BaseRepository):
             'page': page,
             'pageSize': page_size,
             'totalPages': (total_count + page_size - 1) // page_size,
+            'nextCursor': self._next_cursor(logs, page_size, cursor),
             'stats': stats,
             'timeDistribution': time_distribution
+        }, not time_dist_error
+    
+    def _get_logs_fanout(self, filters: Dict, where_clause: str, params: List, stats_where_clause: str, stats_params: List, page_size: int, offset: int, page: int, cursor: Optional[Dict], time_dist_loader=None) -> Dict[str, Any]:
+        """Run page, count, stats and time distribution as concurrent queries.
+
+        Parts still running after their timeout are reported in 'pending' and
+        can be collected with the returned 'partsToken'.
+        """
+        bucket_seconds = self._query_id_bucket_seconds(stats_where_clause, window_bucket_seconds(filters))
+        parts = {
+            'logs': lambda: self._encode_page(self._logs_page_part(where_clause, params, page_size, offset, cursor), filters),
+            'count': lambda: self._count_part(self._get_total_count(where_clause, params), page_size),
+            'stats': lambda: {'stats': self._get_stats(stats_where_clause, stats_params)},
+            'timeDistribution': lambda: {'timeDistribution': self._format_time_distribution(time_dist_loader())
+                                         if time_dist_loader else self._get_time_distribution(stats_where_clause, stats_params, bucket_seconds)}
         }
+        return self._run_fanout('logs', filters, parts, page, page_size)
+    
+    def _get_logs_rollup(self, filters: Dict, plan: Tuple, where_clause: str, params: List,
+                         page_size: int, offset: int, page: int, cursor: Optional[Dict]) -> Tuple[Dict[str, Any], bool]:
+        """Page from log_history; count, stats and time distribution from the rollup
+        plus a live scan of the window edges. Returns (result, cacheable)."""
+        aggregator, window_start, first_full, rollup_end, precision_seconds, dimensions = plan
+        page_future = fanout_executor.submit(self._logs_page_part, where_clause, params, page_size, offset, cursor)
+        
+        stats_filters = {k: v for k, v in filters.items() if k != 'level'}
+        try:
+            rows = aggregator.log_buckets(first_full, rollup_end, precision_seconds, dimensions=dimensions)
+            rows += self._edge_aggregate(
+                stats_filters, 'log_history', 'timestamp',
+                f"{time_bucket_sql('timestamp', precision_seconds)}::VARCHAR as time_bucket, log_level, COUNT(*) as count",
+                "time_bucket, log_level", window_start, first_full, rollup_end)
+            page_part = page_future.result()
+        except Exception as e:
+            print(f"❌ Rollup log query failed: {e}")
+            return {'error': str(e), 'logs': [], 'total': 0, 'page': page, 'pageSize': page_size, 'totalPages': 0}, False
+        
+        level_totals = {}
+        for _, log_level, count in rows:
+            level_totals[log_level] = level_totals.get(log_level, 0) + int(count)
+        
+        stats = {'total': 0, 'error': 0, 'warning': 0, 'info': 0, 'debug': 0}
+        level_map = {'ERROR': 'error', 'WARN': 'warning', 'INFO': 'info', 'DEBUG': 'debug'}
+        for level, count in level_totals.items():
+            if level in level_map:
+                stats[level_map[level]] = count
+        stats['total'] = sum(stats[key] for key in ['error', 'warning', 'info', 'debug'])
+        
+        if filters.get('level') in LEVEL_MAP:
+            total_count = level_totals.get(LEVEL_MAP[filters['level']], 0)
+        else:
+            total_count = sum(level_totals.values())
+        
+        return {
+            **page_part,
+            'total': total_count,
+            'page': page,
+            'pageSize': page_size,
+            'totalPages': (total_count + page_size - 1) // page_size,
+            'stats': stats,
+            'timeDistribution': self._format_time_distribution(rows),
+            'aggregates': 'rollup'
+        }, True
+    
+    def _logs_page_part(self, where_clause: str, params: List, page_size: int, offset: int, cursor: Optional[Dict]) -> Dict[str, Any]:
+        if cursor:
+            where_clause = f"{where_clause} AND timestamp <= ?" if where_clause else "WHERE timestamp <= ?"
+            params = params + [cursor['ts']]
+            offset = cursor['skip']
+        logs = self._get_paginated_logs(where_clause, params, page_size, offset)
+        # Same row order as the combined query, which sorts the page by timestamp text
+        logs.sort(key=lambda log: log['timestamp'] or '')
+        return {'logs': logs, 'nextCursor': self._next_cursor(logs, page_size, cursor)}
+    
+    @db_operation
+    def get_logs_since(self, filters: Dict, since: str, limit: int, skip: int = 0) -> Tuple[List[Dict], Optional[str]]:
+        """Logs matching the filters with timestamp >= since, oldest first.
+
+        Used by live tail: the time range filter is replaced by the lower bound,
+        so each call is a small range scan at the head of the table.
+        """
+        conditions, params = self._build_where_clause(without_time_filters(filters))
+        where = " AND ".join(c for c in [conditions, "timestamp >= ?"] if c)
+        query = f"""
+        SELECT 
+            timestamp::VARCHAR AS timestamp,
+            query_id,
+            log_level,
+            target,
+            message,
+            path,
+            cluster_id,
+            node_id,
+            warehouse_id,
+            fields
+        FROM {self.db.database}.log_history
+        WHERE {where}
+        ORDER BY {LOG_TAIL_ORDER}
+        LIMIT {limit} OFFSET {skip}
+        """
+        results, columns, error = self.db.execute_query(query, params + [since])
+        if error:
+            return [], error
+        return [dict(zip(columns, row)) for row in results], None
+    
+    def get_log_patterns(self, filters: Dict) -> Dict[str, Any]:
+        """Message templates of the filtered logs with counts, sample query ids and sparklines.
+
+        Messages are streamed rather than paged and clustered as they arrive;
+        the miner remembers the range it has seen, so widening or refreshing
+        the window only reads the new rows.
+        """
+        limit = max(1, min(int(filters.get('limit') or 50), 500))
+        with phase('sql_build'):
+            # Without a window, patterns cover the last hour
+            filters = resolve_time_window({'timeRange': '1h', **filters})
+            base_conditions, base_params = self._build_where_clause(without_time_filters(filters))
+        start, end = parse_time_bound(filters.get('startTime')), parse_time_bound(filters.get('endTime'))
+        if not start or not end:
+            return {'error': 'A time window is required', 'patterns': []}
+        
+        key = pattern_cache.make_key(f"{self.db.cache_namespace}:{self.db.database}.log_history", base_conditions, base_params)
+        operation = f"{type(self).__name__}.get_log_patterns"
+        
+        def stream(range_start: str, range_end: str, max_rows: int):
+            where = " AND ".join(c for c in [base_conditions, "timestamp >= ? AND timestamp < ?"] if c)
+            query = f"""
+            SELECT timestamp::VARCHAR, query_id, message
+            FROM {self.db.database}.log_history
+            WHERE {where}
+            LIMIT {int(max_rows)}
+            """
+            for _, rows in self.db.iter_query(query, base_params + [range_start, range_end], operation=operation):
+                yield from rows
+        
+        try:
+            result = pattern_cache.get(key, start, end, window_bucket_seconds(filters), stream, limit, PATTERN_MAX_ROWS)
+        except Exception as e:
+            print(f"❌ Log pattern mining failed: {e}")
+            return {'error': str(e), 'patterns': []}
+        if filters.get('search'):
+            result['searchPath'] = self._search_condition(filters['search'])[2]
+        result['window'] = self._window_info(filters)
+        return result
+    
+    def export_logs(self, filters: Dict, max_rows: int) -> Iterator[Tuple[List, List]]:
+        """Stream every log row matching the filters, newest first, in batches"""
+        where_conditions, params = self._build_where_clause(filters)
+        where_clause = f"WHERE {where_conditions}" if where_conditions else ""
+        query = f"""
+        SELECT 
+            timestamp, query_id, log_level, target, message, path,
+            cluster_id, node_id, warehouse_id, fields
+        FROM {self.db.database}.log_history
+        {where_clause}
+        ORDER BY {LOG_PAGE_ORDER}
+        LIMIT {int(max_rows)}
+        """
+        return self.db.iter_query(query, params, operation=f"{type(self).__name__}.export")
     
+    @db_operation
     def _get_total_count(self, where_clause: str, params: List) -> int:
         query = f"SELECT COUNT(*) FROM {self.db.database}.log_history {where_clause}"
-        results, _, error = self.db.execute_query(query, params)
-        return results[0][0] if results and not error else 0
+        results, _ = self._query_or_raise(query, params)
+        return int(results[0][0]) if results and results[0][0] else 0
     
+    @db_operation
     def _get_stats(self, where_clause: str, params: List) -> Dict[str, int]:
         query = f"""
         SELECT 
@@ -312,24 +942,25 @@ class LogRepository(BaseRepository):
         GROUP BY log_level
         """
         
-        results, _, error = self.db.execute_query(query, params)
+        results, _ = self._query_or_raise(query, params)
         stats = {'total': 0, 'error': 0, 'warning': 0, 'info': 0, 'debug': 0}
         
-        if not error and results:
-            # Map database levels to frontend levels
-            level_map = {'ERROR': 'error', 'WARN': 'warning', 'INFO': 'info', 'DEBUG': 'debug'}
-            for level, count in results:
-                if level in level_map:
-                    stats[level_map[level]] = count
-            # Calculate total from individual counts
-            stats['total'] = sum(stats[key] for key in ['error', 'warning', 'info', 'debug'])
+        # Map database levels to frontend levels
+        level_map = {'ERROR': 'error', 'WARN': 'warning', 'INFO': 'info', 'DEBUG': 'debug'}
+        for level, count in results:
+            if level in level_map:
+                stats[level_map[level]] = int(count)
+        # Calculate total from individual counts
+        stats['total'] = sum(stats[key] for key in ['error', 'warning', 'info', 'debug'])
         
         return stats
     
+    @db_operation
     def _get_paginated_logs(self, where_clause: str, params: List, page_size: int, offset: int) -> List[Dict]:
+        # Timestamps are rendered by the server, matching the combined query and page cursors
         query = f"""
         SELECT 
-            timestamp,
+            timestamp::VARCHAR AS timestamp,
             query_id,
             log_level,
             target,
@@ -341,38 +972,23 @@ class LogRepository(BaseRepository):
             fields
         FROM {self.db.database}.log_history
         {where_clause}
-        ORDER BY timestamp DESC
+        ORDER BY {LOG_PAGE_ORDER}
         LIMIT {page_size} OFFSET {offset}
         """
         
-        results, columns, error = self.db.execute_query(query, params)
-        if error or not results:
-            return []
-        
-        logs = []
-        for row in results:
-            log_dict = dict(zip(columns, row))
-            if log_dict.get('timestamp'):
-                log_dict['timestamp'] = log_dict['timestamp'].isoformat()
-            logs.append(log_dict)
-        
-        return logs
+        results, columns = self._query_or_raise(query, params)
+        return [dict(zip(columns, row)) for row in results]
     
-    def _get_time_distribution(self, where_clause: str, params: List, time_range: str) -> List[Dict]:
-        """Generate time distribution data for charts"""
-        # Check if this is a query ID search (no time range needed)
-        is_query_id_search = any('query_id = ?' in where_clause for _ in [where_clause])
-        
-        if is_query_id_search:
-            # For query ID search, use HOUR precision and no time range
-            precision = 'HOUR'
-        else:
-            # Determine bucket precision based on time range
-            precision = BUCKET_PRECISION.get(time_range, 'MINUTE')
-        
+    def _query_id_bucket_seconds(self, where_clause: str, bucket_seconds: int) -> int:
+        """Query ID searches have no time range, so their charts use hourly buckets"""
+        return 3600 if 'query_id = ?' in where_clause else bucket_seconds
+    
+    @db_operation
+    def _get_time_distribution(self, where_clause: str, params: List, bucket_seconds: int) -> List[Dict]:
+        """Generate time distribution data for charts, in buckets of bucket_seconds"""
         query = f"""
         SELECT
-            TRUNC(timestamp, '{precision}') as time_bucket,
+            {time_bucket_sql('timestamp', bucket_seconds)}::VARCHAR as time_bucket,
             log_level,
             COUNT(*) as count
         FROM {self.db.database}.log_history
@@ -381,25 +997,17 @@ class LogRepository(BaseRepository):
         ORDER BY time_bucket, log_level
         """
         
-        results, _, error = self.db.execute_query(query, params)
-        
-        # Debug logging
-        print(f"Time distribution query: {query}")
-        print(f"Query params: {params}")
-        print(f"Query error: {error}")
-        print(f"Query results: {results}")
-        
-        if error or not results:
-            print(f"No time distribution data: error={error}, results={results}")
-            return []
-        
-        # Group results by time bucket and aggregate by log level
+        results, _ = self._query_or_raise(query, params)
+        return self._format_time_distribution(results)
+    
+    def _format_time_distribution(self, results: List[Tuple]) -> List[Dict]:
+        """Group (time_bucket, log_level, count) rows into chart buckets"""
         time_buckets = {}
+        level_map = {'ERROR': 'error', 'WARN': 'warning', 'INFO': 'info', 'DEBUG': 'debug'}
         for time_bucket, log_level, count in results:
-            bucket_key = time_bucket.isoformat() if time_bucket else None
-            if bucket_key not in time_buckets:
-                time_buckets[bucket_key] = {
-                    'time_bucket': bucket_key,
+            if time_bucket not in time_buckets:
+                time_buckets[time_bucket] = {
+                    'time_bucket': time_bucket,
                     'total': 0,
                     'error': 0,
                     'warning': 0,
@@ -408,50 +1016,119 @@ class LogRepository(BaseRepository):
                 }
             
             # Map database log levels to frontend levels
-            level_map = {'ERROR': 'error', 'WARN': 'warning', 'INFO': 'info', 'DEBUG': 'debug'}
             frontend_level = level_map.get(log_level, 'info')
             
-            time_buckets[bucket_key][frontend_level] += count
-            time_buckets[bucket_key]['total'] += count
+            time_buckets[time_bucket][frontend_level] += int(count)
+            time_buckets[time_bucket]['total'] += int(count)
         
         # Convert to list and sort by time
         time_distribution = list(time_buckets.values())
         time_distribution.sort(key=lambda x: x['time_bucket'] or '')
-        
-        print(f"Final time distribution: {time_distribution}")
         return time_distribution
 
 class QueryRepository(BaseRepository):
-    def __init__(self, db_client: DatabendClient):
-        super().__init__(db_client)
+    PAGE_KEY = 'queries'
+    DICTIONARY_COLUMNS = ('sql_user', 'current_database', 'query_kind', 'status', 'client_address')
+    TIMESTAMP_COLUMNS = ('query_start_time', 'event_time')
+    
+    def __init__(self, db_client: DatabendClient, cache: ResultCache = None):
+        super().__init__(db_client, cache)
     
     def _get_search_field(self):
         """Return the field name used for searching in queries"""
         return 'query_text'
     
+    def _get_search_table(self):
+        return 'query_history'
+    
     def get_queries(self, filters: Dict) -> Dict[str, Any]:
         page = filters.get('page', 1)
         page_size = min(filters.get('pageSize', 200), 200)
         offset = (page - 1) * page_size
         
-        where_conditions, params = self._build_where_clause(filters)
-        where_clause = f"WHERE {where_conditions}" if where_conditions else ""
+        with phase('sql_build'):
+            filters = resolve_time_window(filters)
+            # Row conditions; the status filter applies to the collapsed view instead
+            where_conditions, params = self._build_where_clause({k: v for k, v in filters.items() if k != 'status'})
+            where_clause = f"WHERE {where_conditions}" if where_conditions else ""
+            status_condition = self._status_condition(filters)
+        
+        rollup_plan = self._rollup_window('query', filters, ())
+        if rollup_plan:
+            return self._cached('queries', filters, self._encoded(filters, lambda: self._get_queries_rollup(
+                filters, rollup_plan, where_clause, params, status_condition, page_size, offset, page)))
+        
+        time_dist_loader = self._incremental_time_distribution(
+            {k: v for k, v in filters.items() if k != 'status'}, 'query_history', 'query_start_time', QUERY_STATUS_EXPR,
+            source=lambda where: f"({self._collapsed_queries_sql(f'WHERE {where}', status_condition)}) AS queries")
+        
+        if filters.get('mode') == 'fanout':
+            return self._get_queries_fanout(filters, where_clause, params, status_condition, page_size, offset, page, time_dist_loader)
         
         # Execute all queries in a single combined query to reduce database requests
-        return self._get_queries_combined(where_clause, params, page_size, offset, filters.get('timeRange', '5m'), page)
+        return self._cached('queries', filters, self._encoded(filters, lambda: self._get_queries_combined(
+            where_clause, params, page_size, offset, window_bucket_seconds(filters), page, time_dist_loader, status_condition)))
+    
+    def _status_condition(self, filters: Dict) -> str:
+        if filters.get('status') == 'error':
+            return "exception_code != 0"
+        if filters.get('status') == 'success':
+            return "exception_code = 0"
+        return ""
+    
+    def _collapsed_queries_sql(self, where_clause: str, status_condition: str = "") -> str:
+        """One row per query_id: its QueryEnd row when there is one, otherwise its latest row.
+
+        Row conditions apply before collapsing so partitions are still pruned;
+        the status condition after, as a query's status is only known from its
+        QueryEnd row.
+        """
+        status_filter = f" AND {status_condition}" if status_condition else ""
+        return f"""
+            SELECT {QUERY_COLUMNS}
+            FROM (
+                SELECT
+                    {QUERY_COLUMNS},
+                    ROW_NUMBER() OVER (
+                        PARTITION BY query_id
+                        ORDER BY CASE WHEN log_type_name = 'QueryEnd' THEN 0 ELSE 1 END, event_time DESC
+                    ) AS query_row
+                FROM {self.db.database}.query_history
+                {where_clause}
+            ) AS query_rows
+            WHERE query_row = 1{status_filter}"""
+    
+    def _query_record(self, row: Dict) -> Dict:
+        """A collapsed query_history row in the shape the queries view renders"""
+        return {
+            'query_id': row['query_id'],
+            'query_text': row['query_text'],
+            'sql_user': row['sql_user'],
+            'current_database': row['current_database'],
+            'query_kind': row['query_kind'],
+            'query_start_time': row['query_start_time'],
+            'event_time': row['event_time'],
+            'duration_ms': row['query_duration_ms'],
+            'status': 'error' if row['exception_code'] else 'success',
+            'exception_code': row['exception_code'],
+            'exception_text': row['exception_text'],
+            'result_rows': row['result_rows'],
+            'result_bytes': row['result_bytes'],
+            'scan_rows': row['scan_rows'],
+            'scan_bytes': row['scan_bytes'],
+            'client_address': row['client_address']
+        }
     
     def _build_where_clause(self, filters: Dict) -> Tuple[str, List]:
         conditions = []
         params = []
         
-        self._add_time_filter(conditions, filters, time_field='query_start_time')
+        self._add_time_filter(conditions, params, filters, time_field='query_start_time')
         
         # Query status filter
-        if filters.get('status'):
-            if filters['status'] == 'error':
-                conditions.append("exception_code != 0")
-            elif filters['status'] == 'success':
-                conditions.append("exception_code = 0")
+        status_condition = self._status_condition(filters)
+        if status_condition:
+            conditions.append(status_condition)
         
         # Query ID search
         if filters.get('queryId'):
@@ -480,90 +1157,86 @@ class QueryRepository(BaseRepository):
         
         return " AND ".join(conditions), params
     
-    def _get_queries_combined(self, where_clause: str, params: List, page_size: int, offset: int, time_range: str, page: int) -> Dict[str, Any]:
-        """Combined query to get queries, stats, count and time distribution in one request"""
-        precision = BUCKET_PRECISION.get(time_range, 'MINUTE')
+    @db_operation
+    def _get_queries_combined(self, where_clause: str, params: List, page_size: int, offset: int, bucket_seconds: int, page: int, time_dist_loader=None, status_condition: str = "") -> Dict[str, Any]:
+        """Combined query to get queries, stats, count and time distribution in one request.
+
+        Everything is computed over the collapsed one-row-per-query view, so
+        page, count and chart agree. With a time_dist_loader the time
+        distribution is computed incrementally alongside the combined query
+        instead of as one of its branches.
+        Returns (result, cacheable); failed queries are not cacheable.
+        """
+        time_dist_future = fanout_executor.submit(time_dist_loader) if time_dist_loader else None
         
-        # Use params for all CTE queries
-        all_params = params + params + params + params
+        time_dist_cte = ""
+        time_dist_select = ""
+        if not time_dist_future:
+            time_dist_cte = f""",
+        -- Get time distribution
+        time_dist_data AS (
+            SELECT
+                {time_bucket_sql('query_start_time', bucket_seconds)} as time_bucket,
+                {QUERY_STATUS_EXPR} as status,
+                COUNT(*) as count
+            FROM collapsed
+            GROUP BY time_bucket, status
+        )"""
+            time_dist_select = """
+        UNION ALL
+        SELECT 
+            'time_dist' as data_type, time_bucket::VARCHAR, status, count::VARCHAR,
+            NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL
+        FROM time_dist_data"""
         
         combined_query = f"""
         WITH 
-        -- Count distinct queries
-        count_data AS (
-            SELECT COUNT(DISTINCT query_id) as total_count
-            FROM {self.db.database}.query_history
-            {where_clause}
+        -- One row per query
+        collapsed AS ({self._collapsed_queries_sql(where_clause, status_condition)}
         ),
-        -- Get query statistics
+        -- Get query statistics; durations only exist once a query has finished
         stats_data AS (
             SELECT
-                COUNT(DISTINCT query_id) as total_queries,
+                COUNT(*) as total_queries,
                 SUM(CASE WHEN exception_code = 0 THEN 1 ELSE 0 END) as success_queries,
                 SUM(CASE WHEN exception_code != 0 THEN 1 ELSE 0 END) as error_queries,
-                AVG(query_duration_ms) as avg_duration_ms
-            FROM {self.db.database}.query_history
-            {where_clause}
+                AVG(CASE WHEN log_type_name = 'QueryEnd' THEN query_duration_ms END) as avg_duration_ms
+            FROM collapsed
         ),
-        -- Get paginated queries with row numbers
+        -- Get the page
         queries_data AS (
-            SELECT
-                query_id, log_type_name, query_text, event_time, query_start_time,
-                query_duration_ms, exception_code, exception_text, sql_user, current_database,
-                query_kind, result_rows, result_bytes, scan_rows, scan_bytes, client_address,
-                ROW_NUMBER() OVER (ORDER BY query_start_time DESC) as rn
-            FROM {self.db.database}.query_history
-            {where_clause}
-        ),
-        -- Get time distribution
-        time_dist_data AS (
-            SELECT
-                TRUNC(query_start_time, '{precision}') as time_bucket,
-                CASE WHEN exception_code IS NOT NULL AND exception_code != 0 THEN 'error' ELSE 'success' END as status,
-                COUNT(*) as count
-            FROM {self.db.database}.query_history
-            {where_clause}
-            GROUP BY time_bucket, status
-        )
-        SELECT 
-            'count' as data_type, total_count::VARCHAR as col1, NULL as col2, NULL as col3, NULL as col4, NULL as col5, 
-            NULL as col6, NULL as col7, NULL as col8, NULL as col9, NULL as col10, NULL as col11, NULL as col12, NULL as col13, NULL as col14, NULL as col15, NULL as col16
-        FROM count_data
-        UNION ALL
+            SELECT {QUERY_COLUMNS}
+            FROM collapsed
+            ORDER BY query_start_time DESC, query_id
+            LIMIT {page_size} OFFSET {offset}
+        ){time_dist_cte}
         SELECT 
-            'stats' as data_type, total_queries::VARCHAR, success_queries::VARCHAR, error_queries::VARCHAR, avg_duration_ms::VARCHAR,
-            NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL
+            'stats' as data_type, total_queries::VARCHAR as col1, success_queries::VARCHAR as col2, error_queries::VARCHAR as col3,
+            avg_duration_ms::VARCHAR as col4, NULL as col5, NULL as col6, NULL as col7, NULL as col8, NULL as col9, NULL as col10,
+            NULL as col11, NULL as col12, NULL as col13, NULL as col14, NULL as col15, NULL as col16
         FROM stats_data
         UNION ALL
         SELECT 
             'queries' as data_type, query_id, log_type_name, query_text, event_time::VARCHAR, query_start_time::VARCHAR,
             query_duration_ms::VARCHAR, exception_code::VARCHAR, exception_text, sql_user, current_database,
             query_kind, result_rows::VARCHAR, result_bytes::VARCHAR, scan_rows::VARCHAR, scan_bytes::VARCHAR, client_address
-        FROM queries_data
-        WHERE rn > {offset} AND rn <= {offset + page_size}
-        UNION ALL
-        SELECT 
-            'time_dist' as data_type, time_bucket::VARCHAR, status, count::VARCHAR,
-            NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL
-        FROM time_dist_data
-        ORDER BY data_type, col1
+        FROM queries_data{time_dist_select}
         """
         
-        results, _, error = self.db.execute_query(combined_query, all_params)
+        results, _, error = self.db.execute_query(combined_query, params)
+        time_dist_rows, time_dist_error = self._resolve_time_dist(time_dist_future)
         if error or not results:
-            return {'queries': [], 'total': 0, 'page': page, 'pageSize': page_size, 'totalPages': 0, 'stats': {'total': 0, 'success': 0, 'error': 0, 'avg_duration_ms': 0}, 'timeDistribution': []}
+            return {'queries': [], 'total': 0, 'page': page, 'pageSize': page_size, 'totalPages': 0, 'stats': {'total': 0, 'success': 0, 'error': 0, 'avg_duration_ms': 0}, 'timeDistribution': []}, not error
         
         # Parse results
-        total_count = 0
+        decode_start = time.perf_counter()
         stats = {'total': 0, 'success': 0, 'error': 0, 'avg_duration_ms': 0}
-        queries_raw = []
+        queries = []
         time_buckets = {}
         
         for row in results:
             data_type = row[0]
-            if data_type == 'count':
-                total_count = int(row[1]) if row[1] else 0
-            elif data_type == 'stats':
+            if data_type == 'stats':
                 stats = {
                     'total': int(row[1]) if row[1] else 0,
                     'success': int(row[2]) if row[2] else 0,
@@ -571,7 +1244,7 @@ class QueryRepository(BaseRepository):
                     'avg_duration_ms': round(float(row[4])) if row[4] else 0
                 }
             elif data_type == 'queries':
-                query_dict = {
+                queries.append(self._query_record({
                     'query_id': row[1], 'log_type_name': row[2], 'query_text': row[3], 'event_time': row[4],
                     'query_start_time': row[5], 'query_duration_ms': int(row[6]) if row[6] else 0,
                     'exception_code': int(row[7]) if row[7] else 0, 'exception_text': row[8],
@@ -579,8 +1252,7 @@ class QueryRepository(BaseRepository):
                     'result_rows': int(row[12]) if row[12] else 0, 'result_bytes': int(row[13]) if row[13] else 0,
                     'scan_rows': int(row[14]) if row[14] else 0, 'scan_bytes': int(row[15]) if row[15] else 0,
                     'client_address': row[16]
-                }
-                queries_raw.append(query_dict)
+                }))
             elif data_type == 'time_dist':
                 time_bucket = row[1]
                 status = row[2]
@@ -590,65 +1262,270 @@ class QueryRepository(BaseRepository):
                 time_buckets[time_bucket][status] += count
                 time_buckets[time_bucket]['total'] += count
         
-        # Process queries to calculate durations and deduplicate
-        processed_queries = self._process_query_durations(queries_raw)
-        time_distribution = sorted(time_buckets.values(), key=lambda x: x['time_bucket'] or '')
+        # UNION ALL doesn't keep the page order
+        queries.sort(key=lambda q: (q['query_start_time'] or '', q['query_id'] or ''), reverse=True)
+        if time_dist_future:
+            time_distribution = self._format_time_distribution(time_dist_rows)
+        else:
+            time_distribution = sorted(time_buckets.values(), key=lambda x: x['time_bucket'] or '')
+        record('decode', time.perf_counter() - decode_start)
         
+        # Every collapsed row is one query, so the page count comes from the stats
+        total_count = stats['total']
         return {
-            'queries': processed_queries,
+            'queries': queries,
             'total': total_count,
             'page': page,
             'pageSize': page_size,
             'totalPages': (total_count + page_size - 1) // page_size,
             'stats': stats,
             'timeDistribution': time_distribution
+        }, not time_dist_error
+    
+    def _get_queries_fanout(self, filters: Dict, where_clause: str, params: List, status_condition: str, page_size: int, offset: int, page: int, time_dist_loader=None) -> Dict[str, Any]:
+        """Run page, count, stats and time distribution as concurrent queries"""
+        bucket_seconds = window_bucket_seconds(filters)
+        parts = {
+            'queries': lambda: self._encode_page(
+                {'queries': self._get_query_page(where_clause, params, status_condition, page_size, offset)}, filters),
+            'count': lambda: self._count_part(self._get_total_count(where_clause, params, status_condition), page_size),
+            'stats': lambda: {'stats': self._get_stats(where_clause, params, status_condition)},
+            'timeDistribution': lambda: {'timeDistribution': self._format_time_distribution(time_dist_loader())
+                                         if time_dist_loader else self._get_time_distribution(where_clause, params, bucket_seconds, status_condition)}
         }
+        return self._run_fanout('queries', filters, parts, page, page_size)
     
-    def _get_total_count(self, where_clause: str, params: List) -> int:
+    def _get_queries_rollup(self, filters: Dict, plan: Tuple, where_clause: str, params: List, status_condition: str,
+                            page_size: int, offset: int, page: int) -> Tuple[Dict[str, Any], bool]:
+        """Page from the collapsed query view; count, stats and time distribution from
+        the rollup plus a live scan of the window edges. Returns (result, cacheable).
+
+        The rollup counts rows, so queries are derived per bucket: every query
+        has one row more than it has QueryEnd rows, and only a QueryEnd row can
+        carry an error. Queries still running count as successes, as in the
+        collapsed view.
+        """
+        aggregator, window_start, first_full, rollup_end, precision_seconds, _ = plan
+        page_future = fanout_executor.submit(self._get_query_page, where_clause, params, status_condition, page_size, offset)
+        
+        # Status is applied below, after rows have been turned into queries
+        dimensions = {}
+        if filters.get('database'):
+            dimensions['current_database'] = filters['database']
+        if filters.get('user'):
+            dimensions['sql_user'] = filters['user']
+        
+        try:
+            rows = aggregator.query_buckets(first_full, rollup_end, precision_seconds, dimensions)
+            rows += self._edge_aggregate(
+                {k: v for k, v in filters.items() if k != 'status'}, 'query_history', 'query_start_time',
+                f"""{time_bucket_sql('query_start_time', precision_seconds)}::VARCHAR as time_bucket,
+            {QUERY_STATUS_EXPR} as status,
+            COUNT(*) as row_count,
+            SUM(CASE WHEN log_type_name = 'QueryEnd' THEN 1 ELSE 0 END) as query_count,
+            SUM(CASE WHEN log_type_name = 'QueryEnd' THEN query_duration_ms ELSE 0 END) as duration_sum""",
+                "time_bucket, status", window_start, first_full, rollup_end)
+            queries = page_future.result()
+        except Exception as e:
+            print(f"❌ Rollup query history query failed: {e}")
+            return {'error': str(e), 'queries': [], 'total': 0, 'page': page, 'pageSize': page_size, 'totalPages': 0}, False
+        
+        buckets = {}
+        finished = {'success': [0, 0], 'error': [0, 0]}  # status -> [finished queries, duration sum]
+        for bucket, status, row_count, query_count, bucket_duration in rows:
+            counts = buckets.setdefault(bucket, {'total': 0, 'error': 0})
+            counts['total'] += int(row_count or 0) - int(query_count or 0)
+            if status == 'error':
+                counts['error'] += int(query_count or 0)
+            finished[status][0] += int(query_count or 0)
+            finished[status][1] += int(bucket_duration or 0)
+        
+        wanted = [filters['status']] if filters.get('status') in ('error', 'success') else ['success', 'error']
+        time_dist_rows = []
+        for bucket, counts in buckets.items():
+            by_status = {'success': counts['total'] - counts['error'], 'error': counts['error']}
+            time_dist_rows.extend((bucket, status, by_status[status]) for status in wanted if by_status[status])
+        
+        stats = {'total': 0, 'success': 0, 'error': 0, 'avg_duration_ms': 0}
+        for _, status, count in time_dist_rows:
+            stats[status] += count
+            stats['total'] += count
+        finished_count = sum(finished[status][0] for status in wanted)
+        if finished_count:
+            stats['avg_duration_ms'] = round(sum(finished[status][1] for status in wanted) / finished_count)
+        total_count = stats['total']
+        
+        return {
+            'queries': queries,
+            'total': total_count,
+            'page': page,
+            'pageSize': page_size,
+            'totalPages': (total_count + page_size - 1) // page_size,
+            'stats': stats,
+            'timeDistribution': self._format_time_distribution(time_dist_rows),
+            'aggregates': 'rollup'
+        }, True
+    
+    def get_query_fingerprints(self, filters: Dict) -> Dict[str, Any]:
+        """Finished queries grouped by fingerprint with latency percentiles, load and error rate.
+
+        One aggregate scan over the QueryEnd rows of the window; sorted by
+        total time by default, so the queries dominating load come first.
+        """
+        sort = filters.get('sort') if filters.get('sort') in FINGERPRINT_SORTS else 'totalTime'
+        limit = max(1, min(int(filters.get('limit') or 100), 1000))
+        with phase('sql_build'):
+            filters = resolve_time_window(filters)
+            where_conditions, params = self._build_where_clause(filters)
+        
+        return self._cached('query_fingerprints', filters, self._encoded(
+            filters, lambda: self._get_query_fingerprints(where_conditions, params, sort, limit)))
+    
+    @db_operation
+    def _get_query_fingerprints(self, where_conditions: str, params: List, sort: str, limit: int) -> Tuple[Dict[str, Any], bool]:
         query = f"""
-        SELECT COUNT(DISTINCT query_id) as total 
+        SELECT
+            {QUERY_FINGERPRINT_EXPR} as fingerprint,
+            MIN(query_text) as sample_query,
+            COUNT(*) as calls,
+            SUM(query_duration_ms) as total_ms,
+            QUANTILE_CONT(0.5)(query_duration_ms) as p50_ms,
+            QUANTILE_CONT(0.95)(query_duration_ms) as p95_ms,
+            QUANTILE_CONT(0.99)(query_duration_ms) as p99_ms,
+            MAX(query_duration_ms) as max_ms,
+            SUM(scan_bytes) as scan_bytes,
+            SUM({QUERY_SPILLED_BYTES_EXPR}) as spill_bytes,
+            SUM(CASE WHEN exception_code != 0 THEN 1 ELSE 0 END) as errors,
+            MAX(query_start_time)::VARCHAR as last_seen,
+            SUM(SUM(query_duration_ms)) OVER () as window_ms,
+            COUNT(*) OVER () as fingerprint_count
         FROM {self.db.database}.query_history
-        {where_clause}
+        WHERE {where_conditions} AND log_type_name = 'QueryEnd'
+        GROUP BY fingerprint
+        ORDER BY {FINGERPRINT_SORTS[sort]} DESC, fingerprint
+        LIMIT {limit}
         """
         
-        rows, _, error = self.db.execute_query(query, params)
-        if error or not rows:
-            return 0
+        rows, _, error = self.db.execute_query(query, QUERY_NORMALIZE_PATTERNS + params)
+        if error:
+            return {'error': error, 'fingerprints': [], 'sort': sort, 'totalFingerprints': 0, 'totalMs': 0}, False
+        
+        decode_start = time.perf_counter()
+        window_ms = int(rows[0][12] or 0) if rows else 0
+        fingerprints = []
+        for (fingerprint, sample_query, calls, total_ms, p50, p95, p99, max_ms,
+             scan_bytes, spill_bytes, errors, last_seen, _, _) in rows:
+            calls, total_ms, errors = int(calls or 0), int(total_ms or 0), int(errors or 0)
+            fingerprints.append({
+                'fingerprint': fingerprint,
+                'query': sample_query,
+                'calls': calls,
+                'totalMs': total_ms,
+                'avgMs': round(total_ms / calls, 1) if calls else 0,
+                'p50Ms': round(float(p50 or 0), 1),
+                'p95Ms': round(float(p95 or 0), 1),
+                'p99Ms': round(float(p99 or 0), 1),
+                'maxMs': int(max_ms or 0),
+                'scanBytes': int(scan_bytes or 0),
+                'spillBytes': int(spill_bytes or 0),
+                'errors': errors,
+                'errorRate': round(errors * 100.0 / calls, 2) if calls else 0.0,
+                'timeShare': round(total_ms * 100.0 / window_ms, 2) if window_ms else 0.0,
+                'lastSeen': last_seen
+            })
+        record('decode', time.perf_counter() - decode_start)
         
-        return rows[0][0] if rows[0][0] else 0
+        return {
+            'fingerprints': fingerprints,
+            'sort': sort,
+            'totalFingerprints': int(rows[0][13] or 0) if rows else 0,
+            'totalMs': window_ms
+        }, True
     
-    def _get_stats(self, where_clause: str, params: List) -> Dict:
-        # Get query statistics: total, success, error, avg duration
+    def export_queries(self, filters: Dict, max_rows: int) -> Iterator[Tuple[List, List]]:
+        """Stream every query matching the filters, one row each as in the queries view, newest first, in batches"""
+        # Row conditions; the status filter applies to the collapsed view, as in get_queries
+        where_conditions, params = self._build_where_clause({k: v for k, v in filters.items() if k != 'status'})
+        where_clause = f"WHERE {where_conditions}" if where_conditions else ""
         query = f"""
         SELECT
-            COUNT(DISTINCT query_id) as total_queries,
+            query_id, log_type_name, query_text, event_time, query_start_time,
+            query_duration_ms, exception_code, exception_text, sql_user, current_database,
+            query_kind, result_rows, result_bytes, scan_rows, scan_bytes, client_address
+        FROM ({self._collapsed_queries_sql(where_clause, self._status_condition(filters))}
+        ) AS queries
+        ORDER BY query_start_time DESC, query_id
+        LIMIT {int(max_rows)}
+        """
+        return self.db.iter_query(query, params, operation=f"{type(self).__name__}.export")
+    
+    @db_operation
+    def _get_total_count(self, where_clause: str, params: List, status_condition: str = "") -> int:
+        query = f"""
+        SELECT COUNT(*) as total
+        FROM ({self._collapsed_queries_sql(where_clause, status_condition)}
+        ) AS queries
+        """
+        
+        rows, _ = self._query_or_raise(query, params)
+        return int(rows[0][0]) if rows and rows[0][0] else 0
+    
+    @db_operation
+    def _get_stats(self, where_clause: str, params: List, status_condition: str = "") -> Dict:
+        # Get query statistics: total, success, error, avg duration of finished queries
+        query = f"""
+        SELECT
+            COUNT(*) as total_queries,
             SUM(CASE WHEN exception_code = 0 THEN 1 ELSE 0 END) as success_queries,
             SUM(CASE WHEN exception_code != 0 THEN 1 ELSE 0 END) as error_queries,
-            AVG(query_duration_ms) as avg_duration_ms
-        FROM {self.db.database}.query_history
-        {where_clause}
+            AVG(CASE WHEN log_type_name = 'QueryEnd' THEN query_duration_ms END) as avg_duration_ms
+        FROM ({self._collapsed_queries_sql(where_clause, status_condition)}
+        ) AS queries
         """
         
-        rows, _, error = self.db.execute_query(query, params)
-        if error or not rows:
+        rows, _ = self._query_or_raise(query, params)
+        if not rows:
             return {'total': 0, 'success': 0, 'error': 0, 'avg_duration_ms': 0}
         
         return {
-            'total': rows[0][0] if rows[0][0] else 0,
-            'success': rows[0][1] if rows[0][1] else 0,
-            'error': rows[0][2] if rows[0][2] else 0,
-            'avg_duration_ms': round(rows[0][3]) if rows[0][3] else 0
+            'total': int(rows[0][0]) if rows[0][0] else 0,
+            'success': int(rows[0][1]) if rows[0][1] else 0,
+            'error': int(rows[0][2]) if rows[0][2] else 0,
+            'avg_duration_ms': round(float(rows[0][3])) if rows[0][3] else 0
         }
     
+    @db_operation
+    def _get_query_page(self, where_clause: str, params: List, status_condition: str, limit: int, offset: int) -> List[Dict]:
+        """A page of the collapsed query view, newest first; times are rendered like the combined query"""
+        query = f"""
+        SELECT
+            query_id, log_type_name, query_text, event_time::VARCHAR AS event_time,
+            query_start_time::VARCHAR AS query_start_time, query_duration_ms, exception_code,
+            exception_text, sql_user, current_database, query_kind, result_rows, result_bytes,
+            scan_rows, scan_bytes, client_address
+        FROM ({self._collapsed_queries_sql(where_clause, status_condition)}
+        ) AS queries
+        ORDER BY query_start_time DESC, query_id
+        LIMIT {limit} OFFSET {offset}
+        """
+        
+        rows, columns = self._query_or_raise(query, params)
+        return [self._query_record(self._decode_query_row(row, columns)) for row in rows]
+    
+    def _decode_query_row(self, row: Tuple, columns: List[str]) -> Dict:
+        numeric_columns = {'query_duration_ms', 'exception_code', 'result_rows', 'result_bytes', 'scan_rows', 'scan_bytes'}
+        return {col: int(row[i] or 0) if col in numeric_columns else row[i] for i, col in enumerate(columns)}
+    
+    @db_operation
     def _get_paginated_queries(self, where_clause: str, params: List, limit: int, offset: int) -> List[Dict]:
-        # Get query history with start and end events
+        # Get query history with start and end events; times are rendered like the combined query
         query = f"""
         SELECT
             query_id,
             log_type_name,
             query_text,
-            event_time,
-            query_start_time,
+            event_time::VARCHAR AS event_time,
+            query_start_time::VARCHAR AS query_start_time,
             query_duration_ms,
             exception_code,
             exception_text,
@@ -666,19 +1543,75 @@ class QueryRepository(BaseRepository):
         LIMIT {limit} OFFSET {offset}
         """
         
-        rows, columns, error = self.db.execute_query(query, params)
-        if error or not rows:
-            return []
-        
-        result = []
-        for row in rows:
-            query_data = {}
-            for i, col in enumerate(columns):
-                query_data[col] = row[i]
-            result.append(query_data)
-        
+        rows, columns = self._query_or_raise(query, params)
+        return [self._decode_query_row(row, columns) for row in rows]
+    
+    def get_query_drilldown(self, query_id: str, log_repo: 'LogRepository', filters: Dict) -> Optional[Dict[str, Any]]:
+        """A query's record, its logs and their per-level histogram, or None when it is unknown.
+
+        The log scan is bounded by the query's own start and end time, so only
+        the log_history partitions of that window are read. Finished queries
+        never change and stay cached until evicted.
+        """
+        key = self._cache_key('query_drilldown', {'queryId': query_id})
+        if not filters.get('nocache'):
+            value, etag = self.cache.get_with_etag(key)
+            if value is not None:
+                note_result_etag(etag)
+                return value
+        
+        result = self._load_query_drilldown(query_id, log_repo, filters.get('around'))
+        if result is not None and not filters.get('nocache'):
+            ttl = None if result['query']['finished'] else self.cache.default_ttl
+            note_result_etag(self.cache.set(key, result, ttl))
         return result
     
+    def _load_query_drilldown(self, query_id: str, log_repo: 'LogRepository', around: Optional[str]) -> Optional[Dict[str, Any]]:
+        events = self._get_query_events(query_id, around)
+        if not events:
+            return None
+        query_record = self._process_query_durations(events)[0]
+        finished = any(e['log_type_name'] == 'QueryEnd' for e in events)
+        start = parse_ts(min(e['query_start_time'] or e['event_time'] for e in events))
+        end = parse_ts(max(e['event_time'] for e in events)) if finished else datetime.datetime.utcnow()
+        window_start, window_end = start - DRILLDOWN_SLACK, end + DRILLDOWN_SLACK
+        
+        bucket_seconds = choose_bucket_seconds(window_end - window_start)
+        where_clause = "WHERE query_id = ? AND timestamp >= ? AND timestamp < ?"
+        params = [query_id, format_ts(window_start), format_ts(window_end)]
+        
+        time_dist_future = fanout_executor.submit(log_repo._get_time_distribution, where_clause, params, bucket_seconds)
+        logs = log_repo._get_paginated_logs(where_clause, params, DRILLDOWN_LOG_LIMIT, 0)
+        time_distribution = time_dist_future.result()
+        
+        query_record['finished'] = finished
+        return {
+            'query': query_record,
+            'events': events,
+            'logs': logs,
+            'totalLogs': sum(bucket['total'] for bucket in time_distribution),
+            'logsTruncated': len(logs) >= DRILLDOWN_LOG_LIMIT,
+            'timeDistribution': time_distribution,
+            'bucketSeconds': bucket_seconds,
+            'window': {'start': format_ts(window_start), 'end': format_ts(window_end)}
+        }
+    
+    @db_operation
+    def _get_query_events(self, query_id: str, around: Optional[str] = None) -> List[Dict]:
+        """query_history rows of one query, oldest first; a start time hint bounds the lookup"""
+        conditions, params = ["query_id = ?"], [query_id]
+        if around:
+            try:
+                hint = parse_ts(around)
+            except ValueError:
+                hint = None
+            if hint:
+                conditions.append("query_start_time >= ? AND query_start_time < ?")
+                params.extend([format_ts(hint - DRILLDOWN_HINT_WINDOW), format_ts(hint + DRILLDOWN_HINT_WINDOW)])
+        events = self._get_paginated_queries(f"WHERE {' AND '.join(conditions)}", params, 100, 0)
+        events.sort(key=lambda e: e['event_time'] or '')
+        return events
+    
     def _process_query_durations(self, queries: List[Dict]) -> List[Dict]:
         # Group queries by query_id to calculate durations between start and end events
         query_map = {}
@@ -722,65 +1655,41 @@ class QueryRepository(BaseRepository):
         
         return processed_queries
     
-    def _get_time_distribution(self, where_clause: str, params: List, time_range: str) -> List[Dict]:
-        """Generate time distribution data for charts"""
-        # Determine bucket precision based on time range
-        precision = BUCKET_PRECISION.get(time_range, 'MINUTE')
-        
+    @db_operation
+    def _get_time_distribution(self, where_clause: str, params: List, bucket_seconds: int, status_condition: str = "") -> List[Dict]:
+        """Generate time distribution data for charts, one count per query"""
         query = f"""
         SELECT
-            TRUNC(query_start_time, '{precision}') as time_bucket,
-            CASE WHEN exception_code IS NOT NULL AND exception_code != 0 THEN 'error' ELSE 'success' END as status,
+            {time_bucket_sql('query_start_time', bucket_seconds)}::VARCHAR as time_bucket,
+            {QUERY_STATUS_EXPR} as status,
             COUNT(*) as count
-        FROM {self.db.database}.query_history
-        {where_clause}
+        FROM ({self._collapsed_queries_sql(where_clause, status_condition)}
+        ) AS queries
         GROUP BY time_bucket, status
         ORDER BY time_bucket, status
         """
         
-        results, _, error = self.db.execute_query(query, params)
-        
-        # Debug logging
-        print(f"Query time distribution query: {query}")
-        print(f"Query params: {params}")
-        print(f"Query error: {error}")
-        print(f"Query results: {results}")
-        
-        # Additional debug: check if there are any QueryEnd records at all
-        debug_query = """
-        SELECT COUNT(*) as total_queryend,
-               MIN(query_start_time) as earliest_time,
-               MAX(query_start_time) as latest_time
-        FROM system_history.query_history
-        WHERE log_type_name = 'QueryEnd'
-        """
-        debug_results, _, debug_error = self.db.execute_query(debug_query, [])
-        print(f"Debug QueryEnd check: {debug_results}")
-        
-        if error or not results:
-            print(f"No query time distribution data: error={error}, results={results}")
-            return []
-        
-        # Group results by time bucket and aggregate by status
+        results, _ = self._query_or_raise(query, params)
+        return self._format_time_distribution(results)
+    
+    def _format_time_distribution(self, results: List[Tuple]) -> List[Dict]:
+        """Group (time_bucket, status, count) rows into chart buckets"""
         time_buckets = {}
         for time_bucket, status, count in results:
-            bucket_key = time_bucket.isoformat() if time_bucket else None
-            if bucket_key not in time_buckets:
-                time_buckets[bucket_key] = {
-                    'time_bucket': bucket_key,
+            if time_bucket not in time_buckets:
+                time_buckets[time_bucket] = {
+                    'time_bucket': time_bucket,
                     'total': 0,
                     'success': 0,
                     'error': 0
                 }
             
-            time_buckets[bucket_key][status] += count
-            time_buckets[bucket_key]['total'] += count
+            time_buckets[time_bucket][status] += int(count)
+            time_buckets[time_bucket]['total'] += int(count)
         
         # Convert to list and sort by time
         time_distribution = list(time_buckets.values())
         time_distribution.sort(key=lambda x: x['time_bucket'] or '')
-        
-        print(f"Final query time distribution: {time_distribution}")
         return time_distribution
 
 
@@ -789,79 +1698,8 @@ class MetricsRepository:
         self.db = db_client
     
     def get_metrics(self) -> Dict[str, Any]:
-        # Combine all metrics queries into a single request
-        combined_query = """
-        WITH 
-        total_logs AS (
-            SELECT COUNT(*) as count 
-            FROM system_history.log_history 
-            WHERE timestamp >= NOW() - INTERVAL 24 HOUR
-        ),
-        error_rate AS (
-            SELECT (COUNT(CASE WHEN log_level = 'ERROR' THEN 1 END) * 100.0 / COUNT(*)) as rate
-            FROM system_history.log_history 
-            WHERE timestamp >= NOW() - INTERVAL 24 HOUR
-        ),
-        active_queries AS (
-            SELECT COUNT(DISTINCT query_id) as count
-            FROM system_history.log_history 
-            WHERE timestamp >= NOW() - INTERVAL 5 MINUTE AND query_id IS NOT NULL
-        )
-        SELECT 
-            'total_logs' as metric_type, count::VARCHAR as value
-        FROM total_logs
-        UNION ALL
-        SELECT 
-            'error_rate' as metric_type, rate::VARCHAR as value
-        FROM error_rate
-        UNION ALL
-        SELECT 
-            'active_queries' as metric_type, count::VARCHAR as value
-        FROM active_queries
-        UNION ALL
-        SELECT 
-            'avg_query_time' as metric_type, '0.0' as value
-        """
-        
-        results, _, error = self.db.execute_query(combined_query)
-        metrics = {'totalLogs': 0, 'errorRate': 0.0, 'avgQueryTime': 0.0, 'activeQueries': 0}
-        
-        if not error and results:
-            for metric_type, value in results:
-                if metric_type == 'total_logs':
-                    metrics['totalLogs'] = int(value) if value else 0
-                elif metric_type == 'error_rate':
-                    metrics['errorRate'] = round(float(value), 2) if value else 0.0
-                elif metric_type == 'active_queries':
-                    metrics['activeQueries'] = int(value) if value else 0
-                elif metric_type == 'avg_query_time':
-                    metrics['avgQueryTime'] = float(value) if value else 0.0
-        
-        return metrics
-    
-    def _get_total_logs(self) -> int:
-        query = "SELECT COUNT(*) FROM system_history.log_history WHERE timestamp >= NOW() - INTERVAL 24 HOUR"
-        results, _, error = self.db.execute_query(query)
-        return results[0][0] if results and not error else 0
-    
-    def _get_error_rate(self) -> float:
-        query = """
-        SELECT (COUNT(CASE WHEN log_level = 'ERROR' THEN 1 END) * 100.0 / COUNT(*)) as error_rate
-        FROM system_history.log_history 
-        WHERE timestamp >= NOW() - INTERVAL 24 HOUR
-        """
-        results, _, error = self.db.execute_query(query)
-        return round(results[0][0], 2) if results and not error else 0.0
-    
-    def _get_avg_query_time(self) -> float:
-        # log_history doesn't have query duration, return 0
-        return 0.0
-    
-    def _get_active_queries(self) -> int:
-        query = """
-        SELECT COUNT(DISTINCT query_id) 
-        FROM system_history.log_history 
-        WHERE timestamp >= NOW() - INTERVAL 5 MINUTE AND query_id IS NOT NULL
-        """
-        results, _, error = self.db.execute_query(query)
-        return results[0][0] if results and not error else 0
+        # Served from the target's shared snapshot, refreshed incrementally in the background
+        return metrics_snapshot_for(self.db).get()
+
+    def get_metrics_freshness(self) -> Dict[str, str]:
+        return metrics_snapshot_for(self.db).freshness()
@@ -0,0 +1,133 @@
+import csv
+import datetime
+import io
+import json
+import os
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# Hard cap on rows per export; requests may ask for fewer with maxRows
+EXPORT_MAX_ROWS = int(os.environ.get('BENDDASH_EXPORT_MAX_ROWS', 5_000_000))
+
+# Exports streaming at once in this process. Each holds a pooled connection until it is done,
+# so they may take only a quarter of a pool and the dashboard panels keep the rest.
+EXPORT_MAX_CONCURRENT = int(os.environ.get('BENDDASH_EXPORT_MAX_CONCURRENT',
+                                           max(1, int(os.environ.get('BENDDASH_POOL_MAX', 8)) // 4)))
+export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+Batches = Iterator[Tuple[List[str], List]]
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def _ndjson(batches: Batches) -> Iterator[bytes]:
+    for columns, rows in batches:
+        chunk = io.StringIO()
+        for row in rows:
+            chunk.write(json.dumps({c: _json_value(v) for c, v in zip(columns, row)}, default=str))
+            chunk.write('\n')
+        yield chunk.getvalue().encode('utf-8')
+
+
+def _csv(batches: Batches) -> Iterator[bytes]:
+    header_written = False
+    for columns, rows in batches:
+        chunk = io.StringIO()
+        writer = csv.writer(chunk)
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows([[_json_value(v) for v in row] for row in rows])
+        yield chunk.getvalue().encode('utf-8')
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only file that hands out what has been written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet(batches: Batches) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _DrainableSink()
+    writer = None
+    try:
+        for columns, rows in batches:
+            data = {c: [row[i] for row in rows] for i, c in enumerate(columns)}
+            if writer is None:
+                table = pa.Table.from_pydict(data)
+                # Columns that are all NULL in the first batch get a type later batches can fill
+                schema = pa.schema([
+                    pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                    for f in table.schema
+                ])
+                writer = pq.ParquetWriter(sink, schema)
+            table = pa.Table.from_pydict(data, schema=writer.schema)
+            # One row group per fetched batch keeps memory flat
+            writer.write_table(table)
+            yield sink.drain()
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def stream_export(batches: Batches, fmt: str) -> Iterator[bytes]:
+    """Encode row batches into the requested format, one chunk per batch"""
+    if fmt == 'csv':
+        return _csv(batches)
+    if fmt == 'parquet':
+        return _parquet(batches)
+    return _ndjson(batches)
+
+
+def resolve_export_request(fmt: Optional[str], max_rows) -> Tuple[str, int, Optional[str]]:
+    """Validate format and row limit; returns (format, max_rows, error)"""
+    fmt = (fmt or 'ndjson').lower()
+    if fmt not in EXPORT_FORMATS:
+        return fmt, 0, f"Unsupported export format '{fmt}', use one of: {', '.join(EXPORT_FORMATS)}"
+    if fmt == 'parquet' and not parquet_available():
+        return fmt, 0, "Parquet export requires the pyarrow package"
+    try:
+        limit = int(max_rows) if max_rows else EXPORT_MAX_ROWS
+    except (TypeError, ValueError):
+        return fmt, 0, "maxRows must be an integer"
+    return fmt, max(1, min(limit, EXPORT_MAX_ROWS)), None
@@ -0,0 +1,150 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from shared_state import shared_store
+
+# Seconds to wait for each part before answering without it. The page is what
+# the user is looking at, so it gets the longest budget.
+DEFAULT_PART_TIMEOUTS = {'logs': 30.0, 'queries': 30.0, 'count': 2.0, 'stats': 2.0, 'timeDistribution': 2.0}
+DEFAULT_PART_TIMEOUT = 5.0
+
+# How long unfinished parts stay collectable through a follow-up request
+PENDING_TTL = 120.0
+
+
+class FanoutExecutor:
+    """Runs the independent parts of a dashboard response concurrently.
+
+    Parts that miss their timeout keep running; the caller gets a token to
+    collect them later with collect(). With a shared store, late parts are
+    also published there, so any worker process can answer the collect.
+    """
+
+    PARTS_NAMESPACE = 'parts'
+    PART_NAMESPACE = 'part'
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, max_workers: int = 16, pending_ttl: float = PENDING_TTL, store=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='benddash-fanout')
+        self.pending_ttl = pending_ttl
+        self.store = store
+        self._pending = {}  # token -> (expires_at, {part: future})
+        self._lock = threading.Lock()
+
+    def run(self, parts: Dict[str, Callable[[], Dict]], timeouts: Dict[str, float] = None) -> Tuple[Dict, List[str], Optional[str]]:
+        """Start every part and wait for each up to its own timeout.
+
+        Returns (merged results of finished parts, names of pending parts, token).
+        """
+        timeouts = {**DEFAULT_PART_TIMEOUTS, **(timeouts or {})}
+        start = time.monotonic()
+        # Parts run in the caller's context so per-request instrumentation follows them
+        futures = {name: self._executor.submit(contextvars.copy_context().run, fn) for name, fn in parts.items()}
+
+        # Wait for the parts in order of their deadlines
+        for name in sorted(futures, key=lambda n: timeouts.get(n, DEFAULT_PART_TIMEOUT)):
+            remaining = start + timeouts.get(name, DEFAULT_PART_TIMEOUT) - time.monotonic()
+            if remaining > 0:
+                wait([futures[name]], timeout=remaining)
+
+        return self._split(futures)
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """Run a single callable on the shared pool"""
+        return self._executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    def collect(self, token: str, timeout: float = 0) -> Optional[Tuple[Dict, List[str], Optional[str]]]:
+        """Results of parts left pending by run(); None if the token is unknown or expired"""
+        self._expire()
+        with self._lock:
+            entry = self._pending.pop(token, None)
+        if entry is None:
+            return self._collect_shared(token, timeout) if self.store is not None else None
+        _, futures = entry
+        if timeout > 0:
+            wait(list(futures.values()), timeout=timeout)
+        return self._split(futures, token)
+
+    def _split(self, futures: Dict, token: str = None) -> Tuple[Dict, List[str], Optional[str]]:
+        done, pending, failed = {}, {}, []
+        for name, future in futures.items():
+            if not future.done():
+                pending[name] = future
+                continue
+            try:
+                done.update(future.result())
+            except Exception as e:
+                print(f"❌ Fan-out part '{name}' failed: {e}")
+                failed.append(name)
+        if failed:
+            done['failedParts'] = sorted(failed)
+        if not pending:
+            return done, [], None
+        if token is None:
+            token = uuid.uuid4().hex
+            if self.store is not None:
+                self._publish(token, pending)
+        with self._lock:
+            self._pending[token] = (time.monotonic() + self.pending_ttl, pending)
+        return done, sorted(pending), token
+
+    def _publish(self, token: str, pending: Dict):
+        """Write each pending part to the shared store once it finishes"""
+        self.store.set(self.PARTS_NAMESPACE, token, json.dumps(sorted(pending)), self.pending_ttl)
+        for name, future in pending.items():
+            future.add_done_callback(lambda f, name=name: self._publish_part(token, name, f))
+
+    def _publish_part(self, token: str, name: str, future):
+        try:
+            part = {'result': future.result()}
+        except Exception:
+            part = {'failed': True}
+        try:
+            self.store.set(self.PART_NAMESPACE, f"{token}:{name}", json.dumps(part, default=str), self.pending_ttl)
+        except Exception as e:
+            print(f"⚠️ Failed to share fan-out part '{name}': {e}")
+
+    def _collect_shared(self, token: str, timeout: float) -> Optional[Tuple[Dict, List[str], Optional[str]]]:
+        """collect() for a token issued by another worker process"""
+        names, _ = self.store.get(self.PARTS_NAMESPACE, token)
+        if names is None:
+            return None
+        names = json.loads(names)
+        deadline = time.monotonic() + timeout
+        while True:
+            parts = {name: self.store.get(self.PART_NAMESPACE, f"{token}:{name}")[0] for name in names}
+            if all(parts.values()) or time.monotonic() >= deadline:
+                break
+            time.sleep(self.POLL_INTERVAL)
+        done, failed, pending = {}, [], []
+        for name, part in parts.items():
+            if part is None:
+                pending.append(name)
+                continue
+            part = json.loads(part)
+            if part.get('failed'):
+                failed.append(name)
+            else:
+                done.update(part['result'])
+        if failed:
+            done['failedParts'] = sorted(failed)
+        if not pending:
+            return done, [], None
+        # The next collect only waits for what is still missing
+        self.store.set(self.PARTS_NAMESPACE, token, json.dumps(pending), self.pending_ttl)
+        return done, sorted(pending), token
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            for token in [t for t, (expires_at, _) in self._pending.items() if expires_at <= now]:
+                del self._pending[token]
+
+
+fanout_executor = FanoutExecutor(max_workers=int(os.environ.get('BENDDASH_FANOUT_WORKERS', 16)), store=shared_store)
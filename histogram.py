@@ -0,0 +1,163 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+PRECISION_SECONDS = {'SECOND': 1, 'MINUTE': 60, 'HOUR': 3600, 'DAY': 86400}
+
+# Bars per time distribution when the request doesn't ask for a count
+HISTOGRAM_POINTS = int(os.environ.get('BENDDASH_HISTOGRAM_POINTS', 60))
+MAX_HISTOGRAM_POINTS = 500
+
+# Bucket widths in seconds, from one second to a day
+NICE_BUCKET_SECONDS = (
+    1, 2, 5, 10, 15, 30,
+    60, 120, 180, 300, 600, 900, 1200, 1800,
+    3600, 7200, 10800, 21600, 43200, 86400
+)
+
+_TRUNC_UNITS = {seconds: unit for unit, seconds in PRECISION_SECONDS.items()}
+
+# Rows reach the history tables with some delay, so a bucket is only treated
+# as closed once it ended at least this many seconds ago.
+DEFAULT_SETTLE_SECONDS = 120
+
+TS_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def format_ts(value: datetime.datetime) -> str:
+    """Render a timestamp the way Databend casts TIMESTAMP to VARCHAR"""
+    return value.strftime(TS_FORMAT)
+
+
+def parse_ts(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S')
+
+
+def floor_ts(value: datetime.datetime, seconds: int) -> datetime.datetime:
+    epoch = int((value - datetime.datetime(1970, 1, 1)).total_seconds())
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=epoch - epoch % seconds)
+
+
+def ceil_ts(value: datetime.datetime, seconds: int) -> datetime.datetime:
+    floored = floor_ts(value, seconds)
+    return floored if floored == value else floored + datetime.timedelta(seconds=seconds)
+
+
+def choose_bucket_seconds(span: datetime.timedelta, points: Optional[int] = None) -> int:
+    """Narrowest bucket width that splits span into at most points buckets.
+
+    Beyond a day per bucket, widths grow in whole days so the count stays bounded.
+    """
+    points = max(1, min(int(points or HISTOGRAM_POINTS), MAX_HISTOGRAM_POINTS))
+    span_seconds = max(span.total_seconds(), 1)
+    for seconds in NICE_BUCKET_SECONDS:
+        if span_seconds / seconds <= points:
+            return seconds
+    days = -(-span_seconds // (86400 * points))
+    return int(days) * 86400
+
+
+def time_bucket_sql(time_field: str, seconds: int) -> str:
+    """Databend expression flooring time_field to a bucket of the given width.
+
+    Calendar units use TRUNC; other widths floor the epoch seconds, so every
+    bucket starts on a multiple of its width since 1970-01-01 UTC.
+    """
+    unit = _TRUNC_UNITS.get(seconds)
+    if unit:
+        return f"TRUNC({time_field}, '{unit}')"
+    return f"TO_TIMESTAMP((TO_UNIX_TIMESTAMP({time_field}) DIV {seconds}) * {seconds})"
+
+
+class IncrementalHistogram:
+    """Caches the closed buckets of time distributions.
+
+    A series is identified by (table, filter signature, bucket width). On refresh
+    only the partial head bucket at the window start and the buckets after the
+    last closed one are queried; everything in between is served from memory.
+    """
+
+    def __init__(self, max_series: int = 256, settle_seconds: int = DEFAULT_SETTLE_SECONDS):
+        self.max_series = max_series
+        self.settle_seconds = settle_seconds
+        self._series = OrderedDict()  # key -> {'covered_from', 'closed_until', 'buckets'}
+        self._lock = threading.Lock()
+        self.full_scans = 0
+        self.tail_scans = 0
+
+    def make_key(self, table: str, where_clause: str, params: List, bucket_seconds: int) -> str:
+        payload = json.dumps([table, where_clause, params, bucket_seconds], default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str, window_start: datetime.datetime, bucket_seconds: int,
+            fetch: Callable[[str, List], List[Tuple[str, str, int]]],
+            now: Optional[datetime.datetime] = None,
+            window_end: Optional[datetime.datetime] = None) -> List[Tuple[str, str, int]]:
+        """Return (bucket, label, count) rows for [window_start, window_end), or up to now without an end.
+
+        fetch(range_condition, range_params) runs the aggregation restricted by
+        a condition on the time column, written with a '{time_field}' placeholder.
+        Only live windows, ending at or after now, belong here: the open
+        buckets are the ones still being written.
+        """
+        now = now or datetime.datetime.utcnow()
+        step = bucket_seconds
+        first_full = ceil_ts(window_start, step)
+        open_start = floor_ts(now - datetime.timedelta(seconds=self.settle_seconds), step)
+
+        with self._lock:
+            series = self._series.get(key)
+            if series is not None:
+                self._series.move_to_end(key)
+                series = {**series, 'buckets': dict(series['buckets'])}
+
+        reusable = (series is not None and series['covered_from'] <= first_full
+                    and series['closed_until'] >= first_full)
+        if reusable:
+            # Partial head bucket plus everything after the last closed bucket
+            condition = "(({time_field} >= ? AND {time_field} < ?) OR {time_field} >= ?)"
+            params = [format_ts(window_start), format_ts(first_full), format_ts(series['closed_until'])]
+            buckets = {b: counts for b, counts in series['buckets'].items() if parse_ts(b) >= first_full}
+            self.tail_scans += 1
+        else:
+            condition = "{time_field} >= ?"
+            params = [format_ts(window_start)]
+            buckets = {}
+            self.full_scans += 1
+
+        if window_end is not None:
+            condition += " AND {time_field} < ?"
+            params.append(format_ts(window_end))
+
+        fresh = {}
+        for bucket, label, count in fetch(condition, params):
+            fresh.setdefault(bucket, {})
+            fresh[bucket][label] = fresh[bucket].get(label, 0) + int(count)
+        buckets.update(fresh)
+
+        if first_full < open_start:
+            closed = {b: counts for b, counts in buckets.items() if first_full <= parse_ts(b) < open_start}
+            with self._lock:
+                self._series[key] = {'covered_from': first_full, 'closed_until': open_start, 'buckets': closed}
+                self._series.move_to_end(key)
+                while len(self._series) > self.max_series:
+                    self._series.popitem(last=False)
+
+        rows = []
+        for bucket in sorted(buckets):
+            for label, count in buckets[bucket].items():
+                rows.append((bucket, label, count))
+        return rows
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'series': len(self._series), 'fullScans': self.full_scans, 'tailScans': self.tail_scans}
+
+
+histogram_cache = IncrementalHistogram(
+    settle_seconds=int(os.environ.get('BENDDASH_HISTOGRAM_SETTLE_SECONDS', DEFAULT_SETTLE_SECONDS))
+)
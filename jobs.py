@@ -0,0 +1,329 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import cancellation
+from histogram import format_ts
+from shared_state import shared_store
+
+# Jobs running at once across all users; more wait in the executor queue
+JOB_WORKERS = int(os.environ.get('BENDDASH_JOB_WORKERS', 4))
+# Queued plus running jobs per session
+JOB_MAX_PER_USER = int(os.environ.get('BENDDASH_JOB_MAX_PER_USER', 2))
+# Finished jobs and their results are kept this long for polling and reuse
+JOB_RETENTION = int(os.environ.get('BENDDASH_JOB_RETENTION_SECONDS', 1800))
+MAX_JOBS = 500
+# Running jobs look up their scan progress at most this often
+PROGRESS_INTERVAL = 1.0
+
+ACTIVE = ('queued', 'running')
+# Jobs run a request whole, so the split and fan-out knobs of interactive loads do not apply
+JOB_IGNORED_FILTER_KEYS = {'_ts', 'mode', 'partTimeouts'}
+
+
+class JobLimitExceeded(Exception):
+    """Raised when a session already has its maximum of unfinished jobs"""
+
+
+def job_filters(filters: Dict) -> Dict:
+    return {key: value for key, value in filters.items() if key not in JOB_IGNORED_FILTER_KEYS}
+
+
+class Job:
+    def __init__(self, job_id: str, owner: str, kind: str, key: str, context: cancellation.QueryContext, db_client):
+        self.id = job_id
+        self.owner = owner
+        self.kind = kind
+        self.key = key
+        self.context = context
+        self.db = db_client
+        self.status = 'queued'
+        self.created_at = datetime.datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self.finished_monotonic = None
+        self.result = None
+        self.error = None
+        self.future = None
+        self.progress = {'runningStatements': 0, 'rowsScanned': 0, 'bytesScanned': 0}
+        self.progress_checked = 0.0
+
+    def to_dict(self, include_result: bool = False) -> Dict:
+        end = self.finished_at or datetime.datetime.utcnow()
+        info = {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'createdAt': format_ts(self.created_at),
+            'startedAt': format_ts(self.started_at) if self.started_at else None,
+            'finishedAt': format_ts(self.finished_at) if self.finished_at else None,
+            'elapsedMs': round((end - self.started_at).total_seconds() * 1000) if self.started_at else 0,
+            'progress': self.progress,
+            'error': self.error
+        }
+        if include_result and self.status == 'done':
+            info['result'] = self.result
+        return info
+
+
+class JobSnapshot:
+    """A job run by another worker process, as last published to the shared store"""
+
+    def __init__(self, record: Dict):
+        self.id = record['id']
+        self.owner = record['owner']
+        self.status = record['status']
+        self._record = record
+
+    def to_dict(self, include_result: bool = False) -> Dict:
+        info = {key: value for key, value in self._record.items() if key not in ('owner', 'key', 'result')}
+        if include_result and self.status == 'done':
+            info['result'] = self._record.get('result')
+        return info
+
+
+class JobManager:
+    """Runs expensive dashboard queries off the request thread.
+
+    Jobs run on a bounded executor, each session may have only a few queued
+    or running at once, and finished results are kept for a while so the same
+    request from the same session is answered from the finished job.
+
+    With a shared store, jobs are published there as they progress, so any
+    worker process can report, reuse or cancel them; the worker running a job
+    picks up cancellations from the store.
+    """
+
+    NAMESPACE = 'job'
+    KEY_NAMESPACE = 'job-key'
+    CANCEL_NAMESPACE = 'job-cancel'
+
+    def __init__(self, max_workers: int = JOB_WORKERS, max_per_user: int = JOB_MAX_PER_USER,
+                 retention: float = JOB_RETENTION, max_jobs: int = MAX_JOBS, store=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='benddash-job')
+        self.store = store
+        self._monitor = None
+        self.max_workers = max_workers
+        self.max_per_user = max_per_user
+        self.retention = retention
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()  # job id -> Job, oldest first
+        self._by_key = {}  # request key -> job id of its latest job
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'reused': 0, 'rejected': 0, 'done': 0, 'failed': 0, 'cancelled': 0}
+
+    @staticmethod
+    def make_key(owner: str, kind: str, target: str, filters: Dict) -> str:
+        payload = json.dumps([owner, kind, target, filters], sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def submit(self, owner: str, kind: str, target: str, filters: Dict, db_client,
+               run: Callable[[], Dict]) -> Tuple[Job, bool]:
+        """Start run() as a job, or return the session's unexpired job for the same request.
+
+        Returns (job, reused); raises JobLimitExceeded when the session is at its limit.
+        nocache filters always start a new job.
+        """
+        self._expire()
+        key = self.make_key(owner, kind, target, filters)
+        shared = self._shared_jobs(owner) if self.store is not None else {}
+        with self._lock:
+            existing = None if filters.get('nocache') else self._jobs.get(self._by_key.get(key))
+            if existing is None and not filters.get('nocache'):
+                existing = next((job for job in shared.values() if job._record.get('key') == key), None)
+            if existing is not None and existing.status in ACTIVE + ('done',):
+                self._stats['reused'] += 1
+                return existing, True
+            local = {job.id for job in self._jobs.values() if job.owner == owner and job.status in ACTIVE}
+            active = len(local | {job.id for job in shared.values() if job.status in ACTIVE})
+            if active >= self.max_per_user:
+                self._stats['rejected'] += 1
+                raise JobLimitExceeded(f"At most {self.max_per_user} jobs may be queued or running per session")
+            job_id = uuid.uuid4().hex
+            job = Job(job_id, owner, kind, key, cancellation.job_context(job_id, owner), db_client)
+            self._jobs[job_id] = job
+            self._by_key[key] = job_id
+            self._stats['submitted'] += 1
+            job.future = self._executor.submit(self._run, job, run)
+        self._publish(job)
+        if self.store is not None:
+            self._watch()
+        print(f"🧵 Job {job_id} ({kind}) submitted")
+        return job, False
+
+    def _run(self, job: Job, run: Callable[[], Dict]):
+        with self._lock:
+            if job.status != 'queued':
+                return
+            job.status = 'running'
+            job.started_at = datetime.datetime.utcnow()
+        self._publish(job)
+        # The job's statements are tagged with its id, so they can be watched and killed
+        cancellation.activate(job.context)
+        try:
+            result = run()
+            error = result.get('error') if isinstance(result, dict) else None
+        except Exception as e:
+            result, error = None, str(e)
+        finally:
+            cancellation.activate(None)
+        with self._lock:
+            if job.status == 'running':
+                job.status = 'failed' if error else 'done'
+                job.result = None if error else result
+                job.error = error
+                self._stats[job.status] += 1
+            job.finished_at = datetime.datetime.utcnow()
+            job.finished_monotonic = time.monotonic()
+        self._publish(job)
+        print(f"🧵 Job {job.id} {job.status} in {(job.finished_at - job.started_at).total_seconds():.3f}s")
+
+    def get(self, job_id: str, owner: str):
+        """A session's job with fresh progress, or None"""
+        self._expire()
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return self._shared_job(job_id, owner) if self.store is not None else None
+        if job.owner != owner:
+            return None
+        self._refresh_progress(job)
+        return job
+
+    def _refresh_progress(self, job: Job):
+        if job.status == 'running' and time.monotonic() - job.progress_checked >= PROGRESS_INTERVAL:
+            job.progress_checked = time.monotonic()
+            try:
+                job.progress = job.db.tagged_progress(job.id)
+            except Exception as e:
+                print(f"⚠️ Could not read progress of job {job.id}: {e}")
+            self._publish(job)
+
+    def cancel(self, job_id: str, owner: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            return self._cancel_shared(job_id, owner)
+        with self._lock:
+            if job is None or job.owner != owner:
+                return None
+            if job.status not in ACTIVE:
+                return job
+            was_running = job.status == 'running'
+            job.status = 'cancelled'
+            job.finished_at = datetime.datetime.utcnow()
+            job.finished_monotonic = time.monotonic()
+            self._stats['cancelled'] += 1
+        if was_running:
+            cancellation.query_tracker.cancel(job.context)
+        else:
+            job.future.cancel()
+        self._publish(job)
+        return job
+
+    def _publish(self, job: Job):
+        """Share a job's latest state with the other worker processes"""
+        if self.store is None:
+            return
+        record = dict(job.to_dict(include_result=True), owner=job.owner, key=job.key)
+        if job.status not in ACTIVE and self.store.get(self.CANCEL_NAMESPACE, job.id)[0]:
+            # Cancelled from another worker while it was finishing here
+            record.update(status='cancelled', result=None)
+        ttl = self.retention if job.status not in ACTIVE else self._active_ttl()
+        try:
+            self.store.set(self.NAMESPACE, f"{job.owner}:{job.id}", json.dumps(record, default=str), ttl)
+            self.store.set(self.KEY_NAMESPACE, job.key, job.id, ttl)
+        except Exception as e:
+            print(f"⚠️ Failed to share job {job.id}: {e}")
+
+    def _active_ttl(self) -> float:
+        # A worker that dies mid-job leaves its record behind until the job could no longer be running
+        return self.retention + (cancellation.STATEMENT_TIMEOUTS['/api/jobs'] or self.retention)
+
+    def _shared_jobs(self, owner: str) -> Dict[str, JobSnapshot]:
+        jobs = {}
+        for _, record in self.store.scan(self.NAMESPACE, f"{owner}:"):
+            job = JobSnapshot(json.loads(record))
+            jobs[job.id] = job
+        return jobs
+
+    def _shared_job(self, job_id: str, owner: str) -> Optional[JobSnapshot]:
+        record, _ = self.store.get(self.NAMESPACE, f"{owner}:{job_id}")
+        return JobSnapshot(json.loads(record)) if record else None
+
+    def _cancel_shared(self, job_id: str, owner: str) -> Optional[JobSnapshot]:
+        """Ask the worker running a job to cancel it"""
+        job = self._shared_job(job_id, owner)
+        if job is None or job.status not in ACTIVE:
+            return job
+        self.store.set(self.CANCEL_NAMESPACE, job_id, '1', self._active_ttl())
+        record = dict(job._record, status='cancelled', finishedAt=format_ts(datetime.datetime.utcnow()))
+        self.store.set(self.NAMESPACE, f"{owner}:{job_id}", json.dumps(record, default=str), self.retention)
+        with self._lock:
+            self._stats['cancelled'] += 1
+        return JobSnapshot(record)
+
+    def _watch(self):
+        with self._lock:
+            if self._monitor is not None and self._monitor.is_alive():
+                return
+            self._monitor = threading.Thread(target=self._monitor_jobs, name='benddash-job-monitor', daemon=True)
+            self._monitor.start()
+
+    def _monitor_jobs(self):
+        """Publish the progress of this worker's jobs and apply cancellations sent through other workers"""
+        while True:
+            with self._lock:
+                active = [job for job in self._jobs.values() if job.status in ACTIVE]
+                if not active:
+                    self._monitor = None
+                    return
+            for job in active:
+                try:
+                    if self.store.get(self.CANCEL_NAMESPACE, job.id)[0]:
+                        self.cancel(job.id, job.owner)
+                    else:
+                        self._refresh_progress(job)
+                except Exception as e:
+                    print(f"⚠️ Failed to check job {job.id}: {e}")
+            time.sleep(PROGRESS_INTERVAL)
+
+    def events(self, job, interval: float = 1.0, max_duration: float = 1800) -> Iterator[str]:
+        """Server-Sent Events with the job's status until it finishes"""
+        started = time.monotonic()
+        while time.monotonic() - started < max_duration:
+            job = self.get(job.id, job.owner) or job
+            yield f"event: status\ndata: {json.dumps(job.to_dict(), default=str)}\n\n"
+            if job.status not in ACTIVE:
+                return
+            time.sleep(interval)
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.status not in ACTIVE]
+            expired = [job for job in finished if now - job.finished_monotonic > self.retention]
+            # Beyond the cap the oldest finished jobs go first; unfinished ones are never dropped
+            overflow = len(self._jobs) - len(expired) - self.max_jobs
+            expired += [job for job in finished if job not in expired][:max(0, overflow)]
+            for job in expired:
+                del self._jobs[job.id]
+                if self._by_key.get(job.key) == job.id:
+                    del self._by_key[job.key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            statuses = {}
+            for job in self._jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+            return dict(self._stats, jobs=statuses, workers=self.max_workers, maxPerUser=self.max_per_user)
+
+
+job_manager = JobManager(store=shared_store)
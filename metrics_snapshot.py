@@ -0,0 +1,248 @@
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from histogram import floor_ts, format_ts, parse_ts
+from shared_state import SharedStore, shared_store
+from telemetry import db_operation
+
+# Seconds between background refreshes of each target's metrics
+METRICS_INTERVAL = int(os.environ.get('BENDDASH_METRICS_INTERVAL', 15))
+# Refreshing stops after this many seconds without a reader and restarts on the next read
+METRICS_IDLE_TIMEOUT = int(os.environ.get('BENDDASH_METRICS_IDLE_TIMEOUT', 600))
+
+WINDOW = datetime.timedelta(hours=24)
+# Minutes this recent are re-counted on every refresh to pick up late rows
+SETTLE = datetime.timedelta(seconds=120)
+
+
+class MetricsSnapshot:
+    """Dashboard metrics for one target, refreshed in the background and shared by all readers.
+
+    The 24h totals are kept as per-minute (total, errors) counts: a refresh
+    re-counts only the minutes since the previous watermark (minus a settle
+    margin) and drops the minutes that left the window, so the window is
+    exact to the minute.
+
+    With a SharedStore, only the worker holding the target's lease queries
+    Databend; it publishes the snapshot under key and the other workers read
+    it from there, taking over once the lease lapses.
+    """
+
+    NAMESPACE = 'metrics'
+    LEASE_NAMESPACE = 'metrics-lease'
+    # Longest a worker without a value waits for the leader's first one
+    WAIT_SECONDS = 10.0
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, db_client, interval: int = METRICS_INTERVAL, idle_timeout: int = METRICS_IDLE_TIMEOUT,
+                 store: Optional[SharedStore] = None, key: str = ''):
+        self.db = db_client
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.store = store
+        self.key = key
+        self.buckets = {}  # minute -> (total, errors)
+        self.watermark = None
+        self.value = None
+        self.as_of = None
+        self.last_error = None
+        self.last_read = time.monotonic()
+        self.full_scans = 0
+        self.delta_scans = 0
+        self._refresh_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+
+    def get(self) -> Dict:
+        self.last_read = time.monotonic()
+        self._ensure_thread()
+        if self.value is None:
+            try:
+                self.refresh(only_if_missing=True)
+            except Exception as e:
+                # Served as zeros with refreshError set; the background loop keeps retrying
+                print(f"❌ Metrics refresh failed: {e}")
+        value = dict(self.value or {'totalLogs': 0, 'errorRate': 0.0, 'avgQueryTime': 0.0, 'activeQueries': 0})
+        value['refreshError'] = self.last_error
+        return value
+
+    def freshness(self) -> Dict[str, str]:
+        """Response headers saying how old the served value is.
+
+        Kept out of the body, whose ETag would otherwise change on every read.
+        """
+        age = (datetime.datetime.utcnow() - self.as_of).total_seconds() if self.as_of else None
+        headers = {'X-Metrics-Stale': 'true' if age is None or age > 3 * self.interval else 'false'}
+        if age is not None:
+            headers['Age'] = str(int(age))
+            headers['X-Metrics-As-Of'] = format_ts(self.as_of)
+        return headers
+
+    def _ensure_thread(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='benddash-metrics', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._thread_lock:
+                if time.monotonic() - self.last_read > self.idle_timeout:
+                    # Nobody is looking; the next read restarts refreshing
+                    self._thread = None
+                    return
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"❌ Metrics refresh failed: {e}")
+
+    def refresh(self, only_if_missing: bool = False):
+        with self._refresh_lock:
+            if self.store is not None:
+                self._load_shared()
+            if only_if_missing and self.value is not None:
+                return
+            if not self._lead():
+                # Another worker refreshes this target
+                if only_if_missing:
+                    self._wait_for_leader()
+                return
+            now = datetime.datetime.utcnow()
+            window_start = floor_ts(now - WINDOW, 60)
+            if self.watermark is None or self.watermark - SETTLE < window_start:
+                since = window_start
+                self.full_scans += 1
+            else:
+                since = floor_ts(self.watermark - SETTLE, 60)
+                self.delta_scans += 1
+
+            try:
+                minutes = self._count_minutes(since)
+                active_queries = self._count_active_queries()
+            except Exception as e:
+                self.last_error = str(e)
+                self._publish()
+                raise
+
+            since_key, cutoff_key = format_ts(since), format_ts(window_start)
+            buckets = {m: c for m, c in self.buckets.items() if cutoff_key <= m < since_key}
+            buckets.update(minutes)
+            self.buckets = buckets
+
+            total = sum(t for t, _ in buckets.values())
+            errors = sum(e for _, e in buckets.values())
+            self.value = {
+                'totalLogs': total,
+                'errorRate': round(errors * 100.0 / total, 2) if total else 0.0,
+                # log_history doesn't have query duration
+                'avgQueryTime': 0.0,
+                'activeQueries': active_queries
+            }
+            self.watermark = now
+            self.as_of = now
+            self.last_error = None
+            self._publish()
+
+    def _lead(self) -> bool:
+        """Take or renew the target's lease; always True without a store"""
+        if self.store is None:
+            return True
+        return self.store.hold(self.LEASE_NAMESPACE, self.key, f"{os.getpid()}:{id(self)}", 3 * self.interval)
+
+    def _publish(self):
+        if self.store is None:
+            return
+        record = {
+            'buckets': self.buckets,
+            'watermark': format_ts(self.watermark) if self.watermark else None,
+            'value': self.value,
+            'asOf': format_ts(self.as_of) if self.as_of else None,
+            'error': self.last_error
+        }
+        self.store.set(self.NAMESPACE, self.key, json.dumps(record), WINDOW.total_seconds())
+
+    def _load_shared(self):
+        stored, _ = self.store.get(self.NAMESPACE, self.key)
+        if stored is None:
+            return
+        record = json.loads(stored)
+        self.buckets = {minute: tuple(counts) for minute, counts in record['buckets'].items()}
+        self.watermark = parse_ts(record['watermark']) if record['watermark'] else None
+        self.value = record['value']
+        self.as_of = parse_ts(record['asOf']) if record['asOf'] else None
+        self.last_error = record['error']
+
+    def _wait_for_leader(self):
+        deadline = time.monotonic() + self.WAIT_SECONDS
+        while self.value is None and self.last_error is None and time.monotonic() < deadline:
+            time.sleep(self.POLL_INTERVAL)
+            self._load_shared()
+
+    @db_operation
+    def _count_minutes(self, since: datetime.datetime) -> Dict[str, tuple]:
+        query = f"""
+        SELECT
+            TRUNC(timestamp, 'MINUTE')::VARCHAR as minute,
+            COUNT(*) as total,
+            SUM(CASE WHEN log_level = 'ERROR' THEN 1 ELSE 0 END) as errors
+        FROM {self.db.database}.log_history
+        WHERE timestamp >= ?
+        GROUP BY minute
+        """
+        rows, _, error = self.db.execute_query(query, [format_ts(since)])
+        if error:
+            raise RuntimeError(error)
+        return {minute: (int(total or 0), int(errors or 0)) for minute, total, errors in rows}
+
+    @db_operation
+    def _count_active_queries(self) -> int:
+        # Distinct counts can't be merged across refreshes, but five minutes is a small scan
+        query = f"""
+        SELECT COUNT(DISTINCT query_id)
+        FROM {self.db.database}.log_history
+        WHERE timestamp >= NOW() - INTERVAL 5 MINUTE AND query_id IS NOT NULL
+        """
+        rows, _, error = self.db.execute_query(query)
+        if error:
+            raise RuntimeError(error)
+        return int(rows[0][0] or 0) if rows else 0
+
+    def stats(self) -> Dict:
+        return {
+            'minutes': len(self.buckets),
+            'asOf': format_ts(self.as_of) if self.as_of else None,
+            'fullScans': self.full_scans,
+            'deltaScans': self.delta_scans,
+            'refreshing': self._thread is not None,
+            'shared': self.store is not None,
+            'lastError': self.last_error
+        }
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def metrics_snapshot_for(db_client) -> Optional[MetricsSnapshot]:
+    """The shared metrics snapshot of a client's target"""
+    if db_client is None:
+        return None
+    key = (db_client.cache_namespace, db_client.database)
+    with _snapshots_lock:
+        snapshot = _snapshots.get(key)
+        if snapshot is None:
+            snapshot = _snapshots[key] = MetricsSnapshot(db_client, store=shared_store, key=f"{key[0]}/{key[1]}")
+        else:
+            # Follow reconnects: the previous client of this target may have been closed
+            snapshot.db = db_client
+        return snapshot
+
+
+def metrics_snapshot_stats() -> Dict:
+    with _snapshots_lock:
+        return {f"{ns}/{db}": snapshot.stats() for (ns, db), snapshot in _snapshots.items()}
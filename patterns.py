@@ -0,0 +1,333 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from histogram import DEFAULT_SETTLE_SECONDS, floor_ts, format_ts, parse_ts
+
+# Templates kept per filter set; the least recently matched one is folded into "other"
+PATTERN_MAX_TEMPLATES = int(os.environ.get('BENDDASH_PATTERN_MAX_TEMPLATES', 1000))
+# Rows streamed per request at most; a window with more is reported as truncated
+PATTERN_MAX_ROWS = int(os.environ.get('BENDDASH_PATTERN_MAX_ROWS', 2_000_000))
+# Share of equal tokens for a message to join an existing template
+PATTERN_SIMILARITY = float(os.environ.get('BENDDASH_PATTERN_SIMILARITY', 0.4))
+PATTERN_MAX_STATES = int(os.environ.get('BENDDASH_PATTERN_MAX_STATES', 16))
+
+# Prefix tree depth: message length, then this many leading tokens
+PREFIX_TOKENS = 2
+MAX_CHILDREN = 100
+# Longer messages (stack traces) are cut here, the rest becomes one wildcard
+MAX_TOKENS = 64
+SAMPLE_QUERY_IDS = 5
+EXAMPLE_LENGTH = 500
+# Counts older than this many steps before the newest mined one are dropped
+RETAINED_STEPS = 3000
+
+WILDCARD = '<*>'
+
+# Order matters: whole identifiers first, bare numbers last
+_MASKS = (
+    (re.compile(r'\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b'), '<UUID>'),
+    (re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b'), '<IP>'),
+    (re.compile(r'(?:[A-Za-z]:)?(?:/[\w.\-@]+){2,}/?'), '<PATH>'),
+    (re.compile(r'\b(?:0x[0-9a-fA-F]+|[0-9a-fA-F]{16,})\b'), '<HEX>'),
+    (re.compile(r'(?<![\w.])[-+]?\d+(?:\.\d+)?[a-zA-Z%]*\b'), '<NUM>'),
+)
+
+
+def mask_message(message: str) -> List[str]:
+    """Tokens of a log message with numbers, UUIDs, addresses and paths masked"""
+    for pattern, replacement in _MASKS:
+        message = pattern.sub(replacement, message)
+    tokens = message.split()
+    if len(tokens) > MAX_TOKENS:
+        tokens = tokens[:MAX_TOKENS] + [WILDCARD]
+    return tokens
+
+
+class Template:
+    def __init__(self, template_id: int, tokens: List[str], example: str, leaf: List[int]):
+        self.id = template_id
+        self.tokens = tokens
+        self.example = example[:EXAMPLE_LENGTH]
+        self.leaf = leaf
+        self.buckets = {}  # step start -> rows
+        self.samples = []  # (timestamp, query_id), newest distinct query ids
+
+    def add_sample(self, timestamp: str, query_id: Optional[str]):
+        if not query_id or any(q == query_id for _, q in self.samples):
+            return
+        if len(self.samples) < SAMPLE_QUERY_IDS:
+            self.samples.append((timestamp, query_id))
+            return
+        oldest = min(range(len(self.samples)), key=lambda i: self.samples[i][0])
+        if self.samples[oldest][0] < timestamp:
+            self.samples[oldest] = (timestamp, query_id)
+
+
+class PatternMiner:
+    """Drain-style clustering of log messages into templates.
+
+    Messages are routed through a prefix tree by token count and their first
+    tokens; within the leaf the most similar template wins and has its
+    differing tokens replaced by wildcards, or a new template is started.
+    Templates carry per-step counts, so any window within the mined range can
+    be summarised without re-reading rows.
+    """
+
+    def __init__(self, step: int, max_templates: int = PATTERN_MAX_TEMPLATES, similarity: float = PATTERN_SIMILARITY):
+        self.step = step
+        self.max_templates = max_templates
+        self.similarity = similarity
+        self.templates = OrderedDict()  # id -> Template, least recently matched first
+        self.other = {}  # step start -> rows of evicted templates
+        self.covered_from = None
+        self.covered_until = None
+        self.lock = threading.Lock()
+        self._root = {}
+        self._next_id = 0
+
+    def _leaf(self, tokens: List[str]) -> List[int]:
+        node = self._root.setdefault(len(tokens), {})
+        for token in tokens[:PREFIX_TOKENS]:
+            key = WILDCARD if any(c.isdigit() for c in token) else token
+            if key not in node and len(node) >= MAX_CHILDREN:
+                key = WILDCARD
+            node = node.setdefault(key, {})
+        return node.setdefault(None, [])
+
+    def match(self, message: str) -> Template:
+        tokens = mask_message(message or '')
+        leaf = self._leaf(tokens)
+        best, best_score = None, -1.0
+        for template_id in leaf:
+            template = self.templates[template_id]
+            same = sum(1 for a, b in zip(template.tokens, tokens) if a == b)
+            score = same / len(tokens) if tokens else 1.0
+            if score > best_score:
+                best, best_score = template, score
+        if best is not None and best_score >= self.similarity:
+            best.tokens = [a if a == b else WILDCARD for a, b in zip(best.tokens, tokens)]
+            self.templates.move_to_end(best.id)
+            return best
+
+        template = Template(self._next_id, tokens, message or '', leaf)
+        self._next_id += 1
+        leaf.append(template.id)
+        self.templates[template.id] = template
+        while len(self.templates) > self.max_templates:
+            _, evicted = self.templates.popitem(last=False)
+            evicted.leaf.remove(evicted.id)
+            for bucket, count in evicted.buckets.items():
+                self.other[bucket] = self.other.get(bucket, 0) + count
+        return template
+
+    def mine(self, rows: Iterable[Tuple[str, Optional[str], str]], counts: Dict[int, Dict[str, int]]) -> int:
+        """Match (timestamp, query_id, message) rows, adding to counts[template id][step start].
+
+        Returns the number of rows read.
+        """
+        step_of = {}
+        prefix = 16 if self.step % 60 == 0 else 19
+        read = 0
+        for timestamp, query_id, message in rows:
+            timestamp = str(timestamp)
+            key = timestamp[:prefix]
+            bucket = step_of.get(key)
+            if bucket is None:
+                bucket = step_of[key] = format_ts(floor_ts(parse_ts(timestamp), self.step))
+            template = self.match(message)
+            template_counts = counts.setdefault(template.id, {})
+            template_counts[bucket] = template_counts.get(bucket, 0) + 1
+            template.add_sample(timestamp, query_id)
+            read += 1
+        return read
+
+    def merge(self, counts: Dict[int, Dict[str, int]]):
+        """Keep counts of a completely mined range"""
+        for template_id, buckets in counts.items():
+            template = self.templates.get(template_id)
+            target = template.buckets if template is not None else self.other
+            for bucket, count in buckets.items():
+                target[bucket] = target.get(bucket, 0) + count
+
+    def clear_counts(self):
+        for template in self.templates.values():
+            template.buckets = {}
+            template.samples = []
+        self.other = {}
+        self.covered_from = self.covered_until = None
+
+    def prune(self):
+        """Drop counts older than the retained span"""
+        if self.covered_until is None:
+            return
+        cutoff = self.covered_until - datetime.timedelta(seconds=self.step * RETAINED_STEPS)
+        if self.covered_from >= cutoff:
+            return
+        self.covered_from = cutoff
+        cutoff_key = format_ts(cutoff)
+        for template in self.templates.values():
+            template.buckets = {b: c for b, c in template.buckets.items() if b >= cutoff_key}
+            template.samples = [s for s in template.samples if s[0] >= cutoff_key]
+        self.other = {b: c for b, c in self.other.items() if b >= cutoff_key}
+
+    def summary(self, start: datetime.datetime, end: datetime.datetime, bucket_seconds: int, limit: int,
+                tail: Dict[int, Dict[str, int]]) -> Dict:
+        """Top templates of [start, end) with sparklines of bucket_seconds wide bars"""
+        start_key, end_key = format_ts(start), format_ts(end)
+        bucket_count = max(1, int((end - start).total_seconds() // bucket_seconds))
+        buckets = [format_ts(start + datetime.timedelta(seconds=i * bucket_seconds)) for i in range(bucket_count)]
+        index_of = {}
+
+        def sparkline(*sources) -> Tuple[int, List[int]]:
+            line = [0] * bucket_count
+            for source in sources:
+                for bucket, count in source.items():
+                    if not start_key <= bucket < end_key:
+                        continue
+                    index = index_of.get(bucket)
+                    if index is None:
+                        offset = (parse_ts(bucket) - start).total_seconds()
+                        index = index_of[bucket] = min(int(offset // bucket_seconds), bucket_count - 1)
+                    line[index] += count
+            return sum(line), line
+
+        patterns = []
+        for template in self.templates.values():
+            count, line = sparkline(template.buckets, tail.get(template.id, {}))
+            if not count:
+                continue
+            patterns.append({
+                'template': ' '.join(template.tokens),
+                'count': count,
+                'sampleQueryIds': [q for ts, q in sorted(template.samples, reverse=True) if start_key <= ts < end_key],
+                'example': template.example,
+                'sparkline': line
+            })
+        patterns.sort(key=lambda p: p['count'], reverse=True)
+
+        evicted = [c for i, c in tail.items() if i not in self.templates]
+        other_count, _ = sparkline(self.other, *evicted)
+        total = sum(p['count'] for p in patterns) + other_count
+        for pattern in patterns:
+            pattern['share'] = round(pattern['count'] * 100.0 / total, 2)
+        return {
+            'patterns': patterns[:limit],
+            'templateCount': len(patterns),
+            'totalRows': total,
+            'otherRows': other_count,
+            'buckets': buckets,
+            'bucketSeconds': bucket_seconds
+        }
+
+
+class PatternCache:
+    """Pattern miners per filter set, remembering which time range each has mined.
+
+    A request only streams the rows of its window that the miner has not seen:
+    the part before the mined range and the part after it. Rows younger than
+    the settle time are mined for the response but not kept, as more of them
+    may still arrive.
+    """
+
+    def __init__(self, max_states: int = PATTERN_MAX_STATES, settle_seconds: int = DEFAULT_SETTLE_SECONDS):
+        self.max_states = max_states
+        self.settle_seconds = settle_seconds
+        self._miners = OrderedDict()  # key -> PatternMiner
+        self._lock = threading.Lock()
+        self.rows_mined = 0
+        self.rows_reused = 0
+
+    def make_key(self, source: str, where_clause: str, params: List) -> str:
+        payload = json.dumps([source, where_clause, params], default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def step_for(bucket_seconds: int) -> int:
+        # Windows up to a day keep minute counts, so refreshes and zooms within them share one miner
+        return 60 if bucket_seconds % 60 == 0 and bucket_seconds <= 1800 else bucket_seconds
+
+    def _miner(self, key: str, step: int) -> PatternMiner:
+        with self._lock:
+            miner = self._miners.get((key, step))
+            if miner is None:
+                miner = self._miners[(key, step)] = PatternMiner(step)
+            self._miners.move_to_end((key, step))
+            while len(self._miners) > self.max_states:
+                self._miners.popitem(last=False)
+            return miner
+
+    def get(self, key: str, start: datetime.datetime, end: datetime.datetime, bucket_seconds: int,
+            stream: Callable[[str, str, int], Iterable[Tuple[str, Optional[str], str]]],
+            limit: int, max_rows: int = PATTERN_MAX_ROWS, now: Optional[datetime.datetime] = None) -> Dict:
+        """Top templates of [start, end); stream(start, end, limit) yields (timestamp, query_id, message) rows"""
+        now = now or datetime.datetime.utcnow()
+        step = self.step_for(bucket_seconds)
+        settled = min(end, floor_ts(now - datetime.timedelta(seconds=self.settle_seconds), step))
+        miner = self._miner(key, step)
+
+        with miner.lock:
+            kept = []
+            if start < settled:
+                if miner.covered_from is not None and (start > miner.covered_until or settled < miner.covered_from):
+                    # Not adjacent to what was mined; start the range over but keep the templates
+                    miner.clear_counts()
+                if miner.covered_from is None:
+                    kept = [(start, settled)]
+                else:
+                    kept = [r for r in [(start, miner.covered_from), (miner.covered_until, settled)] if r[0] < r[1]]
+
+            budget, truncated, mined = max_rows, False, 0
+            tail = {}
+            for range_start, range_end in kept:
+                counts = {}
+                read = miner.mine(stream(format_ts(range_start), format_ts(range_end), budget + 1), counts)
+                mined += read
+                budget -= read
+                if budget < 0:
+                    # Incomplete ranges only count for this response
+                    truncated = True
+                    self._add(tail, counts)
+                    break
+                miner.merge(counts)
+                miner.covered_from = min(miner.covered_from or range_start, range_start)
+                miner.covered_until = max(miner.covered_until or range_end, range_end)
+            open_start = max(start, settled)
+            if not truncated and open_start < end:
+                read = miner.mine(stream(format_ts(open_start), format_ts(end), budget + 1), tail)
+                mined += read
+                truncated = read > budget
+            miner.prune()
+            result = miner.summary(start, end, bucket_seconds, limit, tail)
+
+        result.update({'minedRows': mined, 'truncated': truncated})
+        self.rows_mined += mined
+        self.rows_reused += max(0, result['totalRows'] - mined)
+        return result
+
+    @staticmethod
+    def _add(target: Dict[int, Dict[str, int]], counts: Dict[int, Dict[str, int]]):
+        for template_id, buckets in counts.items():
+            template_counts = target.setdefault(template_id, {})
+            for bucket, count in buckets.items():
+                template_counts[bucket] = template_counts.get(bucket, 0) + count
+
+    def stats(self) -> Dict:
+        with self._lock:
+            miners = list(self._miners.values())
+        return {
+            'miners': len(miners),
+            'templates': sum(len(m.templates) for m in miners),
+            'rowsMined': self.rows_mined,
+            'rowsReused': self.rows_reused
+        }
+
+
+pattern_cache = PatternCache(
+    settle_seconds=int(os.environ.get('BENDDASH_HISTOGRAM_SETTLE_SECONDS', DEFAULT_SETTLE_SECONDS))
+)
@@ -0,0 +1,267 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout"""
+
+
+# Driver errors saying the connection itself is gone, as opposed to a failed statement
+_CONNECTION_ERROR_RE = re.compile(r'transport|connection (?:refused|reset|closed|aborted)|broken pipe', re.IGNORECASE)
+
+
+def is_connection_error(error: BaseException) -> bool:
+    return isinstance(error, (ConnectionError, OSError)) or bool(_CONNECTION_ERROR_RE.search(str(error)))
+
+
+class PooledConnection:
+    def __init__(self, raw: Any):
+        self.raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """Bounded pool of driver cursors shared by all requests of one DSN.
+
+    Idle connections above min_size are evicted after idle_timeout. Liveness
+    probes only run while the pool has seen traffic recently: a probe is a
+    real query, and sending one to an otherwise idle warehouse would resume it.
+    """
+
+    def __init__(self, factory: Callable[[], Any], min_size: int = 1, max_size: int = 8,
+                 checkout_timeout: float = 30.0, idle_timeout: float = 300.0,
+                 probe_interval: float = 60.0, probe_active_window: float = 120.0,
+                 probe_query: str = "SELECT 1"):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"Invalid pool bounds: min={min_size}, max={max_size}")
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.probe_interval = probe_interval
+        self.probe_active_window = probe_active_window
+        self.probe_query = probe_query
+
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._last_checkout = 0.0
+
+        self._stats = {
+            'checkouts': 0, 'timeouts': 0, 'created': 0, 'discarded': 0,
+            'evicted': 0, 'probes': 0, 'probeFailures': 0, 'statementErrors': 0,
+            'waitTotalMs': 0.0, 'waitMaxMs': 0.0
+        }
+
+        for _ in range(min_size):
+            self._idle.append(PooledConnection(factory()))
+            self._size += 1
+            self._stats['created'] += 1
+
+        self._maintainer = threading.Thread(target=self._maintain_loop, name='benddash-pool', daemon=True)
+        self._maintainer.start()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """Check out a connection.
+
+        A failed statement (bad SQL, a killed or timed out query) leaves the
+        connection usable, so it goes back to the pool once a probe confirms
+        it still answers. Connection errors, failed probes and streams closed
+        before their last row discard it.
+        """
+        conn = self.acquire(timeout)
+        try:
+            yield conn.raw
+        except GeneratorExit:
+            # The cursor still holds the unread rest of the stream
+            self.release(conn, broken=True)
+            raise
+        except Exception as e:
+            self.release(conn, broken=is_connection_error(e) or not self._probe(conn, 'statementErrors'))
+            raise
+        except BaseException:
+            self.release(conn, broken=True)
+            raise
+        else:
+            self.release(conn)
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledConnection:
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        create = False
+
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Connection pool is closed")
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                        conn = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f"Timed out after {timeout:.1f}s waiting for a database connection "
+                                          f"({self.max_size} in use)")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._in_use += 1
+            self._last_checkout = time.monotonic()
+            self._record_wait(self._last_checkout - start)
+
+        if create:
+            try:
+                conn = PooledConnection(self.factory())
+            except BaseException:
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats['created'] += 1
+        return conn
+
+    def release(self, conn: PooledConnection, broken: bool = False):
+        with self._cond:
+            self._in_use -= 1
+            if broken or self._closed:
+                self._size -= 1
+                self._stats['discarded'] += 1
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+            self._cond.notify()
+        if broken or self._closed:
+            self._close_raw(conn)
+
+    def _record_wait(self, waited: float):
+        waited_ms = waited * 1000
+        self._stats['checkouts'] += 1
+        self._stats['waitTotalMs'] += waited_ms
+        self._stats['waitMaxMs'] = max(self._stats['waitMaxMs'], waited_ms)
+
+    def _close_raw(self, conn: PooledConnection):
+        try:
+            conn.raw.close()
+        except Exception:
+            pass
+
+    def _maintain_loop(self):
+        interval = max(1.0, min(self.probe_interval, self.idle_timeout) / 2)
+        while True:
+            time.sleep(interval)
+            with self._cond:
+                if self._closed:
+                    return
+            self._evict_idle()
+            self._probe_idle()
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        evicted = []
+        with self._cond:
+            # Oldest idle connections sit at the left end of the deque
+            while self._idle and self._size > self.min_size and now - self._idle[0].last_used > self.idle_timeout:
+                evicted.append(self._idle.popleft())
+                self._size -= 1
+                self._stats['evicted'] += 1
+        for conn in evicted:
+            self._close_raw(conn)
+
+    def _probe_idle(self):
+        now = time.monotonic()
+        with self._cond:
+            if now - self._last_checkout > self.probe_active_window:
+                # No recent traffic: let a suspended warehouse stay suspended
+                return
+            stale = [c for c in self._idle if now - c.last_used > self.probe_interval]
+            for conn in stale:
+                self._idle.remove(conn)
+                self._in_use += 1
+
+        for conn in stale:
+            self.release(conn, broken=not self._probe(conn))
+
+    def _probe(self, conn: PooledConnection, reason: Optional[str] = None) -> bool:
+        """Whether a connection still answers the probe query; reason names a stat to count the probe under"""
+        try:
+            conn.raw.execute(self.probe_query)
+            conn.raw.fetchall()
+            alive = True
+        except Exception as e:
+            print(f"⚠️ Pool liveness probe failed, discarding connection: {e}")
+            alive = False
+        with self._cond:
+            self._stats['probes'] += 1
+            if not alive:
+                self._stats['probeFailures'] += 1
+            if reason:
+                self._stats[reason] += 1
+        return alive
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._size -= len(idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_raw(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            checkouts = self._stats['checkouts']
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'inUse': self._in_use,
+                'waiting': self._waiting,
+                'minSize': self.min_size,
+                'maxSize': self.max_size,
+                'checkouts': checkouts,
+                'timeouts': self._stats['timeouts'],
+                'created': self._stats['created'],
+                'discarded': self._stats['discarded'],
+                'evicted': self._stats['evicted'],
+                'probes': self._stats['probes'],
+                'probeFailures': self._stats['probeFailures'],
+                'statementErrors': self._stats['statementErrors'],
+                'avgWaitMs': round(self._stats['waitTotalMs'] / checkouts, 3) if checkouts else 0.0,
+                'maxWaitMs': round(self._stats['waitMaxMs'], 3)
+            }
+
+
+def pool_settings_from_env() -> Dict[str, Any]:
+    """Pool sizing read from BENDDASH_POOL_* environment variables"""
+    return {
+        'min_size': int(os.environ.get('BENDDASH_POOL_MIN', 1)),
+        'max_size': int(os.environ.get('BENDDASH_POOL_MAX', 8)),
+        'checkout_timeout': float(os.environ.get('BENDDASH_POOL_CHECKOUT_TIMEOUT', 30)),
+        'idle_timeout': float(os.environ.get('BENDDASH_POOL_IDLE_TIMEOUT', 300)),
+        'probe_interval': float(os.environ.get('BENDDASH_POOL_PROBE_INTERVAL', 60)),
+    }
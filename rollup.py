@@ -0,0 +1,339 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from histogram import ceil_ts, floor_ts, format_ts, parse_ts
+from shared_state import SharedStore, shared_store
+from telemetry import db_operation
+
+# Background rollups are opt-in: BENDDASH_ROLLUP=1 or `app.py --rollup`
+ROLLUP_ENABLED = os.environ.get('BENDDASH_ROLLUP', '0') == '1'
+
+ROLLUP_INTERVAL = int(os.environ.get('BENDDASH_ROLLUP_INTERVAL', 60))
+# An aggregator nobody read from for this many seconds stops and is dropped; the next read starts a new one
+ROLLUP_IDLE_TIMEOUT = int(os.environ.get('BENDDASH_ROLLUP_IDLE_TIMEOUT', 3600))
+ROLLUP_RETENTION = datetime.timedelta(days=2)
+BACKFILL_CHUNK = datetime.timedelta(hours=6)
+
+# A minute is only rolled up once no more rows are expected for it. QueryEnd
+# rows carry the query's start time, so query minutes settle much later.
+LOG_SETTLE = datetime.timedelta(seconds=int(os.environ.get('BENDDASH_ROLLUP_LOG_SETTLE_SECONDS', 120)))
+QUERY_SETTLE = datetime.timedelta(seconds=int(os.environ.get('BENDDASH_ROLLUP_QUERY_SETTLE_SECONDS', 900)))
+
+LOG_DIMENSIONS = ('log_level', 'node_id', 'warehouse_id')
+QUERY_DIMENSIONS = ('status', 'sql_user', 'current_database')
+
+# Chart series of the query time distribution, shared by the live queries and the rollup
+QUERY_STATUS_EXPR = "CASE WHEN exception_code IS NOT NULL AND exception_code != 0 THEN 'error' ELSE 'success' END"
+
+
+def bucket_expr(precision_seconds: int) -> str:
+    """SQLite expression truncating a rolled-up minute to a chart bucket"""
+    if precision_seconds == 60:
+        return "minute"
+    if precision_seconds == 3600:
+        return "substr(minute, 1, 13) || ':00:00.000000'"
+    if precision_seconds == 86400:
+        return "substr(minute, 1, 10) || ' 00:00:00.000000'"
+    # Other whole-minute widths floor the epoch seconds, like the live query does
+    return (f"strftime('%Y-%m-%d %H:%M:%S', (CAST(strftime('%s', substr(minute, 1, 19)) AS INTEGER) "
+            f"/ {precision_seconds}) * {precision_seconds}, 'unixepoch') || '.000000'")
+
+
+class RollupAggregator:
+    """Maintains minute-granularity rollups of log_history and query_history.
+
+    Rollups live in a SQLite database keyed by the target plus
+    (minute, log_level, node_id, warehouse_id) for logs and
+    (minute, status, sql_user, current_database) for queries. Each source has a
+    watermark: every minute before it has been aggregated and will not change.
+
+    Without a SharedStore the database is private and in memory. With one, the
+    tables live in the store's file and only the worker holding the target's
+    lease scans Databend; it publishes its watermarks under key, and the other
+    workers answer from the same tables up to them.
+
+    The aggregator stops once its client is closed or nobody has used it for
+    idle_timeout seconds.
+    """
+
+    LEASE_NAMESPACE = 'rollup-lease'
+    WATERMARK_NAMESPACE = 'rollup-watermark'
+
+    def __init__(self, db_client, interval: int = ROLLUP_INTERVAL, retention: datetime.timedelta = ROLLUP_RETENTION,
+                 idle_timeout: int = ROLLUP_IDLE_TIMEOUT, shared_store: Optional[SharedStore] = None, key: str = ''):
+        self.db = db_client
+        self.interval = interval
+        self.retention = retention
+        self.idle_timeout = idle_timeout
+        self.shared_store = shared_store
+        self.key = key
+        self.leader = shared_store is None
+        self.last_used = time.monotonic()
+        self.watermarks = {'log': None, 'query': None}
+        self.started_at = {'log': None, 'query': None}
+        self.last_error = None
+        if shared_store is None:
+            self._store = sqlite3.connect(':memory:', check_same_thread=False)
+        else:
+            self._store = sqlite3.connect(shared_store.path, timeout=shared_store.busy_timeout, check_same_thread=False)
+        self._store_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._init_store()
+
+    def _init_store(self):
+        with self._store_lock:
+            self._store.executescript("""
+                CREATE TABLE IF NOT EXISTS log_rollup (
+                    target TEXT, minute TEXT, log_level TEXT, node_id TEXT, warehouse_id TEXT, cnt INTEGER,
+                    PRIMARY KEY (target, minute, log_level, node_id, warehouse_id)
+                );
+                CREATE TABLE IF NOT EXISTS query_rollup (
+                    target TEXT, minute TEXT, status TEXT, sql_user TEXT, current_database TEXT,
+                    row_count INTEGER, query_count INTEGER, duration_sum INTEGER,
+                    PRIMARY KEY (target, minute, status, sql_user, current_database)
+                );
+            """)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='benddash-rollup', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.db.closed or time.monotonic() - self.last_used > self.idle_timeout:
+                break
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"❌ Rollup refresh failed: {e}")
+            self._stop.wait(self.interval)
+        self._stop.set()
+        _forget(self)
+        print(f"💤 Rollup aggregator for {self.db.cache_namespace}/{self.db.database} stopped")
+
+    def refresh(self, now: Optional[datetime.datetime] = None):
+        """Aggregate every settled minute after the watermarks"""
+        now = now or datetime.datetime.utcnow()
+        if self.shared_store is not None:
+            self._load_watermarks()
+            if not self._lead():
+                # Another worker rolls this target up into the shared tables
+                return
+        self._advance('log', now - LOG_SETTLE, now)
+        self._advance('query', now - QUERY_SETTLE, now)
+        self._expire(now)
+
+    def _lead(self) -> bool:
+        """Take or renew the target's lease; always True for a private aggregator"""
+        if self.shared_store is not None:
+            self.leader = self.shared_store.hold(self.LEASE_NAMESPACE, self.key, f"{os.getpid()}:{id(self)}",
+                                                   3 * self.interval)
+        return self.leader
+
+    def _publish_watermarks(self):
+        if self.shared_store is None:
+            return
+        record = {f"{kind}:{source}": format_ts(value) if value else None
+                  for kind, values in (('watermark', self.watermarks), ('started', self.started_at))
+                  for source, value in values.items()}
+        self.shared_store.set(self.WATERMARK_NAMESPACE, self.key, json.dumps(record), self.retention.total_seconds())
+
+    def _load_watermarks(self):
+        stored, _ = self.shared_store.get(self.WATERMARK_NAMESPACE, self.key)
+        if stored is None:
+            return
+        record = json.loads(stored)
+        for source in self.watermarks:
+            watermark, started = record[f"watermark:{source}"], record[f"started:{source}"]
+            self.watermarks[source] = parse_ts(watermark) if watermark else None
+            self.started_at[source] = parse_ts(started) if started else None
+
+    def _advance(self, source: str, settled: datetime.datetime, now: datetime.datetime):
+        end = floor_ts(settled, 60)
+        start = self.watermarks[source]
+        if start is None:
+            start = floor_ts(now - self.retention, 60)
+            self.started_at[source] = start
+        # Backfill in chunks so the first run never aggregates two days in one statement
+        while start < end and self._lead():
+            chunk_end = min(start + BACKFILL_CHUNK, end)
+            if source == 'log':
+                self._aggregate_logs(start, chunk_end)
+            else:
+                self._aggregate_queries(start, chunk_end)
+            start = chunk_end
+            self.watermarks[source] = start
+            self._publish_watermarks()
+
+    @db_operation
+    def _aggregate_logs(self, start: datetime.datetime, end: datetime.datetime):
+        query = f"""
+        SELECT
+            TRUNC(timestamp, 'MINUTE')::VARCHAR as minute,
+            log_level, node_id, warehouse_id,
+            COUNT(*) as cnt
+        FROM {self.db.database}.log_history
+        WHERE timestamp >= ? AND timestamp < ?
+        GROUP BY minute, log_level, node_id, warehouse_id
+        """
+        rows, _, error = self.db.execute_query(query, [format_ts(start), format_ts(end)])
+        if error:
+            raise RuntimeError(error)
+        with self._store_lock:
+            self._store.executemany("INSERT OR REPLACE INTO log_rollup VALUES (?, ?, ?, ?, ?, ?)",
+                                    [(self.key,) + tuple(r[:4]) + (int(r[4]),) for r in rows])
+            self._store.commit()
+
+    @db_operation
+    def _aggregate_queries(self, start: datetime.datetime, end: datetime.datetime):
+        query = f"""
+        SELECT
+            TRUNC(query_start_time, 'MINUTE')::VARCHAR as minute,
+            {QUERY_STATUS_EXPR} as status, sql_user, current_database,
+            COUNT(*) as row_count,
+            SUM(CASE WHEN log_type_name = 'QueryEnd' THEN 1 ELSE 0 END) as query_count,
+            SUM(CASE WHEN log_type_name = 'QueryEnd' THEN query_duration_ms ELSE 0 END) as duration_sum
+        FROM {self.db.database}.query_history
+        WHERE query_start_time >= ? AND query_start_time < ?
+        GROUP BY minute, status, sql_user, current_database
+        """
+        rows, _, error = self.db.execute_query(query, [format_ts(start), format_ts(end)])
+        if error:
+            raise RuntimeError(error)
+        with self._store_lock:
+            self._store.executemany("INSERT OR REPLACE INTO query_rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    [(self.key,) + tuple(r[:4]) + tuple(int(v or 0) for v in r[4:7]) for r in rows])
+            self._store.commit()
+
+    def _expire(self, now: datetime.datetime):
+        cutoff = format_ts(floor_ts(now - self.retention, 60))
+        with self._store_lock:
+            self._store.execute("DELETE FROM log_rollup WHERE target = ? AND minute < ?", [self.key, cutoff])
+            self._store.execute("DELETE FROM query_rollup WHERE target = ? AND minute < ?", [self.key, cutoff])
+            self._store.commit()
+        for source, started in self.started_at.items():
+            if started is not None and format_ts(started) < cutoff:
+                self.started_at[source] = floor_ts(now - self.retention, 60)
+        self._publish_watermarks()
+
+    def coverage(self, source: str, window_start: datetime.datetime, precision_seconds: int) -> Optional[Tuple[datetime.datetime, datetime.datetime]]:
+        """[from, to) range of the window the rollup can answer, or None.
+
+        The range starts at the first whole chart bucket of the window and ends
+        at the watermark; callers scan the two edges live.
+        """
+        watermark = self.watermarks[source]
+        started = self.started_at[source]
+        if watermark is None or started is None or precision_seconds % 60:
+            return None
+        first_full = ceil_ts(window_start, precision_seconds)
+        # The live tail must start on a bucket boundary too
+        rollup_end = floor_ts(watermark, precision_seconds)
+        if started > first_full or rollup_end <= first_full:
+            return None
+        return first_full, rollup_end
+
+    def log_buckets(self, start: datetime.datetime, end: datetime.datetime, precision_seconds: int,
+                    level: Optional[str] = None, dimensions: Dict[str, str] = None) -> List[Tuple[str, str, int]]:
+        """(bucket, log_level, count) rows for [start, end)"""
+        conditions, params = ["target = ?", "minute >= ?", "minute < ?"], [self.key, format_ts(start), format_ts(end)]
+        if level:
+            conditions.append("log_level = ?")
+            params.append(level)
+        for column, value in (dimensions or {}).items():
+            conditions.append(f"{column} = ?")
+            params.append(value)
+        sql = f"""
+            SELECT {bucket_expr(precision_seconds)} AS bucket, log_level, SUM(cnt)
+            FROM log_rollup WHERE {' AND '.join(conditions)}
+            GROUP BY bucket, log_level
+        """
+        with self._store_lock:
+            return self._store.execute(sql, params).fetchall()
+
+    def query_buckets(self, start: datetime.datetime, end: datetime.datetime, precision_seconds: int,
+                      dimensions: Dict[str, str] = None) -> List[Tuple[str, str, int, int, int]]:
+        """(bucket, status, row_count, query_count, duration_sum) rows for [start, end)"""
+        conditions, params = ["target = ?", "minute >= ?", "minute < ?"], [self.key, format_ts(start), format_ts(end)]
+        for column, value in (dimensions or {}).items():
+            conditions.append(f"{column} = ?")
+            params.append(value)
+        sql = f"""
+            SELECT {bucket_expr(precision_seconds)} AS bucket, status,
+                   SUM(row_count), SUM(query_count), SUM(duration_sum)
+            FROM query_rollup WHERE {' AND '.join(conditions)}
+            GROUP BY bucket, status
+        """
+        with self._store_lock:
+            return self._store.execute(sql, params).fetchall()
+
+    def stats(self) -> Dict:
+        with self._store_lock:
+            log_rows = self._store.execute("SELECT COUNT(*) FROM log_rollup WHERE target = ?", [self.key]).fetchone()[0]
+            query_rows = self._store.execute("SELECT COUNT(*) FROM query_rollup WHERE target = ?",
+                                             [self.key]).fetchone()[0]
+        return {
+            'logWatermark': format_ts(self.watermarks['log']) if self.watermarks['log'] else None,
+            'queryWatermark': format_ts(self.watermarks['query']) if self.watermarks['query'] else None,
+            'logRows': log_rows,
+            'queryRows': query_rows,
+            'leader': self.leader,
+            'lastError': self.last_error
+        }
+
+
+_aggregators = {}
+_aggregators_lock = threading.Lock()
+
+
+def rollup_for(db_client) -> Optional[RollupAggregator]:
+    """The running aggregator for a client's target, started on first use"""
+    if not ROLLUP_ENABLED or db_client is None:
+        return None
+    key = (db_client.cache_namespace, db_client.database)
+    with _aggregators_lock:
+        aggregator = _aggregators.get(key)
+        if aggregator is None or aggregator._stop.is_set():
+            aggregator = RollupAggregator(db_client, shared_store=shared_store, key=f"{key[0]}/{key[1]}")
+            aggregator.start()
+            _aggregators[key] = aggregator
+        else:
+            # Follow reconnects: the previous client of this target may have been closed
+            aggregator.db = db_client
+        aggregator.last_used = time.monotonic()
+        return aggregator
+
+
+def release_rollup(db_client):
+    """Stop the aggregator reading through a client that is being closed"""
+    key = (db_client.cache_namespace, db_client.database)
+    with _aggregators_lock:
+        aggregator = _aggregators.get(key)
+        if aggregator is None or aggregator.db is not db_client:
+            return
+        del _aggregators[key]
+    aggregator.stop()
+
+
+def _forget(aggregator: RollupAggregator):
+    key = (aggregator.db.cache_namespace, aggregator.db.database)
+    with _aggregators_lock:
+        if _aggregators.get(key) is aggregator:
+            del _aggregators[key]
+
+
+def rollup_stats() -> Dict:
+    with _aggregators_lock:
+        return {f"{ns}/{db}": agg.stats() for (ns, db), agg in _aggregators.items()}
@@ -0,0 +1,220 @@
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# auto: use an index when one exists; like: always LIKE; match: assume an inverted index
+SEARCH_MODE = os.environ.get('BENDDASH_SEARCH_MODE', 'auto').lower()
+INDEX_CACHE_TTL = int(os.environ.get('BENDDASH_SEARCH_INDEX_TTL', 300))
+
+_TOKEN_RE = re.compile(r'(-?)"([^"]*)"|(\S+)')
+# Explicit search syntax: a "quoted phrase", OR between words, NOT before one, or a prefix* word
+_OPERATOR_RE = re.compile(r'(?:^|\s)-?"[^"]*"(?:\s|$)|\S\s+OR\s+\S|(?:^|\s)NOT\s+\S|\S\*(?:\s|$)')
+# Index clauses of SHOW CREATE TABLE, e.g. "SYNC INVERTED INDEX idx1 (message) tokenizer = 'english'"
+_INDEX_CLAUSE_RE = re.compile(r'\b(INVERTED|NGRAM)\s+INDEX\s+`?\w+`?\s*\(([^)]*)\)', re.IGNORECASE)
+# Shortest run an ngram index can prune on; Databend's default gram_size
+NGRAM_SIZE = 3
+# Characters with a meaning in the QUERY() syntax
+_QUERY_SPECIAL_RE = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/])')
+
+
+class Term:
+    def __init__(self, text: str, phrase: bool = False, prefix: bool = False, negated: bool = False):
+        self.text = text
+        self.phrase = phrase
+        self.prefix = prefix
+        self.negated = negated
+
+    def __repr__(self):
+        return f"Term({self.text!r}, phrase={self.phrase}, prefix={self.prefix}, negated={self.negated})"
+
+
+def uses_operators(text: str) -> bool:
+    """Whether a search string is written in the operator syntax rather than as plain text"""
+    text = (text or '').strip()
+    if _OPERATOR_RE.search(text):
+        return True
+    # '-word' next to other words excludes it; on its own, '-503' is text to find
+    words = text.split()
+    return len(words) > 1 and any(word.startswith('-') and len(word) > 1 for word in words)
+
+
+def parse_search(text: str) -> List[List[Term]]:
+    """Parse a search box string into OR-ed groups of AND-ed terms.
+
+    Plain text is a single substring, as it always was. Only input using
+    explicit syntax is parsed: "quoted phrases", prefix*, OR, AND (the default
+    between words), and negation with NOT or a leading '-'.
+    """
+    if not uses_operators(text):
+        text = (text or '').strip()
+        return [[Term(text, phrase=len(text.split()) > 1)]] if text else []
+    groups, current, negate_next = [], [], False
+    for match in _TOKEN_RE.finditer(text or ''):
+        minus, phrase, word = match.groups()
+        if phrase is not None:
+            if phrase.strip():
+                current.append(Term(phrase.strip(), phrase=True, negated=bool(minus) or negate_next))
+            negate_next = False
+            continue
+        if word == 'OR':
+            if current:
+                groups.append(current)
+            current, negate_next = [], False
+            continue
+        if word == 'AND':
+            continue
+        if word == 'NOT':
+            negate_next = True
+            continue
+        negated = negate_next
+        if word.startswith('-') and len(word) > 1:
+            word, negated = word[1:], True
+        prefix = word.endswith('*') and len(word) > 1
+        word = word.rstrip('*')
+        if word:
+            current.append(Term(word, prefix=prefix, negated=negated))
+        negate_next = False
+    if current:
+        groups.append(current)
+    return groups
+
+
+class IndexCatalog:
+    """Which columns of a table have inverted or ngram indexes, read from its SHOW CREATE TABLE.
+
+    Entries are per server, database and table: system.indexes names tables
+    without their database, so equally named tables elsewhere can't be told apart.
+    """
+
+    def __init__(self, ttl: float = INDEX_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}  # (client namespace, database, table) -> (expires_at, {column: index type})
+        self._lock = threading.Lock()
+
+    def index_type(self, db_client, table: str, column: str) -> Optional[str]:
+        key = (db_client.cache_namespace, db_client.database, table)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            entry = (time.monotonic() + self.ttl, self._load(db_client, db_client.database, table))
+            with self._lock:
+                self._entries[key] = entry
+        return entry[1].get(column)
+
+    def _load(self, db_client, database: str, table: str) -> Dict[str, str]:
+        rows, _, error = db_client.execute_query(f"SHOW CREATE TABLE {database}.{table}")
+        if error:
+            print(f"⚠️ Could not read the indexes of {database}.{table}, text search will use LIKE: {error}")
+            return {}
+        indexes = {}
+        for row in rows:
+            for index_type, columns in _INDEX_CLAUSE_RE.findall(' '.join(str(v) for v in row if v)):
+                for column in columns.split(','):
+                    column = column.strip().strip('`"')
+                    # An inverted index beats an ngram index on the same column
+                    if indexes.get(column) != 'INVERTED':
+                        indexes[column] = index_type.upper()
+        print(f"🔎 Text search indexes of {database}.{table}: {indexes or 'none'}")
+        return indexes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+index_catalog = IndexCatalog()
+
+
+def _like(column: str, term: Term, params: List) -> str:
+    params.append(f"%{term.text}%")
+    condition = f"UPPER({column}) LIKE UPPER(?)"
+    return f"NOT {condition}" if term.negated else condition
+
+
+def _caseless_run(text: str) -> str:
+    """Longest run of characters that UPPER() leaves alone (digits, punctuation), without LIKE wildcards"""
+    runs, current = [], ''
+    for ch in text:
+        if ch.lower() == ch.upper() and ch not in '%_':
+            current += ch
+        else:
+            runs.append(current)
+            current = ''
+    runs.append(current)
+    return max(runs, key=len)
+
+
+def _ngram(column: str, term: Term, params: List) -> Optional[str]:
+    """Case-insensitive LIKE with a plain LIKE the ngram index can prune on, or None if there is none.
+
+    Ngram indexes only prune case-sensitive LIKE. Only a run of the term that
+    has no case can be matched that way without changing the results, so the
+    UPPER() LIKE still decides which rows match.
+    """
+    run = _caseless_run(term.text)
+    if term.negated or len(run) < NGRAM_SIZE:
+        return None
+    params.append(f"%{run}%")
+    return f"({column} LIKE ? AND {_like(column, term, params)})"
+
+
+def _query_term(column: str, term: Term) -> str:
+    escaped = _QUERY_SPECIAL_RE.sub(r'\\\1', term.text)
+    return f'{column}:"{escaped}"' if term.phrase else f'{column}:{escaped}'
+
+
+def build_search_condition(text: str, column: str, index_type: Optional[str]) -> Tuple[str, List, str]:
+    """SQL condition, params and search path ('inverted', 'ngram' or 'like', with '+like'
+    when some terms fell back to LIKE) for a search string.
+
+    With an inverted index, positive words and phrases of each group go into
+    one QUERY() call; prefix and negated terms, which it can't prune on, are
+    checked with LIKE next to it. With an ngram index, terms keep the
+    case-insensitive LIKE and add a prefilter where they have a caseless run.
+    """
+    groups = parse_search(text)
+    if not groups:
+        return "", [], 'like'
+
+    params, group_sql, used = [], [], set()
+    for terms in groups:
+        parts = []
+        if index_type == 'INVERTED':
+            indexed = [t for t in terms if not t.negated and not t.prefix]
+            if indexed:
+                params.append(" AND ".join(_query_term(column, t) for t in indexed))
+                parts.append("QUERY(?)")
+                used.add('inverted')
+            for term in terms:
+                if term.negated or term.prefix:
+                    parts.append(_like(column, term, params))
+                    used.add('like')
+        elif index_type == 'NGRAM':
+            for term in terms:
+                pruned = _ngram(column, term, params)
+                parts.append(pruned or _like(column, term, params))
+                used.add('ngram' if pruned else 'like')
+        else:
+            parts = [_like(column, term, params) for term in terms]
+            used.add('like')
+        group_sql.append(" AND ".join(parts))
+
+    condition = group_sql[0] if len(group_sql) == 1 else " OR ".join(f"({g})" for g in group_sql)
+    path = 'inverted' if 'inverted' in used else ('ngram' if 'ngram' in used else 'like')
+    if path in ('inverted', 'ngram') and 'like' in used:
+        path += '+like'
+    return f"({condition})", params, path
+
+
+def resolve_index_type(db_client, table: str, column: str) -> Optional[str]:
+    if SEARCH_MODE == 'like':
+        return None
+    if SEARCH_MODE == 'match':
+        return 'INVERTED'
+    try:
+        return index_catalog.index_type(db_client, table, column)
+    except Exception as e:
+        print(f"⚠️ Index detection failed, text search will use LIKE: {e}")
+        return None
@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+# Sessions unused for this many seconds are dropped, releasing their share of a client
+SESSION_TTL = int(os.environ.get('BENDDASH_SESSION_TTL', 3600))
+# Most sessions held at once; the least recently used one is dropped to make room
+MAX_SESSIONS = int(os.environ.get('BENDDASH_MAX_SESSIONS', 500))
+
+
+def _process_rss_bytes() -> Optional[int]:
+    """Current resident set size, where /proc is available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class ConnectionRegistry:
+    """Per-session Databend connections, sharing one client (and pool) per DSN.
+
+    Clients are reference-counted by the sessions using them and closed when
+    the last one lets go. Sessions expire after ttl seconds without a request,
+    and at most max_sessions are kept, least recently used first out.
+
+    With a shared store, each session is recorded there by id with its status,
+    but never its DSN: a worker that has not seen the session yet reconnects it
+    on first use with the DSN the caller kept (in the signed session cookie).
+    """
+
+    NAMESPACE = 'session'
+
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = MAX_SESSIONS, store=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.store = store
+        self._sessions = OrderedDict()  # session id -> {'dsn', 'status', 'last_used'}, LRU first
+        self._clients = {}  # dsn -> {'resources', 'refs'}
+        self._lock = threading.Lock()
+        self._stats = {'created': 0, 'reused': 0, 'closed': 0, 'expired': 0, 'evicted': 0, 'restored': 0}
+
+    def connect(self, session_id: str, dsn: str, connect: Callable[[str], Dict[str, Any]],
+                status: Dict) -> Dict:
+        """Point a session at dsn, opening a client with connect(dsn) unless one is shared already.
+
+        connect returns the resources to share ('db_client' plus repositories)
+        and raises when the connection can't be established.
+        """
+        with self._lock:
+            shared = self._clients.get(dsn)
+            if shared:
+                shared['refs'] += 1
+                self._stats['reused'] += 1
+        if not shared:
+            resources = connect(dsn)
+            with self._lock:
+                shared = self._clients.get(dsn)
+                if shared:
+                    # Another session connected to the same DSN meanwhile
+                    shared['refs'] += 1
+                    self._stats['reused'] += 1
+                else:
+                    shared = self._clients[dsn] = {'resources': resources, 'refs': 1}
+                    self._stats['created'] += 1
+                    resources = None
+            if resources:
+                resources['db_client'].close()
+        self._store(session_id, {'dsn': dsn, 'status': status})
+        return shared['resources']
+
+    def record_failure(self, session_id: str, status: Dict):
+        """Remember a failed configuration so the session reports it instead of falling back"""
+        self._store(session_id, {'dsn': None, 'status': status})
+
+    def get(self, session_id: str, connect: Callable[[str], Dict[str, Any]] = None,
+            dsn: Optional[str] = None) -> Optional[Dict]:
+        """The session's resources and status, or None when it has no connection of its own.
+
+        Sessions configured in another worker are reconnected here with
+        connect(dsn), dsn being the one the caller kept for the session.
+        """
+        self.expire()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                now = time.monotonic()
+                entry['last_used'] = now
+                self._sessions.move_to_end(session_id)
+                shared = self._clients.get(entry['dsn']) if entry['dsn'] else None
+                result = {'resources': shared['resources'] if shared else {}, 'status': entry['status']}
+                # Keep the shared record alive without writing it on every request
+                touch = self.store is not None and now - entry.get('shared_at', now) > self.ttl / 10
+                if touch:
+                    entry['shared_at'] = now
+        if entry is None:
+            return self._restore(session_id, connect, dsn)
+        if touch:
+            self._share(session_id, entry)
+        return result
+
+    def _restore(self, session_id: str, connect: Callable[[str], Dict[str, Any]],
+                 dsn: Optional[str]) -> Optional[Dict]:
+        if self.store is None or connect is None:
+            return None
+        stored, _ = self.store.get(self.NAMESPACE, session_id)
+        if stored is None:
+            return None
+        record = json.loads(stored)
+        if record['connected']:
+            if not dsn:
+                return None
+            try:
+                resources = self.connect(session_id, dsn, connect, record['status'])
+            except Exception as e:
+                print(f"⚠️ Failed to restore session connection: {e}")
+                return None
+        else:
+            self.record_failure(session_id, record['status'])
+            resources = {}
+        with self._lock:
+            self._stats['restored'] += 1
+        return {'resources': resources, 'status': record['status']}
+
+    def _share(self, session_id: str, entry: Dict):
+        try:
+            record = {'connected': entry['dsn'] is not None, 'status': entry['status']}
+            self.store.set(self.NAMESPACE, session_id, json.dumps(record), self.ttl)
+        except Exception as e:
+            print(f"⚠️ Failed to share session connection: {e}")
+
+    def release(self, session_id: str):
+        with self._lock:
+            closing = self._drop(session_id)
+        if self.store is not None:
+            self.store.delete(self.NAMESPACE, session_id)
+        self._close(closing)
+
+    def expire(self):
+        """Drop sessions idle for longer than the TTL"""
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [sid for sid, entry in self._sessions.items() if entry['last_used'] < cutoff]
+            closing = []
+            for session_id in expired:
+                closing.extend(self._drop(session_id))
+            self._stats['expired'] += len(expired)
+        if expired:
+            print(f"🧹 Expired {len(expired)} idle session connection(s)")
+        self._close(closing)
+
+    def _store(self, session_id: str, entry: Dict):
+        entry['last_used'] = entry['shared_at'] = time.monotonic()
+        if self.store is not None:
+            self._share(session_id, entry)
+        with self._lock:
+            # The previous client is released only now, so reconnecting to the same DSN keeps it open
+            closing = self._drop(session_id)
+            self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                oldest = next(iter(self._sessions))
+                closing.extend(self._drop(oldest))
+                self._stats['evicted'] += 1
+        self._close(closing)
+
+    def _drop(self, session_id: str):
+        """Forget a session; returns the clients nobody uses anymore. Caller holds the lock."""
+        entry = self._sessions.pop(session_id, None)
+        if not entry or not entry['dsn']:
+            return []
+        shared = self._clients.get(entry['dsn'])
+        if not shared:
+            return []
+        shared['refs'] -= 1
+        if shared['refs'] > 0:
+            return []
+        del self._clients[entry['dsn']]
+        self._stats['closed'] += 1
+        return [shared['resources']['db_client']]
+
+    @staticmethod
+    def _close(clients):
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                print(f"⚠️ Failed to close session client: {e}")
+
+    def session_count(self) -> int:
+        return len(self._sessions)
+
+    def client_count(self) -> int:
+        return len(self._clients)
+
+    def stats(self) -> Dict:
+        """Counts and pool totals only; nothing that identifies a session's target"""
+        with self._lock:
+            clients = [(shared['refs'], shared['resources']['db_client']) for shared in self._clients.values()]
+            stats = dict(self._stats, sessions=len(self._sessions), maxSessions=self.max_sessions, ttlSeconds=self.ttl)
+        pools = {'size': 0, 'idle': 0, 'inUse': 0, 'waiting': 0, 'timeouts': 0}
+        for refs, client in clients:
+            pool = client.pool_stats()
+            for key in pools:
+                pools[key] += pool.get(key, 0)
+        stats.update(clients=len(clients), maxSessionsPerClient=max((refs for refs, _ in clients), default=0),
+                     connections=pools.pop('size'), pools=pools, processRssBytes=_process_rss_bytes())
+        return stats
@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# SQLite file shared by the worker processes of one server; unset keeps all state in process
+STATE_FILE = os.environ.get('BENDDASH_STATE_FILE', '')
+# Seconds a process waits for another one holding the write lock
+BUSY_TIMEOUT = 5.0
+# Expired rows are swept after this many writes
+PURGE_EVERY = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS kv_expiry ON kv (namespace, expires_at);
+"""
+
+
+class SharedStore:
+    """Namespaced string values with expiry in a SQLite file, shared across processes.
+
+    Each thread of each process gets its own connection; the file runs in WAL
+    mode so readers never wait for a writer. Values are plain strings (JSON in
+    practice) and expire by wall-clock time, which all processes agree on.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = BUSY_TIMEOUT):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        # Only the server's user may read what the workers share
+        fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+        os.close(fd)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # Connections must not cross a fork, so they are keyed by process too
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace: str, key: str) -> Tuple[Optional[str], Optional[float]]:
+        """The value and its wall-clock expiry, or (None, None) when missing or expired"""
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def set(self, namespace: str, key: str, value: str, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl is not None else None
+        self._conn().execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?, ?, ?)",
+                             (namespace, key, value, len(value), expires_at))
+        self._wrote()
+
+    def add(self, namespace: str, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        """Store value only when the key is absent or expired; True if this call stored it"""
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ? AND expires_at <= ?", (namespace, key, now))
+            added = conn.execute("INSERT OR IGNORE INTO kv VALUES (?, ?, ?, ?, ?)",
+                                 (namespace, key, value, len(value), expires_at)).rowcount == 1
+        self._wrote()
+        return added
+
+    def hold(self, namespace: str, key: str, owner: str, ttl: float) -> bool:
+        """Take or renew a lease for owner; False while another owner holds it"""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ? AND expires_at <= ?", (namespace, key, now))
+            held = conn.execute("INSERT INTO kv VALUES (?, ?, ?, ?, ?) ON CONFLICT (namespace, key) "
+                                "DO UPDATE SET expires_at = excluded.expires_at WHERE value = excluded.value",
+                                (namespace, key, owner, len(owner), now + ttl)).rowcount == 1
+        self._wrote()
+        return held
+
+    def delete(self, namespace: str, key: str):
+        self._conn().execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def scan(self, namespace: str, prefix: str = '') -> List[Tuple[str, str]]:
+        """Unexpired (key, value) pairs of a namespace whose keys start with prefix"""
+        # Range bounds instead of LIKE, so keys need no escaping and the primary key is used
+        return self._conn().execute(
+            "SELECT key, value FROM kv WHERE namespace = ? AND key >= ? AND key < ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, prefix, prefix + '\U0010ffff', time.time())).fetchall()
+
+    def clear(self, namespace: str):
+        self._conn().execute("DELETE FROM kv WHERE namespace = ?", (namespace,))
+
+    def trim(self, namespace: str, max_bytes: int) -> int:
+        """Drop the entries of a namespace that expire soonest until it fits in max_bytes"""
+        conn = self._conn()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM kv WHERE namespace = ?", (namespace,)).fetchone()[0]
+        if total <= max_bytes:
+            return 0
+        dropped = 0
+        for key, size in conn.execute(
+                "SELECT key, size FROM kv WHERE namespace = ? ORDER BY expires_at IS NULL, expires_at",
+                (namespace,)).fetchall():
+            if total <= max_bytes:
+                break
+            conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+            total -= size
+            dropped += 1
+        return dropped
+
+    def purge(self) -> int:
+        """Delete every expired row"""
+        return self._conn().execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def _wrote(self):
+        with self._lock:
+            self._writes += 1
+            due = self._writes % PURGE_EVERY == 0
+        if due:
+            try:
+                self.purge()
+            except sqlite3.OperationalError as e:
+                print(f"⚠️ Failed to purge shared state: {e}")
+
+    def namespace_stats(self, namespace: str) -> Dict[str, int]:
+        entries, size = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM kv WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, time.time())).fetchone()
+        return {'entries': entries, 'bytes': size}
+
+
+def open_store(path: str = STATE_FILE) -> Optional[SharedStore]:
+    """The process's shared store, or None when state stays in process"""
+    if not path:
+        return None
+    print(f"🗄️ Sharing state through {path}")
+    return SharedStore(path)
+
+
+shared_store = open_store()
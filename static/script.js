@@ -3,6 +3,15 @@
 
 // Shared utilities
 class SharedUtils {
+    // Identifies this tab to the server, which cancels a tab's superseded and abandoned queries
+    static tabId = (window.crypto && crypto.randomUUID)
+        ? crypto.randomUUID()
+        : Date.now().toString(36) + Math.random().toString(36).slice(2);
+
+    static tabHeaders(headers = {}) {
+        return { ...headers, 'X-BendDash-Tab': SharedUtils.tabId };
+    }
+
     static copyToClipboard(text, successElement) {
         navigator.clipboard.writeText(text).then(() => {
             if (successElement) {
@@ -189,13 +198,26 @@ class SharedUtils {
     }
 
     // Generate time distribution chart
-    static generateTimeChart(timeDistribution, chartContainerId, chartTitleId, totalRecords, colorMap) {
+    // With onBarClick, clicking a bar zooms into its bucket; with onResetZoom, clicking the title leaves the zoom
+    static generateTimeChart(timeDistribution, chartContainerId, chartTitleId, totalRecords, colorMap, onBarClick = null, zoomWindow = null, onResetZoom = null) {
         const chartContainer = document.getElementById(chartContainerId);
         const chartTitle = document.getElementById(chartTitleId);
         
         if (!chartContainer || !chartTitle) return;
         
-        chartTitle.textContent = `${totalRecords} Results`;
+        if (zoomWindow) {
+            const start = SharedUtils.formatTimestamp(zoomWindow.startTime, false);
+            const end = SharedUtils.formatTimestamp(zoomWindow.endTime, false);
+            chartTitle.textContent = `${totalRecords} Results · ${start} – ${end} ✕`;
+            chartTitle.title = 'Click to reset zoom';
+            chartTitle.style.cursor = 'pointer';
+            chartTitle.onclick = onResetZoom;
+        } else {
+            chartTitle.textContent = `${totalRecords} Results`;
+            chartTitle.title = '';
+            chartTitle.style.cursor = '';
+            chartTitle.onclick = null;
+        }
         chartContainer.innerHTML = '';
         
         if (!timeDistribution || timeDistribution.length === 0) {
@@ -240,9 +262,46 @@ class SharedUtils {
             
             tooltip.innerHTML = tooltipContent;
             barContainer.appendChild(tooltip);
+            if (onBarClick) {
+                barContainer.style.cursor = 'zoom-in';
+                barContainer.addEventListener('click', () => onBarClick(item));
+            }
             chartContainer.appendChild(barContainer);
         });
     }
+
+    // Epoch microseconds back to the server's 'YYYY-MM-DD HH:MM:SS.ffffff' UTC text
+    static formatEpochMicros(us) {
+        if (us === null || us === undefined) return null;
+        const ms = Math.floor(us / 1000);
+        const micros = String(((us % 1000000) + 1000000) % 1000000).padStart(6, '0');
+        return new Date(ms).toISOString().slice(0, 19).replace('T', ' ') + '.' + micros;
+    }
+
+    // Rows of a format=columnar page; plain row arrays pass through unchanged
+    static decodeColumnarPage(page) {
+        if (!page || page.encoding !== 'columnar') return page;
+        const names = Object.keys(page.columns);
+        const timestamps = new Set(page.timestamps || []);
+        const rows = new Array(page.length);
+        for (let i = 0; i < page.length; i++) {
+            rows[i] = {};
+        }
+        names.forEach(name => {
+            const values = page.columns[name];
+            const dictionary = page.dictionaries[name];
+            for (let i = 0; i < page.length; i++) {
+                let value = values[i];
+                if (dictionary) {
+                    value = dictionary[value];
+                } else if (timestamps.has(name)) {
+                    value = SharedUtils.formatEpochMicros(value);
+                }
+                rows[i][name] = value;
+            }
+        });
+        return rows;
+    }
 }
 
 // Universal UI Handler Class
@@ -453,6 +512,12 @@ class BaseObserver {
         this.autoRefreshSeconds = 'off';
         this.autoRefreshInterval = null;
         this.isLoading = false;
+        this.loadController = null; // aborts the load in flight when a newer one starts
+        this.requestSeq = 0;
+        this.lastResponse = null;
+        this.lastEtag = null;
+        this.zoomWindow = null; // {startTime, endTime} when zoomed into part of the time range
+        this.responseWindow = null;
         this.stats = {};
         this.connectionStatus = { connected: false, error: null };
         this.advancedFilters = []; // Array to store key=value filters
@@ -566,6 +631,7 @@ class BaseObserver {
                 // Only load data if the value actually changed from user interaction
                 if (newTimeRange !== previousTimeRange) {
                     this.timeRange = newTimeRange;
+                    this.zoomWindow = null;
                     previousTimeRange = newTimeRange;
                     this.loadData();
                 }
@@ -623,7 +689,12 @@ class BaseObserver {
     }
 
     async loadData() {
-        if (this.isLoading) return;
+        // A newer load replaces the one in flight; the server kills its queries
+        if (this.loadController) {
+            this.loadController.abort();
+        }
+        const controller = new AbortController();
+        this.loadController = controller;
         
         this.data = [];
         this.renderData();
@@ -634,36 +705,87 @@ class BaseObserver {
             originalButtonText: 'Refresh'
         });
 
+        const requestSeq = ++this.requestSeq;
         try {
             const filters = this.buildFilters();
+            // Rows arrive as soon as the page query finishes; slower parts are collected afterwards
+            filters.mode = 'fanout';
+            filters.format = 'columnar';
+            const body = JSON.stringify(filters);
+            const headers = { 'Content-Type': 'application/json' };
+            // Browsers don't revalidate POST responses themselves, so the last result is kept here
+            if (this.lastEtag && this.lastEtag.body === body) {
+                headers['If-None-Match'] = this.lastEtag.etag;
+            }
             const response = await fetch(this.config.apiEndpoint, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(filters)
+                headers: SharedUtils.tabHeaders(headers),
+                body,
+                signal: controller.signal
             });
             
-            if (!response.ok) {
-                throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-            }
+            let data;
+            if (response.status === 304 && this.lastEtag && this.lastEtag.body === body) {
+                data = this.lastEtag.data;
+            } else {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+                }
 
-            const data = await response.json();
-            
-            if (data.error) {
-                throw new Error(data.error);
+                data = await response.json();
+                
+                if (data.error) {
+                    throw new Error(data.error);
+                }
+                
+                data[this.getDataKey()] = SharedUtils.decodeColumnarPage(data[this.getDataKey()]);
+                const etag = response.headers.get('ETag');
+                this.lastEtag = etag ? { body, etag, data } : null;
             }
             
+            this.lastResponse = data;
             this.processLoadedData(data);
+            if (data.pending && data.pending.length > 0 && data.partsToken) {
+                this.collectPendingParts(data.partsToken, requestSeq);
+            }
         } catch (error) {
+            if (error.name === 'AbortError') return;
             console.error('Error loading data:', error);
             this.showError('Failed to load data: ' + error.message);
             this.data = [];
             this.totalRecords = 0;
         } finally {
-            this.isLoading = false;
-            UIHandler.showLoading(false, {
-                loadingOverlayId: this.config.loadingStateId,
-                originalButtonText: 'Refresh'
-            });
+            // Only the latest load clears the loading state
+            if (this.loadController === controller) {
+                this.loadController = null;
+                this.isLoading = false;
+                UIHandler.showLoading(false, {
+                    loadingOverlayId: this.config.loadingStateId,
+                    originalButtonText: 'Refresh'
+                });
+            }
+        }
+    }
+
+    async collectPendingParts(token, requestSeq) {
+        let nextToken = token;
+        while (nextToken) {
+            try {
+                const response = await fetch(`/api/parts/${nextToken}?wait=10`);
+                if (!response.ok) return;
+                const parts = await response.json();
+                // A newer request has replaced the data these parts belong to
+                if (requestSeq !== this.requestSeq) return;
+                if (parts[this.getDataKey()]) {
+                    parts[this.getDataKey()] = SharedUtils.decodeColumnarPage(parts[this.getDataKey()]);
+                }
+                Object.assign(this.lastResponse, parts);
+                this.processLoadedData(this.lastResponse);
+                nextToken = parts.partsToken;
+            } catch (error) {
+                console.error('Error loading pending parts:', error);
+                return;
+            }
         }
     }
 
@@ -674,6 +796,12 @@ class BaseObserver {
             timeRange: this.timeRange
         };
         
+        // Absolute bounds take precedence over timeRange on the server
+        if (this.zoomWindow) {
+            filters.startTime = this.zoomWindow.startTime;
+            filters.endTime = this.zoomWindow.endTime;
+        }
+        
         if (this.selectedLevel !== 'all') {
             filters[this.getFilterKey()] = this.selectedLevel;
         }
@@ -695,6 +823,7 @@ class BaseObserver {
         this.data = data[dataKey] || [];
         this.totalRecords = data.total || 0;
         this.stats = data.stats || {};
+        this.responseWindow = data.window || null;
         this.renderData();
         this.updateStats();
         this.updatePagination();
@@ -704,6 +833,29 @@ class BaseObserver {
         }
     }
 
+    // Narrow the time window to one histogram bucket
+    zoomToBucket(bucket) {
+        const bucketSeconds = this.responseWindow && this.responseWindow.bucketSeconds;
+        if (!bucket.time_bucket || !bucketSeconds) return;
+        const startMs = Date.parse(bucket.time_bucket.slice(0, 19).replace(' ', 'T') + 'Z');
+        if (isNaN(startMs)) return;
+        // A single-second bucket can't be narrowed further
+        if (bucketSeconds <= 1 && this.zoomWindow) return;
+        // Same UTC text as the bucket labels, so the title reads like the bars
+        this.zoomWindow = {
+            startTime: SharedUtils.formatEpochMicros(startMs * 1000),
+            endTime: SharedUtils.formatEpochMicros((startMs + bucketSeconds * 1000) * 1000)
+        };
+        this.currentPage = 1;
+        this.loadData();
+    }
+
+    resetZoom() {
+        this.zoomWindow = null;
+        this.currentPage = 1;
+        this.loadData();
+    }
+
     updatePagination() {
         const totalPages = Math.ceil(this.totalRecords / this.pageSize);
         const pagination = document.getElementById(this.config.paginationElementId);
@@ -928,6 +1080,10 @@ class LogObserver extends BaseObserver {
         
         this.queryIdSearch = '';
         this.logs = this.data; // Alias for backward compatibility
+        this.pageCursors = {}; // Keyset cursors by page number, valid for one filter set
+        this.cursorFilterKey = null;
+        this.liveSource = null; // EventSource of the live tail
+        this.liveFilterKey = null;
         
         this.initialize();
     }
@@ -1072,9 +1228,77 @@ class LogObserver extends BaseObserver {
             delete filters.search; // Don't use regular search when using query ID search
         }
 
+        // Cursors are only valid for the filter set that produced them
+        const { page, ...cursorScope } = filters;
+        const filterKey = JSON.stringify(cursorScope);
+        if (filterKey !== this.cursorFilterKey) {
+            this.cursorFilterKey = filterKey;
+            this.pageCursors = {};
+        }
+        if (this.pageCursors[this.currentPage]) {
+            filters.cursor = this.pageCursors[this.currentPage];
+        }
+
         return filters;
     }
 
+    processLoadedData(data) {
+        if (data.nextCursor) {
+            this.pageCursors[this.currentPage + 1] = data.nextCursor;
+        }
+        super.processLoadedData(data);
+
+        // Follow the new filters when they changed while tailing
+        if (this.autoRefreshSeconds === 'live' && this.liveFilterKey !== this.cursorFilterKey) {
+            this.startLiveTail();
+        }
+    }
+
+    setAutoRefresh(seconds) {
+        this.stopLiveTail();
+        if (seconds === 'live') {
+            super.setAutoRefresh('off');
+            this.autoRefreshSeconds = 'live';
+            this.startLiveTail();
+            return;
+        }
+        super.setAutoRefresh(seconds);
+    }
+
+    startLiveTail() {
+        this.stopLiveTail();
+        const { page, cursor, mode, ...filters } = this.buildFilters();
+        this.liveFilterKey = this.cursorFilterKey;
+        const url = `/api/logs/tail?filters=${encodeURIComponent(JSON.stringify(filters))}`;
+        this.liveSource = new EventSource(url);
+        this.liveSource.addEventListener('logs', (e) => {
+            const payload = JSON.parse(e.data);
+            this.appendLiveLogs(payload.logs || []);
+        });
+        this.liveSource.addEventListener('error', (e) => {
+            // Server-sent errors carry data; connection errors are retried by EventSource
+            if (e.data) {
+                console.error('Live tail error:', JSON.parse(e.data).error);
+            }
+        });
+    }
+
+    stopLiveTail() {
+        if (this.liveSource) {
+            this.liveSource.close();
+            this.liveSource = null;
+        }
+    }
+
+    appendLiveLogs(logs) {
+        // Only the newest page follows the tail
+        if (this.currentPage !== 1 || logs.length === 0) return;
+        this.data = this.data.concat(logs).slice(-this.pageSize);
+        this.totalRecords += logs.length;
+        this.renderData();
+        this.updatePagination();
+    }
+
     isQueryIdFormat(value) {
         if (!value) return false;
         
@@ -1346,7 +1570,10 @@ class LogObserver extends BaseObserver {
             this.config.chartContainerId, 
             this.config.chartTitleId, 
             this.totalRecords, 
-            colorMap
+            colorMap,
+            (bucket) => this.zoomToBucket(bucket),
+            this.zoomWindow,
+            () => this.resetZoom()
         );
     }
 
@@ -1990,7 +2217,10 @@ class QueryObserver extends BaseObserver {
             this.config.chartContainerId, 
             this.config.chartTitleId, 
             this.totalRecords, 
-            colorMap
+            colorMap,
+            (bucket) => this.zoomToBucket(bucket),
+            this.zoomWindow,
+            () => this.resetZoom()
         );
     }
 
@@ -2051,6 +2281,14 @@ class QueryObserver extends BaseObserver {
 }
 
 // Initialize application
+// Closing or navigating away from the tab cancels whatever it still has running
+window.addEventListener('pagehide', () => {
+    if (navigator.sendBeacon) {
+        const payload = new Blob([JSON.stringify({ tabId: SharedUtils.tabId })], { type: 'application/json' });
+        navigator.sendBeacon('/api/cancel', payload);
+    }
+});
+
 document.addEventListener('DOMContentLoaded', function() {
     window.tabManager = new TabManager();
     window.logObserver = new LogObserver();
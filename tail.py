@@ -0,0 +1,135 @@
+import datetime
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional
+
+from histogram import TS_FORMAT, format_ts
+
+# Request threads of this process; `app.py --serve` passes its --threads down to the workers
+REQUEST_THREADS = int(os.environ.get('BENDDASH_THREADS', 16))
+# Live tails and job event streams each hold a request thread for up to 30 minutes. Together they
+# get at most half of the threads by default, and never all of them, so the dashboard keeps answering.
+MAX_STREAMS = max(1, min(int(os.environ.get('BENDDASH_MAX_STREAMS', REQUEST_THREADS // 2)), REQUEST_THREADS - 1))
+_stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+def _parse(ts: str) -> datetime.datetime:
+    if '.' in ts:
+        return datetime.datetime.strptime(ts[:26], TS_FORMAT)
+    return datetime.datetime.strptime(ts[:19], '%Y-%m-%d %H:%M:%S')
+
+
+def parse_since(value: Optional[str]) -> Optional[str]:
+    """Validate a resume position sent by the client; None if unusable"""
+    if not value:
+        return None
+    try:
+        return format_ts(_parse(value))
+    except ValueError:
+        return None
+
+
+def _sse(event: str, data: Dict, event_id: str = None) -> str:
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def limited_stream(events: Iterator[str]) -> Iterator[str]:
+    """Relay a long-lived event stream while it holds one of the MAX_STREAMS slots"""
+    if not _stream_slots.acquire(blocking=False):
+        yield _sse('error', {'error': f'Too many open event streams (max {MAX_STREAMS})'})
+        return
+    try:
+        yield from events
+    finally:
+        _stream_slots.release()
+
+
+class LogTail:
+    """Follows log_history for one client using a timestamp high-water mark.
+
+    Rows can reach log_history a little after their timestamp, so every poll
+    re-reads a short lateness window behind the mark and drops rows already
+    sent. When a poll returns a full batch the stream is behind; it then reads
+    strictly forward from the mark until it has caught up.
+    """
+
+    def __init__(self, log_repo, filters: Dict, since: Optional[str] = None,
+                 poll_interval: float = 2.0, min_interval: float = 1.0, batch_size: int = 500,
+                 lateness_seconds: int = 30, max_seen: int = 20000, max_duration: float = 1800):
+        self.log_repo = log_repo
+        self.filters = filters
+        self.poll_interval = max(poll_interval, min_interval)
+        self.min_interval = min_interval
+        self.batch_size = batch_size
+        self.lateness = datetime.timedelta(seconds=lateness_seconds)
+        self.max_seen = max_seen
+        self.max_duration = max_duration
+
+        start = datetime.datetime.utcnow() - self.lateness
+        self.hwm = since or format_ts(start)
+        # A resumed stream already delivered everything up to the mark
+        self.resume_floor = since
+        self.seen = OrderedDict()  # row key -> timestamp
+        self.catching_up = False
+
+    def _row_key(self, row: Dict) -> tuple:
+        return (row['timestamp'], row.get('query_id'), row.get('node_id'), hash(row.get('message')))
+
+    def _prune_seen(self):
+        cutoff = format_ts(_parse(self.hwm) - self.lateness)
+        while self.seen and (next(iter(self.seen.values())) < cutoff or len(self.seen) > self.max_seen):
+            self.seen.popitem(last=False)
+
+    def poll(self):
+        """One range scan; returns (new rows, error)"""
+        if self.catching_up:
+            since = self.hwm
+            skip = sum(1 for ts in self.seen.values() if ts == self.hwm)
+        else:
+            since = format_ts(_parse(self.hwm) - self.lateness)
+            skip = 0
+
+        rows, error = self.log_repo.get_logs_since(self.filters, since, self.batch_size, skip)
+        if error:
+            return [], error
+
+        fresh = []
+        for row in rows:
+            key = self._row_key(row)
+            if key in self.seen:
+                continue
+            self.seen[key] = row['timestamp']
+            if self.resume_floor and row['timestamp'] <= self.resume_floor:
+                continue
+            fresh.append(row)
+            if row['timestamp'] > self.hwm:
+                self.hwm = row['timestamp']
+        self.catching_up = len(rows) >= self.batch_size
+        self._prune_seen()
+        return fresh, None
+
+    def events(self) -> Iterator[str]:
+        started = time.monotonic()
+        yield _sse('ready', {'since': self.hwm}, self.hwm)
+        while time.monotonic() - started < self.max_duration:
+            tick = time.monotonic()
+            rows, error = self.poll()
+            if error:
+                yield _sse('error', {'error': error})
+            elif rows:
+                yield _sse('logs', {'logs': rows, 'catchingUp': self.catching_up}, self.hwm)
+            else:
+                # Comment line; a failed write tells us the client went away
+                yield ": keepalive\n\n"
+            interval = self.min_interval if self.catching_up else self.poll_interval
+            time.sleep(max(0.0, interval - (time.monotonic() - tick)))
+        # Let the browser reconnect; it resumes from the last event id
+        yield _sse('reconnect', {'since': self.hwm}, self.hwm)
@@ -0,0 +1,206 @@
+import bisect
+import contextvars
+import functools
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, shared by HTTP and database histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+_operation = contextvars.ContextVar('benddash_db_operation', default='other')
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Tuple, *extra: str) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(e for e in extra if e)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self, const: str = '') -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k, const)} {_number(v)}" for k, v in values]
+
+
+class Gauge(_Metric):
+    """Gauge set directly or read from a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        # Unlabelled gauges are exported as 0 before their first update
+        self._values = {} if self.labelnames else {(): 0}
+        self.callback = callback
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self, const: str = '') -> List[str]:
+        if self.callback is not None:
+            try:
+                self.set(self.callback())
+            except Exception as e:
+                print(f"⚠️ Metrics callback for {self.name} failed: {e}")
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k, const)} {_number(v)}" for k, v in values]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [[count per bucket, then +Inf], sum]
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self, const: str = '') -> List[str]:
+        with self._lock:
+            series = sorted((k, (list(counts), total)) for k, (counts, total) in self._series.items())
+        lines = self._header()
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, const, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels, const)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels, const)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Metrics of this process.
+
+    With worker_label, every series carries worker="<pid>": each worker
+    process answers /metrics with its own values, so scrapes of different
+    workers stay apart and are summed in queries.
+    """
+
+    def __init__(self, worker_label: bool = False):
+        self._metrics = []
+        self.worker_label = worker_label
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        # Read at scrape time, since workers are forked after the registry exists
+        const = f'worker="{os.getpid()}"' if self.worker_label else ''
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(const))
+        return "\n".join(lines) + "\n"
+
+
+# Set for --serve, whose gunicorn workers each keep their own registry
+registry = Registry(worker_label=bool(os.environ.get('BENDDASH_STATE_FILE')))
+
+http_request_duration = registry.register(Histogram(
+    'benddash_http_request_duration_seconds', 'Time spent handling HTTP requests.', ('route', 'method')))
+http_requests = registry.register(Counter(
+    'benddash_http_requests_total', 'HTTP requests by route and status code.', ('route', 'method', 'status')))
+db_query_duration = registry.register(Histogram(
+    'benddash_db_query_duration_seconds', 'Databend query latency including connection wait.', ('operation',)))
+db_query_rows = registry.register(Histogram(
+    'benddash_db_query_rows', 'Rows returned per Databend query.', ('operation',), buckets=ROW_BUCKETS))
+db_query_errors = registry.register(Counter(
+    'benddash_db_query_errors_total', 'Failed Databend queries.', ('operation',)))
+db_queries_in_flight = registry.register(Gauge(
+    'benddash_db_queries_in_flight', 'Databend queries currently executing.'))
+db_queries_killed = registry.register(Counter(
+    'benddash_db_queries_killed_total', 'Databend queries killed because their request was superseded or abandoned.', ('reason',)))
+
+
+@contextmanager
+def operation_scope(name: str):
+    """Label the Databend queries issued inside the block"""
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+def db_operation(method: Callable) -> Callable:
+    """Label the Databend queries issued by a repository method as Class.method"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with operation_scope(f"{type(self).__name__}.{method.__name__}"):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def current_operation() -> str:
+    return _operation.get()
+
+
+def observe_db_query(seconds: float, rows: int, error: bool = False):
+    name = _operation.get()
+    db_query_duration.observe(seconds, name)
+    if error:
+        db_query_errors.inc(name)
+    else:
+        db_query_rows.observe(rows, name)
+
+
+def observe_http_request(route: str, method: str, status: int, seconds: float):
+    http_request_duration.observe(seconds, route, method)
+    http_requests.inc(route, method, str(status))
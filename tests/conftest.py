@@ -0,0 +1,27 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# Modules live at the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+# database.py imports databend_driver; the benchmarks' SQLite stand-in serves the tests too
+import fake_databend  # noqa: E402
+import synthetic  # noqa: E402
+
+if 'databend_driver' not in sys.modules:
+    fake_databend.install()
+
+
+@pytest.fixture
+def history_db(tmp_path):
+    """Empty log_history and query_history tables; returns (dsn, sqlite connection to fill them)"""
+    path = str(tmp_path / 'history.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(synthetic.SCHEMA)
+    yield fake_databend.dsn_for(path), conn
+    conn.close()
@@ -0,0 +1,46 @@
+import threading
+import time
+
+import pytest
+
+from cache import ResultCache
+
+
+def test_loader_exception_reaches_waiting_callers():
+    cache = ResultCache()
+    started = threading.Event()
+    release = threading.Event()
+    outcomes = {}
+
+    def failing_loader():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('connection lost')
+
+    def call(name, loader):
+        try:
+            outcomes[name] = cache.get_or_load('key', loader)
+        except RuntimeError as e:
+            outcomes[name] = e
+
+    owner = threading.Thread(target=call, args=('owner', failing_loader))
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(target=call, args=('waiter', lambda: ({'rows': []}, True)))
+    waiter.start()
+    # Let the waiter attach to the in-flight load before it fails
+    time.sleep(0.1)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert isinstance(outcomes['owner'], RuntimeError)
+    assert isinstance(outcomes['waiter'], RuntimeError)
+    assert cache.get('key') is None
+
+
+def test_failed_load_is_not_stored():
+    cache = ResultCache()
+    with pytest.raises(RuntimeError):
+        cache.get_or_load('key', lambda: (_ for _ in ()).throw(RuntimeError('boom')))
+    assert cache.get_or_load('key', lambda: ({'rows': [1]}, True)) == {'rows': [1]}
@@ -0,0 +1,80 @@
+import threading
+
+import cancellation
+from cache import ResultCache
+
+
+class FakeClient:
+    """Stands in for DatabendClient: statements block until kill_tagged() kills them"""
+
+    def __init__(self):
+        self.killed = threading.Event()
+
+    def kill_tagged(self, request_id):
+        self.killed.set()
+        return 1
+
+
+def test_superseded_owner_load_is_retried_by_waiting_channel():
+    cache = ResultCache()
+    db = FakeClient()
+    owner_started = threading.Event()
+    outcomes = {}
+
+    def killable_loader():
+        # Like _get_logs_combined: a killed statement becomes an error result that is not cached
+        token = cancellation.query_tracker.start(db)
+        try:
+            owner_started.set()
+            db.killed.wait(5)
+            return {'error': 'query killed', 'logs': []}, False
+        finally:
+            cancellation.query_tracker.finish(token)
+
+    def first_tab():
+        cancellation.begin_request('session-a', 'tab-a', '/api/logs', b'{"timeRange": "1h"}')
+        outcomes['a'] = cache.get_or_load('logs-1h', killable_loader)
+
+    def second_tab():
+        cancellation.begin_request('session-b', 'tab-b', '/api/logs', b'{"timeRange": "1h"}')
+        outcomes['b'] = cache.get_or_load('logs-1h', lambda: ({'logs': [{'message': 'hello'}]}, True))
+
+    a = threading.Thread(target=first_tab)
+    a.start()
+    owner_started.wait(5)
+    b = threading.Thread(target=second_tab)
+    b.start()
+    # Wait until the second tab is coalesced onto the first tab's load
+    for _ in range(500):
+        if cache.hits:
+            break
+        threading.Event().wait(0.01)
+    assert cache.hits == 1
+
+    # The first tab switches to different filters, which kills its running load
+    cancellation.begin_request('session-a', 'tab-a', '/api/logs', b'{"timeRange": "24h"}')
+    a.join(5)
+    b.join(5)
+
+    assert outcomes['a'] == {'error': 'query killed', 'logs': []}
+    assert outcomes['b'] == {'logs': [{'message': 'hello'}]}
+    assert cache.retries == 1
+    assert cache.get('logs-1h') == {'logs': [{'message': 'hello'}]}
+
+
+def test_failed_load_of_live_request_is_shared():
+    cache = ResultCache()
+    cancellation.begin_request('session-c', 'tab-c', '/api/logs', b'{}')
+    result = cache.get_or_load('broken', lambda: ({'error': 'syntax error', 'logs': []}, False))
+    assert result == {'error': 'syntax error', 'logs': []}
+    assert cache.retries == 0
+    cancellation.end_request()
+
+
+def test_only_queries_get_an_execution_time_limit():
+    context = cancellation.QueryContext('request-1', 'session', None, 'sig', 30)
+    assert cancellation.tag_query('\n  select 1', context) == (
+        "/* benddash-request:request-1 session:session */ SETTINGS (max_execution_time = 30) select 1")
+    assert 'SETTINGS' in cancellation.tag_query('WITH t AS (SELECT 1) SELECT * FROM t', context)
+    assert cancellation.tag_query("KILL QUERY 'q1'", context) == (
+        "/* benddash-request:request-1 session:session */ KILL QUERY 'q1'")
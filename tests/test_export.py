@@ -0,0 +1,26 @@
+import io
+
+import pytest
+
+from database import DatabendClient, LogRepository
+from export import stream_export
+
+
+def test_empty_csv_exports_have_a_header():
+    body = b''.join(stream_export(iter([(['timestamp', 'message'], [])]), 'csv')).decode()
+    assert body.splitlines() == ['timestamp,message']
+
+
+def test_empty_log_exports_keep_the_csv_header(history_db):
+    dsn, _ = history_db
+    repo = LogRepository(DatabendClient(dsn))
+    body = b''.join(stream_export(repo.export_logs({'timeRange': '1h'}, 10), 'csv')).decode()
+    assert body.splitlines() == ['timestamp,query_id,log_level,target,message,path,cluster_id,node_id,warehouse_id,fields']
+
+
+def test_empty_parquet_exports_have_a_schema():
+    pq = pytest.importorskip('pyarrow.parquet')
+    body = b''.join(stream_export(iter([(['timestamp', 'message'], [])]), 'parquet'))
+    table = pq.read_table(io.BytesIO(body))
+    assert table.num_rows == 0
+    assert table.column_names == ['timestamp', 'message']
@@ -0,0 +1,26 @@
+import threading
+
+from fanout import FanoutExecutor
+
+
+def test_slow_parts_are_collected_with_the_token():
+    executor = FanoutExecutor(max_workers=4)
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return {'count': 42}
+
+    def failing():
+        raise RuntimeError('stats scan failed')
+
+    done, pending, token = executor.run({'logs': lambda: {'logs': [1]}, 'count': slow, 'stats': failing},
+                                        timeouts={'count': 0.05, 'stats': 1})
+    assert done == {'logs': [1], 'failedParts': ['stats']}
+    assert pending == ['count'] and token
+
+    release.set()
+    assert executor.collect(token, timeout=5) == ({'count': 42}, [], None)
+    # A token is answered once
+    assert executor.collect(token) is None
+
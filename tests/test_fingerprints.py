@@ -0,0 +1,48 @@
+import datetime
+
+from cache import ResultCache
+from database import DatabendClient, QueryRepository
+from histogram import format_ts
+
+
+def add_query(conn, start, text, duration_ms, parameterized_hash='', exception_code=0):
+    ts = format_ts(start)
+    conn.execute("INSERT INTO query_history VALUES (?, 'QueryEnd', ?, ?, ?, ?, ?, '', 'root', 'default', 'Query', "
+                 "0, 0, 0, 100, '10.0.0.1', ?, 0, 0, 0)",
+                 [f'q-{text}-{duration_ms}', text, ts, ts, duration_ms, exception_code, parameterized_hash])
+
+
+def test_queries_differing_in_literals_share_a_fingerprint(history_db):
+    dsn, conn = history_db
+    start = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
+    for i, duration in enumerate((10, 20, 30, 40)):
+        add_query(conn, start, f"SELECT * FROM orders WHERE id = {i} AND region = 'r{i}'", duration,
+                  exception_code=1006 if i == 3 else 0)
+    add_query(conn, start, 'INSERT INTO metrics VALUES (1)', 500, parameterized_hash='00000000000000a1')
+    add_query(conn, start, 'INSERT INTO metrics VALUES (2)', 300, parameterized_hash='00000000000000a1')
+    conn.commit()
+
+    repo = QueryRepository(DatabendClient(dsn), cache=ResultCache())
+    result = repo.get_query_fingerprints({'timeRange': '1h', 'nocache': True})
+
+    assert result['totalFingerprints'] == 2
+    assert result['totalMs'] == 900
+    inserts, selects = result['fingerprints']
+    assert inserts['fingerprint'] == '00000000000000a1'
+    assert (inserts['calls'], inserts['totalMs'], inserts['maxMs']) == (2, 800, 500)
+    assert selects['fingerprint'] == 'SELECT * FROM orders WHERE id = ? AND region = ?'
+    assert (selects['calls'], selects['p50Ms'], selects['errorRate']) == (4, 25.0, 25.0)
+
+
+def test_sort_by_calls(history_db):
+    dsn, conn = history_db
+    start = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
+    add_query(conn, start, 'SELECT 1', 1000)
+    for duration in (1, 2, 3):
+        add_query(conn, start, 'SELECT now()', duration)
+    conn.commit()
+
+    repo = QueryRepository(DatabendClient(dsn), cache=ResultCache())
+    result = repo.get_query_fingerprints({'timeRange': '1h', 'sort': 'calls', 'nocache': True})
+
+    assert [f['calls'] for f in result['fingerprints']] == [3, 1]
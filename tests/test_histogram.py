@@ -0,0 +1,47 @@
+import datetime
+
+from database import resolve_time_window
+from histogram import IncrementalHistogram
+
+
+class RecordingFetch:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def __call__(self, condition, params):
+        self.calls.append((condition, params))
+        return self.rows
+
+
+def test_window_end_bounds_every_scan():
+    cache = IncrementalHistogram(settle_seconds=0)
+    now = datetime.datetime(2024, 1, 1, 12, 0, 30)
+    start, end = datetime.datetime(2024, 1, 1, 11), datetime.datetime(2024, 1, 1, 12, 1)
+    fetch = RecordingFetch([('2024-01-01 11:00:00.000000', 'INFO', 3)])
+
+    cache.get('key', start, 60, fetch, now=now, window_end=end)
+    cache.get('key', start, 60, fetch, now=now, window_end=end)
+
+    assert [c for c, _ in fetch.calls] == ["{time_field} >= ? AND {time_field} < ?",
+                                           "(({time_field} >= ? AND {time_field} < ?) OR {time_field} >= ?) "
+                                           "AND {time_field} < ?"]
+    assert all(p[-1] == '2024-01-01 12:01:00.000000' for _, p in fetch.calls)
+
+
+def test_closed_buckets_are_served_from_memory():
+    cache = IncrementalHistogram(settle_seconds=0)
+    start = datetime.datetime(2024, 1, 1, 11)
+    cache.get('key', start, 60, RecordingFetch([('2024-01-01 11:00:00.000000', 'INFO', 3)]),
+              now=datetime.datetime(2024, 1, 1, 12))
+    rows = cache.get('key', start, 60, RecordingFetch([('2024-01-01 12:00:00.000000', 'INFO', 1)]),
+                     now=datetime.datetime(2024, 1, 1, 12, 0, 30))
+
+    assert rows == [('2024-01-01 11:00:00.000000', 'INFO', 3), ('2024-01-01 12:00:00.000000', 'INFO', 1)]
+    assert cache.stats() == {'series': 1, 'fullScans': 1, 'tailScans': 1}
+
+
+def test_relative_windows_cover_the_whole_range():
+    resolved = resolve_time_window({'timeRange': '1h'}, now=datetime.datetime(2024, 1, 1, 12, 0, 30))
+    assert resolved['startTime'] == '2024-01-01 11:00:00.000000'
+    assert resolved['endTime'] == '2024-01-01 12:01:00.000000'
@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from cancellation import query_tracker
+from jobs import JobLimitExceeded, JobManager
+
+
+class BlockingClient:
+    """Stands in for DatabendClient: a statement runs until it is killed or released"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.killed = threading.Event()
+
+    def query(self):
+        token = query_tracker.start(self)
+        try:
+            self.started.set()
+            while not (self.release.is_set() or self.killed.is_set()):
+                self.release.wait(0.01)
+            if self.killed.is_set():
+                return {'error': 'Query was killed'}
+            return {'rows': [1, 2, 3]}
+        finally:
+            query_tracker.finish(token)
+
+    def kill_tagged(self, request_id):
+        self.killed.set()
+        return 1
+
+    def tagged_progress(self, request_id):
+        return {'runningStatements': 1, 'rowsScanned': 10, 'bytesScanned': 100}
+
+
+def test_job_runs_to_done_and_is_reused():
+    manager = JobManager(max_workers=2)
+    db = BlockingClient()
+    job, reused = manager.submit('session', 'logs', 'target', {'level': 'error'}, db, db.query)
+    assert not reused
+    db.started.wait(5)
+    assert manager.get(job.id, 'session').status == 'running'
+
+    db.release.set()
+    job.future.result(5)
+    assert manager.get(job.id, 'session').to_dict(include_result=True)['result'] == {'rows': [1, 2, 3]}
+    assert manager.submit('session', 'logs', 'target', {'level': 'error'}, db, db.query) == (job, True)
+    # Jobs belong to their session
+    assert manager.get(job.id, 'other-session') is None
+
+
+def test_cancel_kills_the_running_statement():
+    manager = JobManager(max_workers=1)
+    db = BlockingClient()
+    job, _ = manager.submit('session', 'logs', 'target', {}, db, db.query)
+    db.started.wait(5)
+
+    assert manager.cancel(job.id, 'session').status == 'cancelled'
+    assert db.killed.wait(5)
+    job.future.result(5)
+    assert job.status == 'cancelled' and job.result is None
+    assert manager.stats()['cancelled'] == 1
+
+
+def test_queued_job_is_cancelled_before_it_starts():
+    manager = JobManager(max_workers=1, max_per_user=5)
+    db = BlockingClient()
+    manager.submit('session', 'logs', 'target', {'n': 1}, db, db.query)
+    db.started.wait(5)
+    queued, _ = manager.submit('session', 'logs', 'target', {'n': 2}, db, lambda: {'rows': []})
+
+    manager.cancel(queued.id, 'session')
+    db.release.set()
+    assert queued.future.cancelled()
+    assert queued.started_at is None
+
+
+def test_unfinished_jobs_per_session_are_limited():
+    manager = JobManager(max_workers=1, max_per_user=1)
+    db = BlockingClient()
+    manager.submit('session', 'logs', 'target', {'n': 1}, db, db.query)
+    with pytest.raises(JobLimitExceeded):
+        manager.submit('session', 'logs', 'target', {'n': 2}, db, db.query)
+    # Other sessions are not affected
+    manager.submit('other-session', 'logs', 'target', {'n': 2}, db, lambda: {'rows': []})
+    db.release.set()
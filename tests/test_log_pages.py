@@ -0,0 +1,62 @@
+import datetime
+
+import pytest
+
+pytest.importorskip('databend_driver')
+
+from cache import ResultCache  # noqa: E402
+from database import DatabendClient, LogRepository  # noqa: E402
+from histogram import format_ts  # noqa: E402
+
+
+def _log(ts, message):
+    return {'timestamp': ts, 'message': message}
+
+
+def test_cursors_round_trip():
+    repo = LogRepository(None)
+    cursor = repo._encode_cursor('2024-01-01 12:00:00.000000', 2)
+    assert repo._decode_cursor(cursor) == {'ts': '2024-01-01 12:00:00.000000', 'skip': 2}
+
+
+def test_invalid_cursors_fall_back_to_page_numbers():
+    repo = LogRepository(None)
+    assert repo._decode_cursor('not a cursor') is None
+    assert repo._decode_cursor(None) is None
+
+
+def test_next_cursor_counts_rows_tied_on_the_oldest_timestamp():
+    repo = LogRepository(None)
+    logs = [_log('12:03', 'a'), _log('12:02', 'b'), _log('12:02', 'c')]
+    cursor = repo._decode_cursor(repo._next_cursor(logs, 3, None))
+    assert cursor == {'ts': '12:02', 'skip': 2}
+
+    # A run of equal timestamps that began on an earlier page keeps counting
+    logs = [_log('12:02', 'd'), _log('12:02', 'e'), _log('12:02', 'f')]
+    assert repo._decode_cursor(repo._next_cursor(logs, 3, cursor)) == {'ts': '12:02', 'skip': 5}
+
+    assert repo._next_cursor(logs[:2], 3, cursor) is None
+
+
+def test_cursor_pages_cover_equal_timestamps_exactly_once(history_db):
+    dsn, conn = history_db
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    rows = []
+    for i in range(11):
+        # Runs of three rows share a timestamp, so page boundaries fall inside them
+        ts = format_ts(now - datetime.timedelta(minutes=i // 3 + 1))
+        rows.append((ts, f'q{i:02d}', 'INFO', 't', f'message {i}', 'p', 'c', f'node-{i % 2}', 'wh', '{}'))
+    conn.executemany("INSERT INTO log_history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+
+    repo = LogRepository(DatabendClient(dsn), cache=ResultCache())
+    seen, cursor = [], None
+    for _ in range(10):
+        result = repo.get_logs({'timeRange': '1h', 'pageSize': 4, 'cursor': cursor, 'nocache': True})
+        seen.extend(log['message'] for log in result['logs'])
+        cursor = result.get('nextCursor')
+        if not cursor:
+            break
+
+    assert sorted(seen) == sorted(r[4] for r in rows)
+    assert len(seen) == len(set(seen))
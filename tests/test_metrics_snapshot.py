@@ -0,0 +1,33 @@
+from metrics_snapshot import MetricsSnapshot
+
+
+class UnreachableClient:
+    database = 'system_history'
+
+    def execute_query(self, query, params=None):
+        return [], [], 'log_history is unreachable'
+
+
+def test_first_refresh_failure_serves_zeros_with_error():
+    snapshot = MetricsSnapshot(UnreachableClient(), interval=3600)
+    value = snapshot.get()
+    assert value['totalLogs'] == 0
+    assert value['errorRate'] == 0.0
+    assert snapshot.freshness()['X-Metrics-Stale'] == 'true'
+    assert 'unreachable' in value['refreshError']
+
+
+class CountingClient:
+    database = 'system_history'
+
+    def execute_query(self, query, params=None):
+        if 'DISTINCT' in query:
+            return [(3,)], [], None
+        return [('2024-01-01 00:00:00.000000', 10, 1)], [], None
+
+
+def test_repeated_reads_return_identical_bodies():
+    snapshot = MetricsSnapshot(CountingClient(), interval=3600)
+    first = snapshot.get()
+    assert first == snapshot.get()
+    assert 'Age' in snapshot.freshness()
@@ -0,0 +1,60 @@
+import datetime
+
+from histogram import format_ts
+from patterns import PatternCache, PatternMiner, mask_message
+
+START = datetime.datetime(2024, 1, 1, 10)
+
+
+def rows_between(rows, start, end):
+    return [r for r in rows if start <= r[0] < end]
+
+
+def test_variable_parts_are_masked():
+    assert mask_message('fetched 1200 rows from 10.0.0.7:8080 in /var/lib/databend/cache') == \
+        ['fetched', '<NUM>', 'rows', 'from', '<IP>', 'in', '<PATH>']
+
+
+def test_similar_messages_share_one_template():
+    miner = PatternMiner(step=60)
+    first = miner.match('job finished on worker alpha with status ok')
+    second = miner.match('job finished on worker beta with status ok')
+    other = miner.match('connection refused by peer')
+
+    assert first is second
+    assert first.tokens == ['job', 'finished', 'on', 'worker', '<*>', 'with', 'status', 'ok']
+    assert other is not first
+
+
+def test_refresh_only_streams_rows_after_the_mined_range():
+    rows = [(format_ts(START + datetime.timedelta(minutes=i)), f'q{i}', f'retry attempt {i} after timeout')
+            for i in range(30)]
+    streamed = []
+
+    def stream(start, end, limit):
+        streamed.append((start, end))
+        return rows_between(rows, start, end)[:limit]
+
+    cache = PatternCache(settle_seconds=0)
+    end = START + datetime.timedelta(minutes=20)
+    first = cache.get('key', START, end, 60, stream, limit=10, now=end)
+    later = START + datetime.timedelta(minutes=30)
+    second = cache.get('key', START, later, 60, stream, limit=10, now=later)
+
+    assert first['patterns'][0]['template'] == 'retry attempt <NUM> after timeout'
+    assert first['patterns'][0]['count'] == 20
+    assert second['patterns'][0]['count'] == 30
+    assert second['minedRows'] == 10
+    assert streamed[-1] == (format_ts(end), format_ts(later))
+
+
+def test_row_budget_marks_the_result_truncated():
+    rows = [(format_ts(START + datetime.timedelta(seconds=i)), None, f'message {i}') for i in range(50)]
+    cache = PatternCache(settle_seconds=0)
+    end = START + datetime.timedelta(minutes=1)
+    result = cache.get('key', START, end, 60, lambda s, e, limit: rows_between(rows, s, e)[:limit],
+                       limit=10, max_rows=20, now=end)
+
+    assert result['truncated'] is True
+    # The incomplete range was not kept, so nothing is served from memory next time
+    assert cache.get('key', START, end, 60, lambda s, e, limit: [], limit=10, now=end)['totalRows'] == 0
@@ -0,0 +1,58 @@
+import pytest
+
+from pool import ConnectionPool
+
+
+class FakeCursor:
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.closed = False
+
+    def execute(self, query, params=None):
+        if not self.alive:
+            raise RuntimeError('Transport error: connection reset by peer')
+        if 'bad' in query:
+            raise RuntimeError("QueryFailed: [1025] Unknown table 'bad'")
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool():
+    cursors = []
+
+    def factory():
+        cursors.append(FakeCursor())
+        return cursors[-1]
+    return ConnectionPool(factory, min_size=1, max_size=2), cursors
+
+
+def test_statement_error_keeps_the_connection():
+    pool, cursors = make_pool()
+    with pytest.raises(RuntimeError):
+        with pool.connection() as cursor:
+            cursor.execute('SELECT * FROM bad')
+    stats = pool.stats()
+    assert stats['discarded'] == 0
+    assert stats['statementErrors'] == 1
+    assert stats['idle'] == 1
+    assert not cursors[0].closed
+    with pool.connection() as cursor:
+        assert cursor is cursors[0]
+    pool.close()
+
+
+def test_connection_error_discards_the_connection():
+    pool, cursors = make_pool()
+    with pytest.raises(RuntimeError):
+        with pool.connection() as cursor:
+            cursor.alive = False
+            cursor.execute('SELECT 1')
+    stats = pool.stats()
+    assert stats['discarded'] == 1
+    assert stats['size'] == 0
+    assert cursors[0].closed
+    pool.close()
@@ -0,0 +1,67 @@
+import datetime
+
+import rollup
+from rollup import RollupAggregator, release_rollup, rollup_for
+
+
+class FakeClient:
+    """Answers rollup scans from a fixed set of log_history rows"""
+    database = 'system_history'
+    cache_namespace = 'root@localhost:8000'
+
+    def __init__(self, log_rows=()):
+        self.log_rows = list(log_rows)
+        self.closed = False
+        self.queries = 0
+
+    def execute_query(self, query, params=None):
+        self.queries += 1
+        if 'log_history' in query:
+            return [r for r in self.log_rows if params[0] <= r[0] < params[1]], [], None
+        return [], [], None
+
+
+def test_settled_minutes_are_rolled_up_into_chart_buckets():
+    now = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    rows = [('2024-01-01 11:00:00.000000', 'INFO', 'n1', 'w1', 5),
+            ('2024-01-01 11:01:00.000000', 'ERROR', 'n1', 'w1', 2),
+            ('2024-01-01 11:59:00.000000', 'INFO', 'n1', 'w1', 7)]
+    aggregator = RollupAggregator(FakeClient(rows))
+    aggregator.refresh(now)
+
+    # The 11:59 minute is still settling, so the watermark stops before it
+    assert aggregator.watermarks['log'] == datetime.datetime(2024, 1, 1, 11, 58)
+    buckets = aggregator.log_buckets(datetime.datetime(2024, 1, 1, 11), datetime.datetime(2024, 1, 1, 12), 3600)
+    assert sorted(buckets) == [('2024-01-01 11:00:00.000000', 'ERROR', 2), ('2024-01-01 11:00:00.000000', 'INFO', 5)]
+
+
+def test_coverage_starts_at_the_first_whole_bucket():
+    aggregator = RollupAggregator(FakeClient())
+    aggregator.refresh(datetime.datetime(2024, 1, 1, 12, 0, 0))
+    start, end = aggregator.coverage('log', datetime.datetime(2024, 1, 1, 9, 30), 3600)
+    assert start == datetime.datetime(2024, 1, 1, 10)
+    assert end == datetime.datetime(2024, 1, 1, 11)
+
+
+def test_closing_the_client_stops_and_drops_its_aggregator(monkeypatch):
+    monkeypatch.setattr(rollup, 'ROLLUP_ENABLED', True)
+    client = FakeClient()
+    aggregator = rollup_for(client)
+    release_rollup(client)
+    aggregator._thread.join(5)
+
+    assert not aggregator._thread.is_alive()
+    assert rollup_for(client) is not aggregator
+    release_rollup(client)
+
+
+def test_idle_aggregator_stops_itself(monkeypatch):
+    monkeypatch.setattr(rollup, 'ROLLUP_ENABLED', True)
+    client = FakeClient()
+    aggregator = RollupAggregator(client, interval=0.05, idle_timeout=0.1)
+    monkeypatch.setitem(rollup._aggregators, (client.cache_namespace, client.database), aggregator)
+    aggregator.start()
+    aggregator._thread.join(5)
+
+    assert not aggregator._thread.is_alive()
+    assert 'root@localhost:8000/system_history' not in rollup.rollup_stats()
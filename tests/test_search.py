@@ -0,0 +1,56 @@
+from search import IndexCatalog, build_search_condition, parse_search
+
+
+def test_ngram_search_stays_case_insensitive():
+    condition, params, path = build_search_condition('timeout', 'message', 'NGRAM')
+    assert condition == "(UPPER(message) LIKE UPPER(?))"
+    assert params == ['%timeout%']
+    assert path == 'like'
+
+
+def test_ngram_prefilter_is_anded_with_case_insensitive_like():
+    condition, params, path = build_search_condition('"HTTP-503" timeout', 'message', 'NGRAM')
+    assert condition == "((message LIKE ? AND UPPER(message) LIKE UPPER(?)) AND UPPER(message) LIKE UPPER(?))"
+    assert params == ['%-503%', '%HTTP-503%', '%timeout%']
+    assert path == 'ngram+like'
+
+
+def test_plain_text_stays_one_substring():
+    for text in ('connection reset by peer', '-503', '-timeout', 'select 1 OR', 'SELECT * FROM t'):
+        condition, params, path = build_search_condition(text, 'message', None)
+        assert condition == "(UPPER(message) LIKE UPPER(?))"
+        assert params == [f'%{text}%']
+
+
+def test_explicit_syntax_is_parsed():
+    assert [[t.text for t in group] for group in parse_search('timeout OR refused')] == [['timeout'], ['refused']]
+    terms = parse_search('"connection reset" -retry time*')[0]
+    assert [(t.text, t.phrase, t.negated, t.prefix) for t in terms] == [
+        ('connection reset', True, False, False), ('retry', False, True, False), ('time', False, False, True)]
+
+
+class ShowCreateClient:
+    cache_namespace = 'root@localhost:8000'
+
+    def __init__(self, database, ddl):
+        self.database = database
+        self.ddl = ddl
+        self.queries = []
+
+    def execute_query(self, query, params=None):
+        self.queries.append(query)
+        table = query.split()[-1]
+        return [(table, self.ddl.get(table, ''))], ['Table', 'Create Table'], None
+
+
+def test_index_catalog_is_keyed_by_database_and_table():
+    catalog = IndexCatalog()
+    ddl = {
+        'system_history.log_history': "CREATE TABLE log_history (message VARCHAR) "
+                                      "NGRAM INDEX idx1 (message) gram_size = 3",
+        'other.log_history': "CREATE TABLE log_history (message VARCHAR) "
+                             "SYNC INVERTED INDEX idx2 (message) tokenizer = 'english'",
+    }
+    assert catalog.index_type(ShowCreateClient('system_history', ddl), 'log_history', 'message') == 'NGRAM'
+    assert catalog.index_type(ShowCreateClient('other', ddl), 'log_history', 'message') == 'INVERTED'
+    assert catalog.index_type(ShowCreateClient('other', ddl), 'query_history', 'query_text') is None
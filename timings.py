@@ -0,0 +1,140 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Number of recent request breakdowns kept for /api/debug/timings
+TIMINGS_BUFFER_SIZE = int(os.environ.get('BENDDASH_TIMINGS_BUFFER', 200))
+
+_current = contextvars.ContextVar('benddash_request_timings', default=None)
+
+
+class RequestTimings:
+    """Accumulated phase durations of one HTTP request.
+
+    Phases may run on fan-out worker threads at the same time, so their
+    durations can add up to more than the request total.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.phases = {}  # name -> [total seconds, count]
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            entry = self.phases.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def server_timing(self, total: float) -> str:
+        """Value of the Server-Timing response header"""
+        with self._lock:
+            items = [f"{name};dur={seconds * 1000:.1f}" + (f';desc="x{count}"' if count > 1 else '')
+                     for name, (seconds, count) in self.phases.items()]
+        items.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(items)
+
+    def to_dict(self, status: int, total: float) -> Dict:
+        with self._lock:
+            phases = {name: {'ms': round(seconds * 1000, 2), 'count': count}
+                      for name, (seconds, count) in self.phases.items()}
+        return {
+            'method': self.method,
+            'path': self.path,
+            'status': status,
+            'startedAt': self.started_at,
+            'totalMs': round(total * 1000, 2),
+            'phases': phases
+        }
+
+
+def begin_request(method: str, path: str) -> RequestTimings:
+    timings = RequestTimings(method, path)
+    _current.set(timings)
+    return timings
+
+
+def end_request():
+    _current.set(None)
+
+
+def current() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+def record(name: str, seconds: float):
+    """Add a measured duration to the current request, if any"""
+    timings = _current.get()
+    if timings is not None:
+        timings.record(name, seconds)
+
+
+@contextmanager
+def phase(name: str):
+    """Time a block as one phase of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+class TimingsBuffer:
+    """Ring buffer of finished request breakdowns"""
+
+    def __init__(self, size: int = TIMINGS_BUFFER_SIZE):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, entry: Dict):
+        with self._lock:
+            self._entries.append(entry)
+
+    def recent(self, path: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        with self._lock:
+            entries = list(self._entries)
+        if path:
+            entries = [e for e in entries if e['path'] == path]
+        return list(reversed(entries[-limit:])) if limit > 0 else []
+
+    def summary(self, path: Optional[str] = None) -> Dict[str, Dict]:
+        """Per-path request count, p50/p95 total and mean time per phase"""
+        with self._lock:
+            entries = list(self._entries)
+        by_path = {}
+        for entry in entries:
+            if path and entry['path'] != path:
+                continue
+            by_path.setdefault(entry['path'], []).append(entry)
+
+        summary = {}
+        for entry_path, items in by_path.items():
+            totals = sorted(e['totalMs'] for e in items)
+            phase_totals = {}
+            for e in items:
+                for name, p in e['phases'].items():
+                    phase_totals[name] = phase_totals.get(name, 0.0) + p['ms']
+            summary[entry_path] = {
+                'requests': len(items),
+                'p50Ms': totals[len(totals) // 2],
+                'p95Ms': totals[min(len(totals) - 1, int(len(totals) * 0.95))],
+                'avgPhaseMs': {name: round(ms / len(items), 2) for name, ms in phase_totals.items()}
+            }
+        return summary
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+timings_buffer = TimingsBuffer()